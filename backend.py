@@ -0,0 +1,506 @@
+"""
+    backend.py  -  fit backends for the pyXIFU error engine
+    ---------------------------------------------------------------------------------
+    Author: V. Fioretti (INAF/OAS) valentina.fioretti@inaf.it
+    ---------------------------------------------------------------------------------
+    Dependencies:
+    - python 2.7
+    - numpy
+    - scipy
+    - pyXSPEC running on Python 2.7 (XspecBackend only)
+    ---------------------------------------------------------------------------------
+    The error engine of pyXIFU only talks to the fit session through a backend:
+    - XspecBackend drives the global pyXSPEC objects (AllModels(1), Fit, Xset).
+    - LocalBackend fits a power law plus Gaussian lines to a binned spectrum with
+      the Poisson cstat (or chi) statistic in NumPy/SciPy, without HEASoft.
+
+    Parameters are numbered from 1 like in XSPEC and their values are the XSPEC
+    list [value, delta, hard min, soft min, soft max, hard max].
+    ---------------------------------------------------------------------------------
+    Example:
+    import backend
+    import pyXIFU as px
+    local=backend.LocalBackend()
+    local.simulate(n_channels=30000,lines=[(6.4,0.01,1e-4)],seed=1)
+    local.save('synthetic')
+    px.ml_get_errors('synthetic','cstat',backend=local,plot_statistic=False)
+    """
+
+
+import numpy as np
+import os
+import hashlib
+import tempfile
+from scipy.optimize import least_squares
+from scipy.special import ndtr
+
+try:
+    import xspec
+    from xspec import AllData, AllModels, Fit, Xset, FakeitSettings
+except ImportError:
+    xspec=None
+
+
+#------ XSPEC commands of a .xcm file loading the spectra and responses or selecting their channels ------
+_xspec_data_commands=['data','response','arf','backgrnd','corfile','dummyrsp','ignore','notice']
+
+
+class XspecBackend(object):
+    """Backend driving the global pyXSPEC session (AllModels(1), Fit, Xset)."""
+
+    backend_name='xspec'
+    extension='.xcm'
+    #------ Data commands of the last .xcm file restored and fingerprint of the files they loaded, shared by the instances (one XSPEC session per process) ------
+    _loaded_data=None
+
+    def __init__(self):
+        if xspec is None:
+            raise ImportError('pyXSPEC is required by XspecBackend')
+        Xset.chatter=0
+
+    def restore(self,filexcm,keep_data=True):
+        """Restore a .xcm file. If keep_data is True and its data commands are the ones of the last file restored, in the same
+            directory and with unchanged files, only the other commands are run so the spectra and responses stay loaded."""
+        with open(filexcm+self.extension) as f:
+            lines=f.readlines()
+        data=tuple([line.strip() for line in lines if line.split()[:1] and line.split()[0] in _xspec_data_commands])
+        key=(os.getcwd(),data)
+        if keep_data and data and XspecBackend._loaded_data==(key,self.data_fingerprint()):
+            fd,partial=tempfile.mkstemp(suffix=self.extension)
+            with os.fdopen(fd,'w') as f:
+                f.writelines([line for line in lines if line.strip() not in data])
+            try:
+                Xset.restore(partial)
+            finally:
+                os.remove(partial)
+            return
+        Xset.restore(filexcm+self.extension)
+        #------ A file simulating new spectra does not leave the data of its commands loaded ------
+        fakeit=any([line.split()[:1]==['fakeit'] for line in lines])
+        XspecBackend._loaded_data=None if fakeit or not data else (key,self.data_fingerprint())
+
+    def save(self,filexcm):
+        if os.path.isfile(filexcm+self.extension): os.remove(filexcm+self.extension)
+        Xset.save(filexcm+self.extension,info="a")
+
+    def n_parameters(self):
+        return AllModels(1).nParameters
+
+    def expression(self):
+        return AllModels(1).expression
+
+    def name(self,i):
+        return AllModels(1)(i).name
+
+    def unit(self,i):
+        return AllModels(1)(i).unit
+
+    def get_values(self,i):
+        return list(AllModels(1)(i).values)
+
+    def set_values(self,values):
+        """values : dict {parameter number: value or list of the 6 XSPEC values}"""
+        pars={}
+        for i,value in values.items():
+            if np.ndim(value)==0:
+                pars[i]=value
+            else:
+                pars[i]=",".join([repr(v) for v in value])
+        AllModels(1).setPars(pars)
+
+    def sigma(self,i):
+        return AllModels(1)(i).sigma
+
+    def hard_limits(self,i):
+        values=AllModels(1)(i).values
+        return values[2],values[5]
+
+    def is_frozen(self,i):
+        return AllModels(1)(i).frozen
+
+    def freeze(self,i,frozen=True):
+        if AllModels(1)(i).frozen!=frozen:
+            AllModels(1)(i).frozen=frozen
+
+    def link(self,i):
+        return AllModels(1)(i).link
+
+    def set_link(self,i,link):
+        if link=='':
+            if AllModels(1)(i).link!='':
+                AllModels(1)(i).untie()
+        elif AllModels(1)(i).link!=link:
+            AllModels(1)(i).link=link.lstrip('= ')
+
+    def set_statistic(self,statistic):
+        Fit.statMethod=statistic
+
+    def fit_settings(self):
+        return {'statMethod':Fit.statMethod,'nIterations':Fit.nIterations,'criticalDelta':Fit.criticalDelta,'query':Fit.query}
+
+    def set_fit_settings(self,settings):
+        for key,value in settings.items():
+            if getattr(Fit,key)!=value:
+                setattr(Fit,key,value)
+
+    def set_parallel(self,n_cores):
+        Xset.parallel.leven = n_cores
+
+    def fit(self):
+        Fit.perform()
+
+    def iterations(self):
+        """Number of iterations of the last fit, not exposed by pyXSPEC."""
+        return None
+
+    def statistic(self):
+        return Fit.statistic
+
+    def stat_test(self):
+        return Fit.statTest
+
+    def dof(self):
+        return Fit.dof
+
+    def fakeit(self,seed,exposure=None,file_prefix='fakeit'):
+        """Replace each loaded spectrum by a Poisson realization of the current model (XSPEC fakeit).
+
+            Parameters
+            ----------
+            seed : int
+            Seed of the XSPEC random number generator.
+            exposure : float or None
+            Exposure time (s). If None, the exposure of the loaded spectra is used.
+            file_prefix : str
+            The fake spectra are written in <file_prefix>_<spectrum number>.fak.
+            """
+        XspecBackend._loaded_data=None
+        Xset.seed(int(seed))
+        settings=[]
+        for i in range(1,AllData.nSpectra+1):
+            fake=FakeitSettings()
+            if exposure is not None: fake.exposure=str(exposure)
+            fake.fileName=file_prefix+'_'+str(i)+'.fak'
+            if os.path.isfile(fake.fileName): os.remove(fake.fileName)
+            settings.append(fake)
+        AllData.fakeit(AllData.nSpectra,settings,applyStats=True)
+
+    def data_fingerprint(self):
+        """File name, response file names and modification time of each loaded spectrum."""
+        fingerprint=[]
+        for i in range(1,AllData.nSpectra+1):
+            spectrum=AllData(i)
+            try:
+                response=(spectrum.response.rmf,spectrum.response.arf)
+            except Exception:
+                response=('','')
+            files=[spectrum.fileName]+[f for f in response if f]
+            mtimes=[os.path.getmtime(f) if os.path.exists(f) else 0. for f in files]
+            fingerprint.append((spectrum.fileName,response,tuple(mtimes)))
+        return fingerprint
+
+    def data_digest(self):
+        """SHA-1 of the content of the spectra, backgrounds and responses loaded. The digest of a file is kept while its size and modification time do not change."""
+        if not hasattr(self,'_file_digests'): self._file_digests={}
+        digest=hashlib.sha1()
+        for i in range(1,AllData.nSpectra+1):
+            spectrum=AllData(i)
+            files=[spectrum.fileName]
+            for attribute in ['background','response']:
+                try:
+                    item=getattr(spectrum,attribute)
+                    files+=[item.fileName] if attribute=='background' else [item.rmf,item.arf]
+                except Exception:
+                    pass
+            for f in files:
+                if not f or not os.path.isfile(f):
+                    digest.update(str(f))
+                    continue
+                stat=os.stat(f)
+                key=(os.path.abspath(f),stat.st_size,stat.st_mtime)
+                if key not in self._file_digests:
+                    file_digest=hashlib.sha1()
+                    with open(f,'rb') as data:
+                        for block in iter(lambda: data.read(1<<20),b''):
+                            file_digest.update(block)
+                    self._file_digests[key]=file_digest.hexdigest()
+                digest.update(self._file_digests[key])
+        return digest.hexdigest()
+
+
+class LocalBackend(object):
+    """Backend fitting a power law plus Gaussian lines to a binned spectrum with NumPy/SciPy.
+
+        The model counts in each channel are exposure*width*(norm*E**-PhoIndex + sum of the Gaussian lines),
+        with a diagonal response. The parameters are PhoIndex, norm, then LineE, Sigma, norm for each line.
+        The state (data, model and fit settings) is saved in a .npz file which plays the role of the .xcm file.
+        """
+
+    backend_name='local'
+    extension='.npz'
+
+    def __init__(self):
+        self.energies=np.array([])
+        self.widths=np.array([])
+        self.counts=np.array([])
+        self.exposure=1.
+        self.data_file=''
+        self.names,self.units,self.links=[],[],[]
+        self.values=np.zeros((0,6))
+        self.frozen=np.zeros(0,dtype=bool)
+        self.sigmas=np.zeros(0)
+        self.settings={'statMethod':'cstat','nIterations':100,'criticalDelta':0.01,'query':'no'}
+        self.n_cores=1
+        self.fit_statistic=0.
+        self.last_iterations=0
+
+    #------ Data and model definition ------
+    def simulate(self,n_channels=1000,lines=[(6.4,0.01,1e-4)],index=1.7,norm=1e-2,exposure=1e5,emin=0.2,emax=12.,seed=0):
+        """Function to create a synthetic spectrum and set the model to the input parameters.
+
+            Parameters
+            ----------
+            n_channels : int
+            Number of channels, log-spaced between emin and emax.
+            lines : list of (float, float, float)
+            Energy (keV), width (keV) and normalization (photons/cm^2/s) of each Gaussian line.
+            index : float
+            Photon index of the power law.
+            norm : float
+            Normalization of the power law at 1 keV (photons/keV/cm^2/s).
+            exposure : float
+            Exposure time (s).
+            emin, emax : float
+            Energy range (keV).
+            seed : int
+            Seed of the Poisson realization.
+            """
+        edges=np.logspace(np.log10(emin),np.log10(emax),n_channels+1)
+        self.energies=0.5*(edges[1:]+edges[:-1])
+        self.widths=edges[1:]-edges[:-1]
+        self.exposure=float(exposure)
+        self.names=['PhoIndex','norm']
+        self.units=['','']
+        values=[[index,0.01,-3.,-2.,9.,10.],[norm,0.01*norm,0.,0.,1e24,1e24]]
+        for energy,width,line_norm in lines:
+            self.names+=['LineE','Sigma','norm']
+            self.units+=['keV','keV','']
+            values+=[[energy,0.05,emin,emin,emax,emax],[width,0.05*width,0.,0.,0.5,1.],[line_norm,0.01*line_norm if line_norm>0 else 1e-6,0.,0.,1e24,1e24]]
+        self.values=np.array(values,dtype=float)
+        self.links=['']*len(self.names)
+        self.frozen=np.zeros(len(self.names),dtype=bool)
+        self.sigmas=np.zeros(len(self.names))
+        self.counts=np.random.RandomState(seed).poisson(self.model_counts()).astype(float)
+        self.data_file='synthetic_'+str(seed)
+        self.fit_statistic=self._statistic_of(self._theta())
+
+    def model_counts(self,theta=None):
+        """Model counts in each channel for the full parameter vector theta (current values if None).
+
+            The power law is evaluated at the channel center, the Gaussian lines are integrated over the channel.
+            """
+        if theta is None: theta=self._theta()
+        counts=theta[1]*self.energies**-theta[0]*self.widths*self.exposure
+        low,high=self.energies-0.5*self.widths,self.energies+0.5*self.widths
+        for k in range(2,len(theta),3):
+            energy,width,line_norm=theta[k],max(theta[k+1],1e-10),theta[k+2]
+            counts=counts+line_norm*(ndtr((high-energy)/width)-ndtr((low-energy)/width))*self.exposure
+        return np.maximum(counts,1e-30)
+
+    def _model_jacobian(self,theta):
+        """Derivatives of the model counts with respect to each parameter of the full vector theta."""
+        scale=self.widths*self.exposure
+        jac=np.empty((len(self.energies),len(theta)))
+        powerlaw=self.energies**-theta[0]
+        jac[:,0]=-theta[1]*powerlaw*np.log(self.energies)*scale
+        jac[:,1]=powerlaw*scale
+        low,high=self.energies-0.5*self.widths,self.energies+0.5*self.widths
+        for k in range(2,len(theta),3):
+            energy,width,line_norm=theta[k],max(theta[k+1],1e-10),theta[k+2]
+            u_low,u_high=(low-energy)/width,(high-energy)/width
+            pdf_low,pdf_high=np.exp(-0.5*u_low**2)/np.sqrt(2*np.pi),np.exp(-0.5*u_high**2)/np.sqrt(2*np.pi)
+            jac[:,k]=line_norm*(pdf_low-pdf_high)/width*self.exposure
+            jac[:,k+1]=line_norm*(pdf_low*u_low-pdf_high*u_high)/width*self.exposure
+            jac[:,k+2]=(ndtr(u_high)-ndtr(u_low))*self.exposure
+        return jac
+
+    def _theta(self,free_values=None,free=None):
+        theta=self.values[:,0].copy()
+        if free_values is not None: theta[free]=free_values
+        for i,link in enumerate(self.links):
+            if link!='':
+                factor,target=self._parse_link(link)
+                theta[i]=factor*theta[target]
+        return theta
+
+    def _parse_link(self,link):
+        """Links are 'pN' or 'factor*pN' (an optional leading '=' is ignored)."""
+        expression=link.replace('=','').replace(' ','')
+        if '*' in expression:
+            factor,target=expression.split('*')
+            return float(factor),int(target.lstrip('p'))-1
+        return 1.,int(expression.lstrip('p'))-1
+
+    def _residuals(self,model):
+        """Residuals whose sum of squares is the statistic, and their derivative with respect to the model."""
+        data=self.counts
+        if self.settings['statMethod']=='chi':
+            error=np.sqrt(np.maximum(data,1.))
+            return (data-model)/error,-1./error
+        deviance=model-data+np.where(data>0,data*np.log(np.where(data>0,data,1.)/model),0.)
+        deviance=np.maximum(deviance,0.)
+        root=np.sqrt(2.*deviance)
+        residuals=np.where(data>model,root,-root)
+        small=root<1e-8
+        dres=np.where(small,-1./np.sqrt(np.maximum(model,1e-30)),(1.-data/model)/np.where(small,1.,root)*np.where(data>model,1.,-1.))
+        return residuals,dres
+
+    def _free(self):
+        return np.array([i for i in range(len(self.names)) if not self.frozen[i] and self.links[i]==''],dtype=int)
+
+    #------ Backend interface ------
+    def restore(self,filexcm):
+        state=np.load(filexcm+self.extension)
+        self.energies,self.widths,self.counts=state['energies'],state['widths'],state['counts']
+        self.exposure=float(state['exposure'])
+        self.data_file=str(state['data_file'])
+        self.names,self.units,self.links=[str(n) for n in state['names']],[str(u) for u in state['units']],[str(l) for l in state['links']]
+        self.values,self.frozen,self.sigmas=state['values'].copy(),state['frozen'].copy(),state['sigmas'].copy()
+        self.settings={'statMethod':str(state['statMethod']),'nIterations':int(state['nIterations']),'criticalDelta':float(state['criticalDelta']),'query':'no'}
+        self.fit_statistic=self._statistic_of(self._theta())
+
+    def save(self,filexcm):
+        with open(filexcm+self.extension,'wb') as f:
+            np.savez(f,energies=self.energies,widths=self.widths,counts=self.counts,exposure=self.exposure,data_file=self.data_file,
+                     names=np.array(self.names),units=np.array(self.units),links=np.array(self.links),values=self.values,frozen=self.frozen,
+                     sigmas=self.sigmas,statMethod=self.settings['statMethod'],nIterations=self.settings['nIterations'],
+                     criticalDelta=self.settings['criticalDelta'])
+
+    def n_parameters(self):
+        return len(self.names)
+
+    def expression(self):
+        return 'powerlaw'+'+gaussian'*((len(self.names)-2)//3)
+
+    def name(self,i):
+        return self.names[i-1]
+
+    def unit(self,i):
+        return self.units[i-1]
+
+    def get_values(self,i):
+        return list(self.values[i-1])
+
+    def set_values(self,values):
+        """values : dict {parameter number: value or list of the 6 XSPEC values}"""
+        for i,value in values.items():
+            if np.ndim(value)==0:
+                self.values[i-1,0]=value
+            else:
+                self.values[i-1]=value
+        self.fit_statistic=self._statistic_of(self._theta())
+
+    def sigma(self,i):
+        return self.sigmas[i-1]
+
+    def hard_limits(self,i):
+        return self.values[i-1,2],self.values[i-1,5]
+
+    def is_frozen(self,i):
+        return bool(self.frozen[i-1])
+
+    def freeze(self,i,frozen=True):
+        self.frozen[i-1]=frozen
+
+    def link(self,i):
+        return self.links[i-1]
+
+    def set_link(self,i,link):
+        self.links[i-1]=link
+
+    def set_statistic(self,statistic):
+        self.settings['statMethod']=statistic
+
+    def fit_settings(self):
+        return dict(self.settings)
+
+    def set_fit_settings(self,settings):
+        self.settings.update(settings)
+
+    def set_parallel(self,n_cores):
+        self.n_cores=n_cores
+
+    def _statistic_of(self,theta):
+        if len(self.counts)==0:
+            return 0.
+        residuals,dres=self._residuals(self.model_counts(theta))
+        return float(np.sum(residuals**2))
+
+    def fit(self):
+        """Levenberg-Marquardt like fit of the free parameters within their soft limits."""
+        free=self._free()
+        if len(free)==0:
+            self.fit_statistic=self._statistic_of(self._theta())
+            self.last_iterations=0
+            return
+        lower,upper=self.values[free,3],self.values[free,4]
+        x0=np.clip(self.values[free,0],lower,upper)
+        linked=[(i,)+self._parse_link(link) for i,link in enumerate(self.links) if link!='']
+
+        def fun(x):
+            residuals,dres=self._residuals(self.model_counts(self._theta(x,free)))
+            return residuals
+
+        def jac(x):
+            theta=self._theta(x,free)
+            residuals,dres=self._residuals(self.model_counts(theta))
+            full=self._model_jacobian(theta)
+            for i,factor,target in linked:
+                full[:,target]+=factor*full[:,i]
+            return dres[:,None]*full[:,free]
+
+        result=least_squares(fun,x0,jac=jac,bounds=(lower,upper),method='dogbox',x_scale='jac',max_nfev=self.settings['nIterations'],ftol=1e-10,xtol=1e-10)
+        self.values[free,0]=result.x
+        self.last_iterations=result.nfev
+        self.fit_statistic=float(np.sum(result.fun**2))
+        self.sigmas[:]=-1.
+        try:
+            covariance=np.linalg.inv(np.dot(result.jac.T,result.jac))
+            self.sigmas[free]=np.sqrt(np.maximum(np.diag(covariance),0.))
+        except np.linalg.LinAlgError:
+            pass
+        pegged=(result.x<=lower)|(result.x>=upper)
+        self.sigmas[free[pegged]]=-1.
+
+    def iterations(self):
+        """Number of evaluations of the model in the last fit."""
+        return self.last_iterations
+
+    def statistic(self):
+        return self.fit_statistic
+
+    def stat_test(self):
+        return self.settings['statMethod']
+
+    def dof(self):
+        return len(self.counts)-len(self._free())
+
+    def fakeit(self,seed,exposure=None,file_prefix='fakeit'):
+        """Replace the spectrum by a Poisson realization of the current model, see XspecBackend.fakeit."""
+        if exposure is not None: self.exposure=float(exposure)
+        self.counts=np.random.RandomState(int(seed)).poisson(self.model_counts()).astype(float)
+        self.data_file=file_prefix
+        self.fit_statistic=self._statistic_of(self._theta())
+
+    def data_fingerprint(self):
+        return [(self.data_file,len(self.counts),self.exposure)]
+
+    def data_digest(self):
+        """SHA-1 of the binned spectrum (energies, widths, counts and exposure)."""
+        digest=hashlib.sha1()
+        for array in [self.energies,self.widths,self.counts,np.array([self.exposure])]:
+            digest.update(np.ascontiguousarray(array,dtype=float).tobytes())
+        return digest.hexdigest()
+
+
+backends=dict((fit_backend.backend_name,fit_backend) for fit_backend in [XspecBackend,LocalBackend])
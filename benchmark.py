@@ -0,0 +1,187 @@
+"""
+ benchmark.py  -  benchmark suite of the pyXIFU error engine
+ ---------------------------------------------------------------------------------
+ Author: V. Fioretti (INAF/OAS) valentina.fioretti@inaf.it
+ ---------------------------------------------------------------------------------
+ Dependencies:
+ - python 2.7
+ - numpy
+ - scipy
+ - matplotlib
+ ---------------------------------------------------------------------------------
+ Each case simulates a deterministic synthetic spectrum with the LocalBackend of backend.py
+ (power law plus Gaussian lines) and runs pyXIFU.ml_get_errors on all the free parameters
+ in a new process. The cases cover:
+ - number of parameters from 2 to 50
+ - number of channels up to the X-IFU scale (30000)
+ - a pegged parameter (line with a null normalization)
+ - asymmetric profiles (weak line, short exposure)
+ For each case the wall time, the number of fits, the time spent in restores, fits,
+ interpolations and plots and the peak RSS are appended as a JSON line to the output file.
+ ---------------------------------------------------------------------------------
+ Parameters:
+ - output = JSON lines file where the results are appended. Default is benchmark_results.jsonl
+ - cases = 'all' or list of case names separated with space (e.g. "pars_2 pars_5"). Default is 'all'
+ - any other argument key=value is given to ml_get_errors (e.g. search_method=bracket warm_start=True)
+ --------------------------------------------------------------------------------
+ Usage example:
+ > python benchmark.py benchmark_results.jsonl all
+ > python benchmark.py benchmark_results.jsonl "pars_5 pegged" search_method=bracket
+ > python benchmark.py compare benchmark_results.jsonl
+"""
+
+import numpy as np
+import sys, os
+import json
+import time
+import datetime
+import socket
+import shutil
+import tempfile
+import resource
+import multiprocessing
+
+import backend
+from campaign import ml_parse_option
+
+
+def ml_lines(n_lines,norm=1e-4,width=0.02,emin=1.,emax=10.):
+    """Gaussian lines evenly spaced in energy between emin and emax."""
+    return [(energy,width,norm) for energy in np.linspace(emin,emax,n_lines+2)[1:-1]]
+
+
+ml_benchmark_cases=[
+    {'name':'pars_2','n_channels':2000,'lines':[]},
+    {'name':'pars_5','n_channels':2000,'lines':ml_lines(1)},
+    {'name':'pars_11','n_channels':2000,'lines':ml_lines(3)},
+    {'name':'pars_20','n_channels':2000,'lines':ml_lines(6)},
+    {'name':'pars_50','n_channels':2000,'lines':ml_lines(16)},
+    {'name':'channels_1000','n_channels':1000,'lines':ml_lines(1)},
+    {'name':'channels_10000','n_channels':10000,'lines':ml_lines(1)},
+    {'name':'channels_30000','n_channels':30000,'lines':ml_lines(1)},
+    {'name':'pegged','n_channels':2000,'lines':ml_lines(1)+[(7.,0.02,0.)]},
+    {'name':'asymmetric','n_channels':2000,'lines':ml_lines(1,norm=2e-4),'exposure':5e4},
+]
+
+
+def ml_benchmark_case(case,settings={},seed=0):
+    """Function to run one benchmark case in the current process.
+
+        Parameters
+        ----------
+        case : dict
+        Benchmark case with name, n_channels, lines and optionally exposure.
+        settings : dict
+        Keyword arguments given to ml_get_errors.
+        seed : int
+        Seed of the synthetic spectrum.
+
+        Returns
+        -------
+        result : dict
+        Case, settings, wall time, statistics returned by ml_get_errors and peak RSS (MB).
+        """
+    import pyXIFU as px
+    cwd=os.getcwd()
+    workdir=tempfile.mkdtemp(prefix='bench_'+case['name']+'_')
+    try:
+        os.chdir(workdir)
+        local=backend.LocalBackend()
+        local.simulate(n_channels=case['n_channels'],lines=case['lines'],exposure=case.get('exposure',1e5),seed=seed)
+        local.save(case['name'])
+        kwargs={'plot_statistic':False}
+        kwargs.update(settings)
+        start=time.time()
+        run_stats=px.ml_get_errors(case['name'],'cstat',backend=local,**kwargs)
+        wall=time.time()-start
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir,ignore_errors=True)
+    rss_self=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+    rss_children=resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss/1024.
+    result={'case':case['name'],'n_channels':case['n_channels'],'n_parameters':2+3*len(case['lines']),'seed':seed,
+            'settings':settings,'wall':wall,'peak_rss_mb':max(rss_self,rss_children)}
+    result.update(run_stats)
+    return result
+
+
+def _ml_benchmark_worker(queue,case,settings,seed):
+    queue.put(ml_benchmark_case(case,settings,seed))
+
+
+def ml_run_benchmarks(output='benchmark_results.jsonl',cases='all',settings={},seed=0):
+    """Function to run the benchmark cases, each in a new process, and append the results to a JSON lines file.
+
+        Parameters
+        ----------
+        output : str
+        JSON lines file where the results are appended.
+        cases : 'all' or list of str
+        Names of the cases to run.
+        settings : dict
+        Keyword arguments given to ml_get_errors.
+        seed : int
+        Seed of the synthetic spectra.
+
+        Returns
+        -------
+        results : list of dict
+        One result per case, see ml_benchmark_case.
+        """
+    selected=[case for case in ml_benchmark_cases if cases=='all' or case['name'] in cases]
+    run_id=datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+    results=[]
+    for case in selected:
+        print "<  INFO  > : Benchmark case",case['name']
+        queue=multiprocessing.Queue()
+        process=multiprocessing.Process(target=_ml_benchmark_worker,args=(queue,case,settings,seed))
+        process.start()
+        result=queue.get()
+        process.join()
+        result['run_id']=run_id
+        result['host']=socket.gethostname()
+        with open(output,'a') as f:
+            f.write(json.dumps(result,sort_keys=True)+'\n')
+        print "<  INFO  > : ",case['name'],"wall =",round(result['wall'],3),"s | fits =",result['n_fits'],"| peak RSS =",round(result['peak_rss_mb'],1),"MB"
+        results.append(result)
+    return results
+
+
+def ml_load_benchmarks(output='benchmark_results.jsonl'):
+    """Function to read the results of all the benchmark runs of a JSON lines file."""
+    with open(output) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def ml_compare_benchmarks(output='benchmark_results.jsonl',reference=None,run=None):
+    """Function to print the wall time and the number of fits of two benchmark runs, case by case.
+
+        Parameters
+        ----------
+        output : str
+        JSON lines file of the results.
+        reference, run : str or None
+        Run identifiers. Default are the two last runs of the file.
+        """
+    results=ml_load_benchmarks(output)
+    run_ids=sorted(set([result['run_id'] for result in results]))
+    if run is None: run=run_ids[-1]
+    if reference is None: reference=run_ids[-2] if len(run_ids)>1 else run_ids[-1]
+    ref=dict((result['case'],result) for result in results if result['run_id']==reference)
+    new=dict((result['case'],result) for result in results if result['run_id']==run)
+    print "%-16s %12s %12s %8s %10s %10s" % ('case','wall_ref','wall_new','ratio','fits_ref','fits_new')
+    for name in sorted(set(ref)&set(new)):
+        print "%-16s %12.3f %12.3f %8.2f %10d %10d" % (name,ref[name]['wall'],new[name]['wall'],new[name]['wall']/ref[name]['wall'],ref[name]['n_fits'],new[name]['n_fits'])
+
+
+if __name__ == '__main__':
+    arg_list = sys.argv
+    if len(arg_list) > 1 and arg_list[1] == 'compare':
+        ml_compare_benchmarks(*arg_list[2:])
+    else:
+        output = arg_list[1] if len(arg_list) > 1 else 'benchmark_results.jsonl'
+        cases = arg_list[2] if len(arg_list) > 2 else 'all'
+        if cases != 'all':
+            cases = cases.split(" ")
+        settings = dict((arg.split('=')[0],ml_parse_option(*arg.split('=',1))) for arg in arg_list[3:])
+        ml_run_benchmarks(output,cases,settings)
@@ -0,0 +1,144 @@
+"""
+    cache.py  -  profile cache of the pyXIFU error engine
+    ---------------------------------------------------------------------------------
+    Author: V. Fioretti (INAF/OAS) valentina.fioretti@inaf.it
+    ---------------------------------------------------------------------------------
+    Dependencies:
+    - python 2.7
+    - numpy
+    ---------------------------------------------------------------------------------
+    MlProfileCache is a content-addressed cache of the statistic profiles of the
+    parameters. The key of a profile is the SHA-1 of the model expression, the state
+    of the parameters (frozen values, links and hard limits), the content of the data
+    and response files and the settings of the profiling (statistic, levels, search
+    method), so a profile is only reused for the same inputs. The best fit statistic
+    is stored with the profile to check that the fit reached the same minimum.
+    Each profile is a JSON file <key>.json
+    in the cache directory, which can be shared by the runs of several models. When the
+    directory is larger than its size bound, the least recently used profiles are removed.
+    ---------------------------------------------------------------------------------
+    Usage example:
+    > python cache.py pyXIFU_cache 100
+    """
+
+
+import numpy as np
+import os
+import sys
+import json
+import hashlib
+import tempfile
+
+
+class MlProfileCache(object):
+    """Content-addressed cache of the statistic profiles, bounded in size with a least recently used eviction.
+
+        Parameters
+        ----------
+        path : str
+        Directory of the cache, created if needed.
+        max_bytes : int
+        Size bound of the directory. The least recently used profiles are removed when it is exceeded.
+        """
+
+    def __init__(self,path,max_bytes=500*1024**2):
+        self.path=path
+        self.max_bytes=max_bytes
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _entry(self,key):
+        return os.path.join(self.path,key+'.json')
+
+    def get(self,key):
+        """Return the profile stored under key, or None. A profile read becomes the most recently used."""
+        try:
+            with open(self._entry(key)) as f:
+                profile=json.load(f)
+            os.utime(self._entry(key),None)
+        except (IOError,OSError,ValueError):
+            return None
+        return _ml_profile_from_json(profile)
+
+    def put(self,key,profile):
+        """Store a profile under key, written in a temporary file renamed at the end so the readers never see a partial file."""
+        fd,tmp=tempfile.mkstemp(dir=self.path,suffix='.tmp')
+        with os.fdopen(fd,'w') as f:
+            json.dump(_ml_profile_to_json(profile),f,default=lambda value: value.tolist())
+        os.rename(tmp,self._entry(key))
+        self.evict()
+
+    def entries(self):
+        """(last use, size, file) of the profiles of the cache, oldest first."""
+        entries=[]
+        for name in os.listdir(self.path):
+            if name.endswith('.json'):
+                try:
+                    stat=os.stat(os.path.join(self.path,name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime,stat.st_size,os.path.join(self.path,name)))
+        return sorted(entries)
+
+    def evict(self,max_bytes=None):
+        """Remove the least recently used profiles until the cache is within max_bytes (default is the size bound). Return the number removed."""
+        if max_bytes is None: max_bytes=self.max_bytes
+        entries=self.entries()
+        size=sum([entry[1] for entry in entries])
+        n_removed=0
+        for mtime,entry_size,filename in entries:
+            if size<=max_bytes:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            size-=entry_size
+            n_removed+=1
+        return n_removed
+
+
+_ml_profile_keys=['para_nb','name','unit','initial_value','hard_min','hard_max','par_list','cost_list','hardcap_hit','n_fits','fitstat']
+
+
+def _ml_profile_to_json(profile):
+    """Fields of a profile needed to compute its errors again, the crossings of the bracket search as [level, root] pairs."""
+    entry=dict((key,profile[key]) for key in _ml_profile_keys)
+    entry['n_fits']=profile.get('n_fits_profile',profile['n_fits'])
+    entry['roots']=[sorted(roots.items()) if roots else None for roots in profile.get('roots',[None,None])]
+    return entry
+
+
+def _ml_profile_from_json(entry):
+    """Profile read from the cache, with the counters of a profile that did not need any fit."""
+    profile=dict((str(key),value) for key,value in entry.items())
+    profile['name'],profile['unit']=str(profile['name']),str(profile['unit'])
+    profile['par_list'],profile['cost_list']=np.array(profile['par_list'],dtype=float),np.array(profile['cost_list'],dtype=float)
+    profile['roots']=[dict((float(level),root) for level,root in roots) if roots is not None else None for roots in profile['roots']]
+    profile.update({'status':'done','n_fits_profile':profile['n_fits'],'n_fits':0,'n_restore':0,'n_disk_restore':0,'t_restore':0.,'t_fit':0.,
+                    'n_fallback':0,'n_replayed':0,'cached':True})
+    return profile
+
+
+def ml_cache_key(*parts):
+    """Function to compute the SHA-1 key of JSON serializable parts (floats written with 10 significant digits)."""
+    return hashlib.sha1(json.dumps(_ml_round(parts),sort_keys=True)).hexdigest()
+
+
+def _ml_round(value):
+    if isinstance(value,float):
+        return float('%.10g' % value)
+    if isinstance(value,(list,tuple)):
+        return [_ml_round(item) for item in value]
+    if isinstance(value,dict):
+        return dict((str(key),_ml_round(item)) for key,item in value.items())
+    return value
+
+
+if __name__ == '__main__':
+    arg_list = sys.argv
+    cache = MlProfileCache(arg_list[1])
+    entries = cache.entries()
+    print "<  INFO  > : Profiles in the cache :",len(entries),"| size :",round(sum([entry[1] for entry in entries])/1024.**2,3),"MB"
+    if len(arg_list) > 2:
+        print "<  INFO  > : Profiles removed :",cache.evict(int(float(arg_list[2])*1024**2))
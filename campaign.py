@@ -0,0 +1,328 @@
+"""
+ campaign.py  -  simulate-and-fit campaigns of the pyXIFU error engine
+ ---------------------------------------------------------------------------------
+ Author: V. Fioretti (INAF/OAS) valentina.fioretti@inaf.it
+ ---------------------------------------------------------------------------------
+ Dependencies:
+ - python 2.7
+ - numpy
+ - scipy
+ - matplotlib
+ - PyPDF2
+ - pyXSPEC running on Python 2.7 (backend=xspec)
+ ---------------------------------------------------------------------------------
+ A campaign runs the errors of every model, for every seed and every combination of
+ the settings grid (exposure, parameter values such as abundances). Each item is run
+ in a pool of worker processes, each with its own XSPEC session:
+ - the model is restored from <model>.xcm (and the optional setup .xcm, like cstat_simula.py)
+ - the parameters of the settings are set and the spectra are replaced by a fakeit
+   realization with the seed and the exposure of the settings
+ - pyXIFU.ml_get_errors is run in <campaign>/<item>/
+ Each finished item is appended to <campaign>/results.jsonl, a restarted campaign skips
+ the items already in this file. At the end all the items are aggregated in
+ <campaign>/results.txt (one row per item and parameter) and the distribution of the
+ best fit values and errors of each parameter is written in <campaign>/summary.txt
+ (median and 16th/84th percentiles for each model and settings group).
+ The results stores of all the items (errors and profile points) are combined in one
+ array with ml_campaign_arrays.
+ ---------------------------------------------------------------------------------
+ Parameters:
+ - campaign = directory of the campaign
+ - models = list of models separated with space (the .xcm files must be <model>.xcm)
+ - seeds = list of seeds separated with space, or range "first-last" (e.g. "0-99")
+ - n_workers = int. Number of worker processes. Default is 1
+ - settings grid, list of values separated with comma:
+   exposure=1e4,1e5 (s) and parN=v1,v2 (value of the parameter N, e.g. an abundance)
+ - backend=xspec or local, setup=<xcm file>, statistic=cstat or chi
+ - daemons=<address>,<address>... : run the items in running daemons (daemon.py) instead of new processes
+ - any other argument key=value is given to ml_get_errors (e.g. level=2.706 search_method=bracket)
+ --------------------------------------------------------------------------------
+ Usage example:
+ > python campaign.py study "base10 base20" "0-99" 8 exposure=1e4,1e5
+ > python campaign.py study base10 "0-199" 16 exposure=1e5 par12=0.3,0.5,1 search_method=bracket
+ > python campaign.py study base10 "0-199" 2 exposure=1e5 daemons=/tmp/pyxifu_0.sock,/tmp/pyxifu_1.sock
+"""
+
+import numpy as np
+import sys, os
+import json
+import time
+import itertools
+import multiprocessing
+
+import backend
+from store import MlColumnStore,ml_load_stores,ml_table_rows
+
+
+def ml_campaign_items(models,seeds,grid=None):
+    """Function to list the items of a campaign.
+
+        Parameters
+        ----------
+        models : list of str
+        Models (.xcm files without extension).
+        seeds : list of int
+        Seeds of the fakeit realizations.
+        grid : dict or None
+        Values of each setting, e.g. {'exposure':[1e4,1e5],'pars':[{12:0.3},{12:1.}]}.
+        Every combination of the values is a settings group.
+
+        Returns
+        -------
+        items : list of dict
+        Name (<model>_g<group>_s<seed>), model, seed, settings group number and settings of each item.
+        """
+    if not grid: grid={}
+    keys=sorted(grid)
+    groups=[dict(zip(keys,values)) for values in itertools.product(*[grid[key] for key in keys])]
+    items=[]
+    for model in models:
+        for group,settings in enumerate(groups):
+            for seed in seeds:
+                items.append({'name':os.path.basename(model)+'_g'+str(group)+'_s'+str(seed),'model':model,'seed':int(seed),'group':group,'settings':settings})
+    return items
+
+
+def ml_campaign_item(item,campaign_dir,backend_name='xspec',statistic='cstat',setup=None,options={}):
+    """Function to simulate and fit one item of a campaign in the current process.
+
+        Parameters
+        ----------
+        item : dict
+        Item returned by ml_campaign_items.
+        campaign_dir : str
+        Directory of the campaign, the item is run in <campaign_dir>/<item name>.
+        backend_name : {'xspec', 'local'}
+        Fit backend of backend.py.
+        statistic : {'cstat', 'chi'}
+        Statistic of the fit method.
+        setup : str or None
+        .xcm file restored after the model (without extension), e.g. the fakeit responses.
+        options : dict
+        Keyword arguments given to ml_get_errors.
+
+        Returns
+        -------
+        result : dict
+        The item, wall time, statistics returned by ml_get_errors and the rows of its results file.
+        """
+    import pyXIFU as px
+    cwd=os.getcwd()
+    workdir=os.path.join(campaign_dir,item['name'])
+    if not os.path.isdir(workdir): os.makedirs(workdir)
+    fit_backend=backend.backends[backend_name]()
+    start=time.time()
+    try:
+        fit_backend.restore(os.path.abspath(item['model']))
+        if setup: fit_backend.restore(os.path.abspath(setup))
+        pars=item['settings'].get('pars',{})
+        if pars: fit_backend.set_values(dict((int(i),value) for i,value in pars.items()))
+        os.chdir(workdir)
+        fit_backend.fakeit(item['seed'],item['settings'].get('exposure'),item['name'])
+        fit_backend.save(item['name'])
+        kwargs={'plot_statistic':False,'n_cores':1}
+        kwargs.update(options)
+        #------ The workers of the pool cannot start processes ------
+        kwargs.update({'n_workers':1,'parallel_directions':False,'plot_workers':1})
+        run_stats=px.ml_get_errors(item['name'],statistic,backend=fit_backend,**kwargs)
+        rows=ml_table_rows(MlColumnStore(item['name']+'_store').read('summary'))
+    finally:
+        os.chdir(cwd)
+    result=dict(item)
+    result.update({'wall':time.time()-start,'rows':rows})
+    result.update(run_stats)
+    return result
+
+
+def _ml_campaign_worker(task):
+    return ml_campaign_item(*task)
+
+
+def _ml_daemon_worker(task):
+    """Thread sending an item to the first free daemon (daemon.py), the daemon is freed when the item is done."""
+    from daemon import ml_submit
+    free,(item,campaign_dir,backend_name,statistic,setup,options)=task
+    address=free.get()
+    try:
+        return ml_submit(address,{'kind':'campaign_item','item':item,'campaign_dir':os.path.abspath(campaign_dir),'statistic':statistic,'setup':setup,'options':options})
+    finally:
+        free.put(address)
+
+
+def ml_run_campaign(campaign_dir,models,seeds,grid=None,n_workers=1,backend_name='xspec',statistic='cstat',setup=None,options={},daemons=None):
+    """Function to run the items of a campaign in a pool of worker processes, or in running daemons, and aggregate the results.
+
+        The items already in <campaign_dir>/results.jsonl are skipped.
+
+        Parameters
+        ----------
+        campaign_dir : str
+        Directory of the campaign.
+        models, seeds, grid :
+        See ml_campaign_items.
+        n_workers : int
+        Number of worker processes, each one with its own XSPEC session.
+        backend_name, statistic, setup, options :
+        See ml_campaign_item.
+        daemons : list of str or None
+        Addresses of running daemons (daemon.py). If given, the items are sent to the daemons instead of 
+        a pool of new processes, so the fit sessions and the loaded responses are kept between the items. 
+        The backend of the daemons is used.
+
+        Returns
+        -------
+        results : list of dict
+        All the finished items of the campaign, see ml_campaign_item.
+        """
+    if not os.path.isdir(campaign_dir): os.makedirs(campaign_dir)
+    output=os.path.join(campaign_dir,'results.jsonl')
+    done=set([result['name'] for result in ml_load_campaign(campaign_dir)])
+    items=ml_campaign_items(models,seeds,grid)
+    todo=[item for item in items if item['name'] not in done]
+    print "<  INFO  > : Campaign items :",len(items),"| already done :",len(items)-len(todo)
+    tasks=[(item,campaign_dir,backend_name,statistic,setup,options) for item in todo]
+    if tasks:
+        if daemons:
+            import Queue
+            from multiprocessing.pool import ThreadPool
+            free=Queue.Queue()
+            for address in daemons:
+                free.put(address)
+            pool=ThreadPool(len(daemons))
+            results=pool.imap_unordered(_ml_daemon_worker,[(free,task) for task in tasks])
+        else:
+            pool=multiprocessing.Pool(max(1,min(n_workers,len(tasks))))
+            results=pool.imap_unordered(_ml_campaign_worker,tasks)
+        try:
+            for n_done,result in enumerate(results):
+                with open(output,'a') as f:
+                    f.write(json.dumps(result,sort_keys=True)+'\n')
+                print "<  INFO  > : ",result['name'],"done in",round(result['wall'],1),"s with",result['n_fits'],"fits (",n_done+1,"/",len(tasks),")"
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    results=ml_load_campaign(campaign_dir)
+    ml_aggregate_campaign(campaign_dir,results)
+    return results
+
+
+def ml_load_campaign(campaign_dir):
+    """Function to read the finished items of a campaign."""
+    output=os.path.join(campaign_dir,'results.jsonl')
+    if not os.path.isfile(output):
+        return []
+    with open(output) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def ml_campaign_arrays(campaign_dir,table='summary'):
+    """Function to combine a table ('summary' or 'points') of the results stores of all the finished items of a campaign.
+
+        Returns
+        -------
+        combined : numpy structured array
+        Rows of all the items, the first column 'run' is the name of the item, see store.ml_load_stores.
+        """
+    names=sorted([result['name'] for result in ml_load_campaign(campaign_dir)])
+    return ml_load_stores([os.path.join(campaign_dir,name,name+'_store') for name in names],table,names)
+
+
+def ml_aggregate_campaign(campaign_dir,results=None):
+    """Function to write the results table and the distribution of the intervals of each parameter of a campaign.
+
+        <campaign_dir>/results.txt has one row per item and parameter. <campaign_dir>/summary.txt has, for each
+        model, settings group and parameter, the number of items and the 16th, 50th and 84th percentiles of
+        the best fit value and of each error column.
+
+        Returns
+        -------
+        summary : list of dict
+        Rows of summary.txt.
+        """
+    if results is None: results=ml_load_campaign(campaign_dir)
+    if not results:
+        return []
+    columns=_ml_value_columns(set([name for result in results for row in result['rows'] for name in row]))
+    with open(os.path.join(campaign_dir,'results.txt'),'w') as f:
+        f.write('# item model group seed para_nb name '+' '.join(columns)+' hard_min_hit hard_max_hit\n')
+        for result in sorted(results,key=lambda result: (result['model'],result['group'],result['seed'])):
+            for row in result['rows']:
+                f.write(' '.join([result['name'],os.path.basename(result['model']),str(result['group']),str(result['seed']),str(row['para_nb']),row['name']]
+                                 +['%1.9f' % row.get(column,np.nan) for column in columns]+[str(int(row['hard_min_hit'])),str(int(row['hard_max_hit']))])+'\n')
+    samples={}
+    for result in results:
+        for row in result['rows']:
+            samples.setdefault((os.path.basename(result['model']),result['group'],row['para_nb'],row['name']),[]).append([row.get(column,np.nan) for column in columns]+[row['hard_min_hit'] or row['hard_max_hit']])
+    groups=dict((result['group'],result['settings']) for result in results)
+    summary=[]
+    with open(os.path.join(campaign_dir,'summary.txt'),'w') as f:
+        for group in sorted(groups):
+            f.write('# group '+str(group)+' : '+json.dumps(groups[group],sort_keys=True)+'\n')
+        f.write('# model group para_nb name n_items n_hardcap '+' '.join([column+'_'+q for column in columns for q in ['p16','p50','p84']])+'\n')
+        for key in sorted(samples):
+            values=np.array(samples[key],dtype=float)
+            percentiles=np.nanpercentile(values[:,:-1],[16,50,84],axis=0).T
+            row={'model':key[0],'group':key[1],'para_nb':key[2],'name':key[3],'n_items':len(values),'n_hardcap':int(values[:,-1].sum())}
+            for column,(p16,p50,p84) in zip(columns,percentiles):
+                row[column+'_p16'],row[column+'_p50'],row[column+'_p84']=p16,p50,p84
+            summary.append(row)
+            f.write(' '.join([key[0],str(key[1]),str(key[2]),key[3],str(row['n_items']),str(row['n_hardcap'])]+['%1.9f' % value for value in percentiles.flatten()])+'\n')
+    print "<  INFO  > : Campaign results in",os.path.join(campaign_dir,'results.txt'),"and",os.path.join(campaign_dir,'summary.txt')
+    return summary
+
+
+def _ml_value_columns(names):
+    """Best fit value then error columns of the results rows, ordered by level (error_min, error_max or error_min_<level>, error_max_<level>)."""
+    errors=[name for name in names if name.startswith('error_')]
+    return ['best_fit_value']+sorted(errors,key=lambda name: (float(name.split('_')[2]) if name.count('_')>1 else 0.,name.split('_')[1]!='min'))
+
+
+def ml_parse_option(key,value):
+    """Function to convert the value of a key=value option of the command lines (campaign.py, benchmark.py, daemon.py, 
+        stream.py) to an int, a float, a bool or None, and a comma-separated level to a list of float."""
+    if key=='level' and ',' in value:
+        return [float(v) for v in value.split(',')]
+    for convert in [int,float]:
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    if value in ['True','False']:
+        return value=='True'
+    if value=='None':
+        return None
+    return value
+
+
+if __name__ == '__main__':
+    arg_list = sys.argv
+    campaign_dir = arg_list[1]
+    models = arg_list[2].split(" ")
+    if '-' in arg_list[3]:
+        first, last = arg_list[3].split('-')
+        seeds = range(int(first), int(last)+1)
+    else:
+        seeds = [int(seed) for seed in arg_list[3].split(" ")]
+    n_workers = int(arg_list[4]) if len(arg_list) > 4 else 1
+    grid, options, pars = {}, {}, []
+    backend_name, statistic, setup, daemons = 'xspec', 'cstat', None, None
+    for arg in arg_list[5:]:
+        key, value = arg.split('=', 1)
+        if key == 'exposure':
+            grid['exposure'] = [float(v) for v in value.split(',')]
+        elif key.startswith('par') and key[3:].isdigit():
+            pars.append([(int(key[3:]), float(v)) for v in value.split(',')])
+        elif key == 'backend':
+            backend_name = value
+        elif key == 'statistic':
+            statistic = value
+        elif key == 'setup':
+            setup = value
+        elif key == 'daemons':
+            daemons = value.split(',')
+        else:
+            options[key] = ml_parse_option(key, value)
+    if pars:
+        grid['pars'] = [dict(combination) for combination in itertools.product(*pars)]
+    ml_run_campaign(campaign_dir, models, seeds, grid, n_workers, backend_name, statistic, setup, options, daemons)
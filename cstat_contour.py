@@ -0,0 +1,49 @@
+"""
+ cstat_contour.py  -  pyXSPEC cstat confidence contours of two parameters
+ ---------------------------------------------------------------------------------
+ Author: V. Fioretti (INAF/OAS) valentina.fioretti@inaf.it
+ ---------------------------------------------------------------------------------
+ Dependencies:
+ - python 2.7
+ - numpy
+ - scipy
+ - matplotlib
+ - PyPDF2
+ - pyXSPEC running on Python 2.7
+  ---------------------------------------------------------------------------------
+ Parameters:
+ - model = name of the model (the .xcm file must be <model>_error.xcm, see cstat_onlyerror.py)
+ - statistic = 'cstat' or 'chi' (Statistic of the fit method)
+ - para_pair = numbers of the two parameters separated with space (e.g. "3 4")
+ - input_level = list of levels separated with space. Default is "2.30 4.61 9.21" (68.3%, 90% and 99% for two parameters)
+ - n_workers = int (optional). Number of XSPEC worker processes fitting the points of the grid. Default is 1.
+ - n_grid = int (optional). Number of points of the coarse grid on each axis. Default is 9.
+ - n_refine = int (optional). Number of refinements of the cells crossed by the contours. Default is 3.
+ - plot_latex = bool (optional). Render the plot with LaTeX (True) or with the matplotlib mathtext (False). Default is True.
+ The contours are plotted in <model>_error_contour_<p1>_<p2>.pdf, their polygons are written in <model>_error_contour_<p1>_<p2>.txt
+ and the grid in <model>_error_contour_<p1>_<p2>.npz.
+ --------------------------------------------------------------------------------
+ Usage example:
+ > python cstat_contour.py base10_60 "cstat" "3 4"
+ > python cstat_contour.py base10_60 "cstat" "3 4" "2.30 4.61" 8 9 4 False
+"""
+
+import sys
+
+import pyXIFU as px
+
+# Import the input parameters
+arg_list = sys.argv
+model = arg_list[1]
+statistic = arg_list[2]
+para_pair = [int(para_nb) for para_nb in arg_list[3].split(" ")]
+if len(arg_list) > 4:
+    input_level = [float(level) for level in arg_list[4].split(" ")]
+else:
+    input_level = [2.30, 4.61, 9.21]
+n_workers = int(arg_list[5]) if len(arg_list) > 5 else 1
+n_grid = int(arg_list[6]) if len(arg_list) > 6 else 9
+n_refine = int(arg_list[7]) if len(arg_list) > 7 else 3
+plot_latex = not (len(arg_list) > 8 and arg_list[8] == 'False')
+
+px.ml_get_contours(model+"_error", statistic, para_pair, level = input_level, n_grid = n_grid, n_refine = n_refine, n_workers = n_workers, plot_latex = plot_latex)
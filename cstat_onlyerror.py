@@ -14,7 +14,10 @@
   ---------------------------------------------------------------------------------
  Parameters:
  - model = name of the model (the .xcm file must be <model>.xcm)
- - input_level = chi2 level to evaluate a confidence interval
+ - input_level = chi2 level to evaluate a confidence interval, or list of levels separated with space (e.g. "1 2.706 6.635").
+ The profiles are scanned once up to the highest level and the interval of each level is extracted from them, <model>_list.txt
+ has one error_min_<level> error_max_<level> pair of columns per level. The lower levels are sampled with the step of the highest one,
+ interp_method = "spline" is recommended.
  - statistic = 'cstat' or 'chi' (Statistic of the fit method)
  - selection = 'all' or list of numbers separated with space (e.g. "1 2 3"). Select the parameters used to get the errors with a list of parameter number.
  - blacklist = list of strings. Contains the list of the parameters's name to be frozen before the error computation.
@@ -29,26 +32,36 @@
  +-----------+---------+---------+----------+---------+---------+---------+---------+---------+---------+
  
  - plot_statistic = bool. Used to plot or not the statistic graphs.
- - interp_method : str. Method for the interpolation of the statistic. "linear" uses a linear interpolation and the brentq method
- for a the root finding. "spline" uses a spline interpolation and find the roots with a scipy method in the spline class.
+ - interp_method : str. Method for the interpolation of the statistic. "linear" takes the crossing of the level on the segment between the two bracketing points,
+ "spline" the root of the cubic spline interpolation on that segment. The crossings closest to the best fit are kept.
+ - n_workers : int (optional). Number of worker processes, each parameter is profiled in its own XSPEC session. Default is 1.
+ - parallel_directions : bool (optional). Scan the left and right directions of each parameter at the same time 
+ in two XSPEC worker processes (only with n_workers = 1). Default is False.
+ - search_method : str (optional). "steppar" walks outward with a fixed step, "bracket" brackets the crossing of the level 
+ with a geometric expansion and refines it with the Brent method on constrained fits, "parabolic" verifies the covariance 
+ interval with two constrained fits per side and falls back to "bracket" when the profile is not parabolic. Default is "steppar".
+ - plot_latex : bool (optional). Render the statistic plots with LaTeX (True) or with the matplotlib mathtext (False, faster).
+ The plots are rendered in parallel once all the parameters are profiled and merged in <model>_error_plots.pdf. Default is True.
+ If the PYXIFU_DAEMON environment variable is set, the errors are evaluated by this daemon (daemon.py), where XSPEC and the responses 
+ are already loaded. matplotlib and PyPDF2 are only imported when plot_statistic is True.
+ - core_budget : int (optional). Total number of cores of the run, split between the worker processes and the XSPEC parallel fit 
+ (Xset.parallel.leven) of each worker from a short calibration of the fit time. It replaces n_workers and n_cores.
 
  --------------------------------------------------------------------------------
  Usage example:
  > python cstat_onlyerror.py base10_60 "cstat" "1 2 6"  [''] 1 1 True "linear"
+ > python cstat_onlyerror.py base10_60 "cstat" all  [''] 1 2.706 True "linear" 8
+ > python cstat_onlyerror.py base10_60 "cstat" all  [''] 1 2.706 True "linear" 1 True
+ > python cstat_onlyerror.py base10_60 "cstat" all  [''] 1 2.706 True "linear" 8 False "bracket"
+ > python cstat_onlyerror.py base10_60 "cstat" all  [''] 1 2.706 True "linear" 8 False "parabolic"
+ > python cstat_onlyerror.py base10_60 "cstat" all  [''] 1 "1 2.706 6.635" True "spline" 8
+ > python cstat_onlyerror.py base10_60 "cstat" all  [''] 1 2.706 True "linear" 8 False "steppar" False
+ > python cstat_onlyerror.py base10_60 "cstat" all  [''] 1 2.706 True "linear" 1 False "steppar" True 16
+ > PYXIFU_DAEMON=/tmp/pyxifu_0.sock python cstat_onlyerror.py base10_60 "cstat" all  [''] 1 2.706 False "linear" 8
 """
 
-import matplotlib.pyplot as plt
 import numpy as np
-from xspec import *
 import sys, os
-from scipy import interpolate  
-import matplotlib.backends.backend_pdf
-from matplotlib import rc
-import shutil
-import datetime
-
-
-import pyXIFU as px
 
 # Import the input parameters
 arg_list = sys.argv
@@ -57,9 +70,25 @@ statistic = arg_list[2]
 selection = arg_list[3]
 blacklist = arg_list[4]
 n_cores = np.int(arg_list[5])
-input_level = np.float(arg_list[6])
+input_level = [np.float(level) for level in arg_list[6].split(" ")]
+if len(input_level) == 1:
+    input_level = input_level[0]
 plot_statistic = bool(arg_list[7])
 interp_method = arg_list[8]
+if len(arg_list) > 9:
+    n_workers = int(arg_list[9])
+else:
+    n_workers = 1
+parallel_directions = len(arg_list) > 10 and arg_list[10] == 'True'
+if len(arg_list) > 11:
+    search_method = arg_list[11]
+else:
+    search_method = "steppar"
+plot_latex = not (len(arg_list) > 12 and arg_list[12] == 'False')
+if len(arg_list) > 13:
+    core_budget = int(arg_list[13])
+else:
+    core_budget = None
 
 
 if selection == 'all':
@@ -68,4 +97,10 @@ else:
     selection_list = list(arg_list[3].split(" "))
     selection_input = list(map(int, selection_list))
 
-px.ml_get_errors(model+"_error",'cstat',selection = selection_input, blacklist = blacklist, n_cores=n_cores,level=input_level, plot_statistic = plot_statistic, interp_method = interp_method)
+options = dict(selection = selection_input, blacklist = blacklist, n_cores=n_cores,level=input_level, plot_statistic = plot_statistic, interp_method = interp_method, n_workers = n_workers, parallel_directions = parallel_directions, search_method = search_method, plot_latex = plot_latex, core_budget = core_budget)
+if os.environ.get('PYXIFU_DAEMON'):
+    from daemon import ml_submit
+    ml_submit(os.environ['PYXIFU_DAEMON'], {'kind':'errors','model':model+"_error",'statistic':'cstat','options':options})
+else:
+    import pyXIFU as px
+    px.ml_get_errors(model+"_error",'cstat',**options)
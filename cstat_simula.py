@@ -5,28 +5,19 @@
  ---------------------------------------------------------------------------------
  Dependencies:
  - python 2.7
- - numpy
- - scipy
- - matplotlib
- - PyPDF2
  - pyXSPEC running on Python 2.7
   ---------------------------------------------------------------------------------
  Parameters:
  - model = name of the model (the .xcm file must be <model>.xcm)
+ If the PYXIFU_DAEMON environment variable is set, the simulation is run by this daemon (daemon.py),
+ where XSPEC and the responses are already loaded.
  --------------------------------------------------------------------------------
  Usage example:
  > python cstat_simula.py base10 
+ > PYXIFU_DAEMON=/tmp/pyxifu_0.sock python cstat_simula.py base10
 """
 
-import matplotlib.pyplot as plt
-import numpy as np
-from xspec import *
 import sys, os
-from scipy import interpolate  
-import matplotlib.backends.backend_pdf
-from matplotlib import rc
-import shutil
-import datetime
 
 
 
@@ -35,7 +26,12 @@ arg_list = sys.argv
 model = arg_list[1]
 
 # simulation
-Xset.restore(model+".xcm")
-Xset.restore("simula.xcm")
+if os.environ.get('PYXIFU_DAEMON'):
+    from daemon import ml_submit
+    ml_submit(os.environ['PYXIFU_DAEMON'], {'kind':'simulate','model':model,'setup':'simula'})
+else:
+    from xspec import *
+    Xset.restore(model+".xcm")
+    Xset.restore("simula.xcm")
 
-Xset.save(model+"_error.xcm",info="a") 
+    Xset.save(model+"_error.xcm",info="a") 
@@ -0,0 +1,221 @@
+"""
+    daemon.py  -  persistent worker of the pyXIFU error engine
+    ---------------------------------------------------------------------------------
+    Author: V. Fioretti (INAF/OAS) valentina.fioretti@inaf.it
+    ---------------------------------------------------------------------------------
+    Dependencies:
+    - python 2.7
+    - pyXSPEC running on Python 2.7 (backend=xspec)
+    ---------------------------------------------------------------------------------
+    MlWorkerDaemon is a long-running process holding one fit session. pyXSPEC, numpy
+    and scipy are imported once, and the spectra and responses of the last model stay
+    loaded between the jobs (see XspecBackend.restore). The jobs are sent on a local
+    socket (path of a Unix socket, or host:port) and run one after the other:
+    - 'simulate': restore <model>.xcm and the setup .xcm, save <model>_error.xcm (cstat_simula.py)
+    - 'errors': pyXIFU.ml_get_errors(model, statistic, **options) (cstat_onlyerror.py)
+    - 'campaign_item': campaign.ml_campaign_item(item, ...) (campaign.py)
+    - 'ping' and 'stop'
+    Each job runs in the directory of the client. matplotlib and PyPDF2 are only
+    imported by the jobs drawing plots. ml_submit sends a job and waits for its result.
+    Start one daemon per core to run jobs in parallel, e.g. the items of a campaign
+    (campaign.py daemons=...). cstat_simula.py and cstat_onlyerror.py send their job
+    to the daemon of the PYXIFU_DAEMON environment variable when it is set.
+    The jobs are pickled, so only the clients knowing the key of the daemons are accepted:
+    the key of the PYXIFU_AUTHKEY environment variable, or else a random key created in
+    ~/.pyxifu_authkey (mode 0600) and shared by the processes of the same user. The Unix
+    sockets are only accessible by their owner and the TCP sockets only bind the loopback.
+    ---------------------------------------------------------------------------------
+    Usage example:
+    > python daemon.py serve /tmp/pyxifu_0.sock
+    > python daemon.py serve /tmp/pyxifu_0.sock local
+    > python daemon.py simulate /tmp/pyxifu_0.sock base10 simula
+    > python daemon.py errors /tmp/pyxifu_0.sock base10_error cstat level=2.706 n_workers=8
+    > python daemon.py ping /tmp/pyxifu_0.sock
+    > python daemon.py stop /tmp/pyxifu_0.sock
+    """
+
+
+import os
+import sys
+import time
+import traceback
+import multiprocessing
+from multiprocessing.connection import Listener, Client
+
+_ml_authkey_file=os.path.join(os.path.expanduser('~'),'.pyxifu_authkey')
+_ml_loopback=['localhost','127.0.0.1']
+
+
+def ml_daemon_authkey():
+    """Function to get the key shared by the daemons and their clients: PYXIFU_AUTHKEY if it is set, otherwise the
+        key of ~/.pyxifu_authkey, created with a random key readable only by the user if it does not exist."""
+    if os.environ.get('PYXIFU_AUTHKEY'):
+        return os.environ['PYXIFU_AUTHKEY']
+    if not os.path.isfile(_ml_authkey_file):
+        try:
+            fd=os.open(_ml_authkey_file,os.O_WRONLY|os.O_CREAT|os.O_EXCL,0600)
+            with os.fdopen(fd,'w') as f:
+                f.write(os.urandom(32).encode('hex'))
+        except OSError:
+            pass # created by another process in the meantime
+    if os.stat(_ml_authkey_file).st_mode&0077:
+        raise RuntimeError(_ml_authkey_file+' must only be readable by its owner (chmod 600)')
+    with open(_ml_authkey_file) as f:
+        return f.read().strip()
+
+
+def ml_daemon_address(address):
+    """Function to convert the address of a daemon: 'host:port' is a TCP socket, anything else the path of a Unix socket.
+
+        Returns
+        -------
+        address : str or (str, int)
+        family : {'AF_UNIX', 'AF_INET'}
+        """
+    host,sep,port=address.rpartition(':')
+    if sep and port.isdigit():
+        return (host or 'localhost',int(port)),'AF_INET'
+    return address,'AF_UNIX'
+
+
+class MlWorkerDaemon(object):
+    """Long-running process holding one fit session and running the jobs received on a local socket.
+
+        Parameters
+        ----------
+        address : str
+        Path of the Unix socket, or host:port with host on the loopback (localhost or 127.0.0.1).
+        backend_name : {'xspec', 'local'}
+        Fit backend of backend.py used by the jobs.
+        """
+
+    def __init__(self,address,backend_name='xspec'):
+        self.address=address
+        self.backend_name=backend_name
+        self.backend=None
+        self.n_jobs=0
+        self.jobs={'ping':self.ping,'simulate':self.simulate,'errors':self.errors,'campaign_item':self.campaign_item}
+
+    def session(self):
+        """Fit backend of the daemon, created by the first job and kept for the next ones."""
+        if self.backend is None:
+            import backend
+            self.backend=backend.backends[self.backend_name]()
+        return self.backend
+
+    def ping(self,job):
+        return {'pid':os.getpid(),'n_jobs':self.n_jobs,'backend':self.backend_name}
+
+    def simulate(self,job):
+        backend=self.session()
+        backend.restore(job['model'])
+        backend.restore(job.get('setup') or 'simula')
+        backend.save(job['model']+'_error')
+        return {'xcm':job['model']+'_error'+backend.extension}
+
+    def errors(self,job):
+        import pyXIFU as px
+        return px.ml_get_errors(job['model'],job.get('statistic','cstat'),backend=self.session(),**job.get('options',{}))
+
+    def campaign_item(self,job):
+        import campaign
+        self.session()
+        return campaign.ml_campaign_item(job['item'],job['campaign_dir'],self.backend_name,job.get('statistic','cstat'),job.get('setup'),job.get('options',{}))
+
+    def run(self,job):
+        """Run a job in the directory of the client, the errors are returned with their traceback and the daemon goes on."""
+        start=time.time()
+        cwd=os.getcwd()
+        try:
+            if job.get('cwd'): os.chdir(job['cwd'])
+            result={'status':'done','result':self.jobs[job['kind']](job)}
+        except Exception:
+            result={'status':'error','traceback':traceback.format_exc()}
+        finally:
+            os.chdir(cwd)
+        self.n_jobs+=1
+        result['wall']=time.time()-start
+        print "<  INFO  > : Job",job['kind'],job.get('model',''),result['status'],"in",round(result['wall'],3),"s"
+        return result
+
+    def serve(self):
+        """Accept the jobs until a 'stop' job is received."""
+        address,family=ml_daemon_address(self.address)
+        if family=='AF_INET' and address[0] not in _ml_loopback:
+            raise ValueError('The daemon only listens on the loopback interface, not on '+address[0])
+        if family=='AF_UNIX' and os.path.exists(address): os.remove(address)
+        #------ The Unix socket is created without access for the group and the others ------
+        umask=os.umask(0077)
+        try:
+            listener=Listener(address,family,authkey=ml_daemon_authkey())
+        finally:
+            os.umask(umask)
+        if family=='AF_UNIX': os.chmod(address,0600)
+        print "<  INFO  > : pyXIFU daemon",os.getpid(),"listening on",self.address,"with the",self.backend_name,"backend"
+        try:
+            while True:
+                try:
+                    connection=listener.accept()
+                except (multiprocessing.AuthenticationError,IOError,EOFError):
+                    print "<  WARNING  > : Connection refused"
+                    continue
+                try:
+                    job=connection.recv()
+                    if job.get('kind')=='stop':
+                        connection.send({'status':'done','result':self.ping(job),'wall':0.})
+                        break
+                    connection.send(self.run(job))
+                except (IOError,EOFError):
+                    print "<  WARNING  > : Client disconnected"
+                finally:
+                    connection.close()
+        finally:
+            listener.close()
+        print "<  INFO  > : pyXIFU daemon stopped after",self.n_jobs,"jobs"
+
+
+def ml_submit(address,job):
+    """Function to send a job to a daemon and wait for its result.
+
+        Parameters
+        ----------
+        address : str
+        Address of the daemon, see ml_daemon_address.
+        job : dict
+        'kind' ('simulate', 'errors', 'campaign_item', 'ping' or 'stop') and the arguments of the job.
+        The job runs in the current directory unless 'cwd' is given.
+
+        Returns
+        -------
+        result : the value returned by the job, e.g. the statistics of ml_get_errors.
+        """
+    job=dict(job)
+    job.setdefault('cwd',os.getcwd())
+    address,family=ml_daemon_address(address)
+    connection=Client(address,family,authkey=ml_daemon_authkey())
+    try:
+        connection.send(job)
+        result=connection.recv()
+    finally:
+        connection.close()
+    if result['status']=='error':
+        raise RuntimeError('Job '+job['kind']+' failed in the daemon:\n'+result['traceback'])
+    return result['result']
+
+
+if __name__ == '__main__':
+    arg_list = sys.argv
+    command, address = arg_list[1], arg_list[2]
+    if command == 'serve':
+        MlWorkerDaemon(address, arg_list[3] if len(arg_list) > 3 else 'xspec').serve()
+    elif command == 'simulate':
+        print ml_submit(address, {'kind':'simulate','model':arg_list[3],'setup':arg_list[4] if len(arg_list) > 4 else None})
+    elif command == 'errors':
+        from campaign import ml_parse_option
+        options = {}
+        for arg in arg_list[5:]:
+            key, value = arg.split('=', 1)
+            options[key] = ml_parse_option(key, value)
+        print ml_submit(address, {'kind':'errors','model':arg_list[3],'statistic':arg_list[4],'options':options})
+    else:
+        print ml_submit(address, {'kind':command})
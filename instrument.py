@@ -0,0 +1,216 @@
+"""
+    instrument.py  -  instrumentation of the pyXIFU error engine
+    ---------------------------------------------------------------------------------
+    Author: V. Fioretti (INAF/OAS) valentina.fioretti@inaf.it
+    ---------------------------------------------------------------------------------
+    Dependencies:
+    - python 2.7
+    ---------------------------------------------------------------------------------
+    MlInstrument records the events of a run of the error engine (restores, fits with
+    their number of iterations, steps of the profiles with their delta statistic and
+    step size, retries, interpolations and plots) as JSON lines appended to a file,
+    one line per event written with a single call, so the worker processes can share it.
+    The events can also be sent to a multiprocessing queue, read live by stream.py.
+    ml_instrument_summary aggregates the events of a file per run and per parameter.
+
+    A profiler can be attached to some phases (e.g. 'fit' or 'restore'): it is enabled
+    only while these phases run and its statistics are dumped in
+    <events file>_<phase>_<pid>.prof (see the pstats module).
+    ---------------------------------------------------------------------------------
+    Usage example:
+    > python instrument.py base10_60_error_events.jsonl
+    > python instrument.py base10_60_error_events.jsonl 20261018T101500_4242
+    """
+
+
+import os
+import sys
+import json
+import time
+import datetime
+import contextlib
+
+
+class MlInstrument(object):
+    """Recorder of the events of the error engine, appended as JSON lines to a file.
+
+        Parameters
+        ----------
+        filename : str or None
+        JSON lines file of the events. If None, the events are not recorded.
+        run_id : str or None
+        Identifier of the run written in each event. Default is the start date and the process id.
+        profiler : 'cprofile', callable or None
+        Profiler enabled during the phases listed in phases. 'cprofile' uses cProfile.Profile, a callable
+        is called with the name of the phase and must return an object with the enable() and disable()
+        methods (e.g. a wrapper of a sampling profiler), and optionally dump_stats(filename).
+        phases : list of str or None
+        Phases profiled, e.g. ['fit','restore'].
+        queue : multiprocessing.Queue or None
+        If given, each event is also put in the queue, by the process recording it.
+        """
+
+    def __init__(self,filename=None,run_id=None,profiler=None,phases=None,queue=None):
+        self.filename=filename
+        self.queue=queue
+        self.run_id=run_id or datetime.datetime.now().strftime("%Y%m%dT%H%M%S")+'_'+str(os.getpid())
+        self.profiler=profiler
+        self.phases=set(phases or [])
+        self._profilers={}
+        self._active=[]
+        self._pid=os.getpid()
+
+    def event(self,kind,**fields):
+        """Append one event to the file, with the run identifier, process id and time."""
+        if self.filename is None and self.queue is None:
+            return
+        record={'run':self.run_id,'pid':os.getpid(),'time':time.time(),'kind':kind}
+        record.update(fields)
+        if self.queue is not None:
+            self.queue.put(record)
+        if self.filename is None:
+            return
+        line=json.dumps(record,sort_keys=True,default=_ml_json_default)+'\n'
+        with open(self.filename,'a') as f:
+            f.write(line)
+
+    @contextlib.contextmanager
+    def phase(self,kind,**fields):
+        """Context manager timing a phase and appending it as an event with its duration dt (s).
+
+            The fields yielded can be completed inside the phase (e.g. number of iterations of a fit).
+            """
+        profiler=self._start_profiler(kind)
+        start=time.time()
+        try:
+            yield fields
+        finally:
+            fields['dt']=time.time()-start
+            self._stop_profiler(profiler)
+            self.event(kind,**fields)
+
+    def _start_profiler(self,kind):
+        if kind not in self.phases or self.profiler is None:
+            return None
+        #------ The profilers of a forked worker process are its own ------
+        if self._pid!=os.getpid():
+            self._profilers,self._active,self._pid={},[],os.getpid()
+        if kind not in self._profilers:
+            if self.profiler=='cprofile':
+                import cProfile
+                self._profilers[kind]=cProfile.Profile()
+            else:
+                self._profilers[kind]=self.profiler(kind)
+        profiler=self._profilers[kind]
+        #------ Only one profiler is enabled at a time, a nested phase pauses the outer one ------
+        if self._active:
+            self._active[-1].disable()
+        profiler.enable()
+        self._active.append(profiler)
+        return profiler
+
+    def _stop_profiler(self,profiler):
+        if profiler is None:
+            return
+        profiler.disable()
+        self._active.pop()
+        if self._active:
+            self._active[-1].enable()
+
+    def dump_profiles(self):
+        """Write the statistics of the profilers of this process in <events file>_<phase>_<pid>.prof."""
+        if self._pid!=os.getpid():
+            return []
+        prefix=os.path.splitext(self.filename or 'pyXIFU_events')[0]
+        files=[]
+        for kind,profiler in sorted(self._profilers.items()):
+            if hasattr(profiler,'dump_stats'):
+                files.append(prefix+'_'+kind+'_'+str(os.getpid())+'.prof')
+                profiler.dump_stats(files[-1])
+        return files
+
+
+def _ml_json_default(value):
+    """Convert the numpy scalars and arrays of an event for json."""
+    if hasattr(value,'tolist'):
+        return value.tolist()
+    raise TypeError(repr(value)+' is not JSON serializable')
+
+
+def ml_load_events(filename,run_id=None):
+    """Function to read the events of a JSON lines file, of one run or of all the runs. Incomplete lines are skipped."""
+    events=[]
+    with open(filename) as f:
+        for line in f:
+            if not line.endswith('\n'):
+                continue
+            try:
+                event=json.loads(line)
+            except ValueError:
+                continue
+            if run_id is None or event['run']==run_id:
+                events.append(event)
+    return events
+
+
+def _ml_accumulate(summary,event):
+    """Add an event to the counters of its kind: number, total and maximum duration, iterations and retry reasons."""
+    counters=summary.setdefault(event['kind'],{'n':0,'t':0.,'t_max':0.,'iterations':0})
+    counters['n']+=1
+    if 'dt' in event:
+        counters['t']+=event['dt']
+        counters['t_max']=max(counters['t_max'],event['dt'])
+    if event.get('iterations') is not None:
+        counters['iterations']+=event['iterations']
+    if 'reason' in event:
+        counters.setdefault('reasons',{})
+        counters['reasons'][event['reason']]=counters['reasons'].get(event['reason'],0)+1
+
+
+def ml_instrument_summary(filename,run_id=None):
+    """Function to aggregate the events of a JSON lines file per run and per parameter.
+
+        Parameters
+        ----------
+        filename : str
+        JSON lines file of the events.
+        run_id : str or None
+        Run to aggregate. Default is all the runs of the file.
+
+        Returns
+        -------
+        summary : dict
+        'runs': {run: {kind: counters}} and 'parameters': {(run, para_nb): {kind: counters}}, the counters of
+        each kind of event are the number of events n, their total and maximum duration t and t_max (s),
+        the total number of fit iterations and the number of retries per reason.
+        """
+    summary={'runs':{},'parameters':{}}
+    for event in ml_load_events(filename,run_id):
+        _ml_accumulate(summary['runs'].setdefault(event['run'],{}),event)
+        if event.get('para_nb') is not None:
+            _ml_accumulate(summary['parameters'].setdefault((event['run'],event['para_nb']),{}),event)
+    return summary
+
+
+def ml_print_instrument_summary(summary):
+    """Function to print the summary returned by ml_instrument_summary, one table per run."""
+    for run in sorted(summary['runs']):
+        print "<  INFO  > : Run",run
+        print "%-12s %8s %12s %12s %12s %10s" % ('event','n','t_total','t_mean','t_max','iter')
+        for kind,counters in sorted(summary['runs'][run].items()):
+            print "%-12s %8d %12.3f %12.6f %12.6f %10d" % (kind,counters['n'],counters['t'],counters['t']/counters['n'],counters['t_max'],counters['iterations'])
+            for reason,n in sorted(counters.get('reasons',{}).items()):
+                print "%-12s %8d   %s" % ('',n,reason)
+        parameters=sorted([key[1] for key in summary['parameters'] if key[0]==run])
+        if parameters:
+            print "%-8s %8s %12s %10s %10s %12s %8s %8s" % ('para_nb','fits','t_fit','iter','restores','t_restore','steps','retries')
+        for para_nb in parameters:
+            counters=summary['parameters'][(run,para_nb)]
+            get=lambda kind,key: counters.get(kind,{}).get(key,0)
+            print "%-8d %8d %12.3f %10d %10d %12.3f %8d %8d" % (para_nb,get('fit','n'),get('fit','t'),get('fit','iterations'),get('restore','n'),get('restore','t'),get('step','n'),get('retry','n'))
+
+
+if __name__ == '__main__':
+    arg_list = sys.argv
+    run_id = arg_list[2] if len(arg_list) > 2 else None
+    ml_print_instrument_summary(ml_instrument_summary(arg_list[1],run_id))
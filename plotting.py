@@ -4,18 +4,79 @@ from matplotlib.ticker import FuncFormatter
 from matplotlib import rc
 import numpy as np
 import matplotlib.pyplot as plt
-from xspec import *
+try:
+    from xspec import *
+except ImportError:
+    pass  # only ml_plots and ml_plotting_statistics_errors without name and unit need pyXSPEC
 
 rc('text', usetex=True)
 rc('legend',fontsize=20)
 
-def ml_plots(filename,expression,filexcm,x_min=0,x_max=0,sigma_res=3,redshift=0):
-    Xset.chatter=0
-    Xset.restore(filexcm)
+def ml_spectrum_command(expression):
+    # XSPEC plot command of the upper panel of an expression and the unit of its flux
+    if 'eeufspec' in expression:
+        return "eeufspec","\mathrm{keV}^2~ (\mathrm{Photons}~ \mathrm{cm}^{-2}\,\mathrm{s}^{-1}\,\mathrm{keV}^{-1})"
+    elif 'eufspec' in expression:
+        return "eufspec","\mathrm{keV}~ (\mathrm{Photons}~ \mathrm{cm}^{-2}\,\mathrm{s}^{-1}\,\mathrm{keV}^{-1})"
+    elif 'ufspec' in expression:
+        return "ufspec","\mathrm{Photons}~ \mathrm{cm}^{-2}\,\mathrm{s}^{-1}\,\mathrm{keV}^{-1}"
+    raise ValueError("Unknown spectrum expression "+expression+", expected eeufspec, eufspec or ufspec")
+
+def ml_plot_arrays(commands):
+    # one XSPEC plot of all the commands (one window each), the arrays of every window are fetched once
     Plot.device='\null'
-    Plot.redshift=redshift
+    Plot.xAxis=('keV')
+    Plot(*commands)
+    arrays={}
+    for window,command in enumerate(commands,1):
+        arrays[command]={'x':np.array(Plot.x(1,window)),'x_err':np.array(Plot.xErr(1,window)),'y':np.array(Plot.y(1,window)),'y_err':np.array(Plot.yErr(1,window))}
+        if command!='delchi':
+            arrays[command]['model']=np.array(Plot.model(1,window))
+    return arrays
+
+def ml_display_groups(n,max_points):
+    # first channel of each group of adjacent channels when n channels are drawn with at most max_points points
+    if max_points is None or n<=max_points:
+        return np.arange(n)
+    return np.unique(np.linspace(0,n,max_points+1).astype(int)[:-1])
+
+def ml_rebin_display(x,x_err,y,y_err,max_points,residuals=False):
+    # display-only rebinning of the data points, the fit is not changed: the fluxes of a group of channels are
+    # averaged with the channel widths and their errors combined, the residuals (delchi) of a group are
+    # summed and divided by the square root of its size so that they stay in units of sigma
+    starts=ml_display_groups(len(x),max_points)
+    if len(starts)==len(x):
+        return x,x_err,y,y_err
+    sizes=np.diff(np.append(starts,len(x)))
+    low,high=(x-x_err)[starts],(x+x_err)[np.append(starts[1:],len(x))-1]
+    if residuals:
+        y_new=np.add.reduceat(y,starts)/np.sqrt(sizes)
+        y_err_new=np.sqrt(np.add.reduceat(y_err**2,starts)/sizes)
+    else:
+        widths=2*x_err
+        total=np.add.reduceat(widths,starts)
+        y_new=np.add.reduceat(widths*y,starts)/total
+        y_err_new=np.sqrt(np.add.reduceat((widths*y_err)**2,starts))/total
+    return 0.5*(low+high),0.5*(high-low),y_new,y_err_new
+
+def ml_downsample_minmax(x,y,max_points):
+    # shape-preserving downsampling of the model: each group of adjacent channels keeps its minimum and
+    # maximum in channel order, so the narrow lines keep their peak with at most max_points points
+    starts=ml_display_groups(len(x),None if max_points is None else max(max_points//2,1))
+    if len(starts)==len(x):
+        return x,y
+    ends=np.append(starts[1:],len(x))
+    order=np.lexsort((y,np.repeat(np.arange(len(starts)),ends-starts)))
+    i_min,i_max=order[starts],order[ends-1]
+    index=np.column_stack([np.minimum(i_min,i_max),np.maximum(i_min,i_max)]).ravel()
+    return x[index],y[index]
+
+def ml_plotting_spectrum(filename,expression,arrays,energy_range,x_min=0,x_max=0,sigma_res=3,redshift=0,max_points=4000,latex=True):
+    # spectrum of an expression from the arrays of ml_plot_arrays, with at most max_points data points and
+    # model points per panel (None draws every channel), energy_range is the band of the data (keV)
+    command,flux_unit=ml_spectrum_command(expression)
     if redshift>0:
-        rest_en='Rest ~'
+        rest_en=r'\mathrm{Rest}~'
     else:
         rest_en=''
     plt.rc('legend',fontsize=20)
@@ -23,7 +84,7 @@ def ml_plots(filename,expression,filexcm,x_min=0,x_max=0,sigma_res=3,redshift=0)
     plt.rc('ytick',labelsize=20)
     plt.rc('axes', titlesize=20)     # fontsize of the axes title
     plt.rc('axes', labelsize=20)
-    plt.rc('text', usetex=True)
+    plt.rc('text', usetex=latex)
     plt.rcParams['xtick.major.pad']='8'
     plt.rcParams['ytick.major.pad']='8'
     #plt.rc( 'font', size=20, family="Times" )   # use a font with serifs
@@ -34,65 +95,116 @@ def ml_plots(filename,expression,filexcm,x_min=0,x_max=0,sigma_res=3,redshift=0)
     else:
         fig, axs = plt.subplots(1, sharex=True, sharey=False,clear=True, gridspec_kw={'hspace': 0},figsize=(12,9),tight_layout=True)
         upper_panel=axs
-    if 'eeufspec' in expression:
-            Plot("eeufspec")
-            flux_unit="\mathrm{keV}^2~ (\mathrm{Photons}~ \mathrm{cm}^{-2}\,\mathrm{s}^{-1}\,\mathrm{keV}^{-1})"
-    elif 'eufspec' in expression:
-            Plot("eufspec")
-            flux_unit="\mathrm{keV}~ (\mathrm{Photons}~ \mathrm{cm}^{-2}\,\mathrm{s}^{-1}\,\mathrm{keV}^{-1})"
-    elif 'ufspec' in expression:
-            Plot("ufspec")
-            flux_unit="\mathrm{Photons}~ \mathrm{cm}^{-2}\,\mathrm{s}^{-1}\,\mathrm{keV}^{-1}"
-            
-    Plot.xAxis=('keV')
-    x = Plot.x()
-    y = np.array(Plot.y())
-    xErrs = Plot.xErr()
-    yErrs = Plot.yErr()
-    folded = np.array(Plot.model())
+
+    def displayed(panel):
+        # channels of the displayed band only, so that the point budget is spent where the plot is seen
+        x=arrays[panel]['x']
+        if x_min!=0 or x_max!=0:
+            return (x>=x_min-1e-2)&(x<=x_max+1e-2)
+        return np.ones(len(x),dtype=bool)
+
     linewidth=0.5
     if x_min!=0 or x_max!=0:
         upper_panel.set_xlim(x_min-1e-2,x_max+1e-2)
     else:
-        upper_panel.set_xlim(np.min(AllData(1).energies)*(1+redshift),np.max(AllData(1).energies)*(1+redshift)+1e-2)
+        upper_panel.set_xlim(energy_range[0]*(1+redshift),energy_range[1]*(1+redshift)+1e-2)
 
     upper_panel.set_xscale("log")
     upper_panel.set_yscale("log")
     upper_panel.xaxis.set_minor_formatter(ticker.ScalarFormatter(useMathText=True))
     upper_panel.xaxis.set_major_formatter(ticker.ScalarFormatter(useMathText=True))    
-    energies=np.array([0.01,0.02,0.03,0.04,0.05,0.06,0.07,0.08,0.09,0.1,0.2,0.3,0.4,0.5,0.6,0.7,0.8,0.9,1,2,3,4,5,6,7,8,9,10,11,12])
-    xticks=energies[np.intersect1d(np.where(energies>np.min(AllData(1).energies)*(1+redshift)),np.where(energies<np.max(AllData(1).energies)*(1+redshift)))]
     upper_panel.set_xticks([1,10])
     #upper_panel.set_xticks(, minor = True)
     upper_panel.xaxis.set_minor_formatter(ticker.ScalarFormatter(useMathText=True))
 
     upper_panel.set_xticklabels([r"$%.2f$" % i for i in [0.6,0.7,0.8,0.9,2,3,4,5,6,7,8,9]],minor=True)
+    spectrum=arrays[command]
+    band=displayed(command)
+    x,xErrs,y,yErrs=ml_rebin_display(spectrum['x'][band],spectrum['x_err'][band],spectrum['y'][band],spectrum['y_err'][band],max_points)
     upper_panel.errorbar(x,y,xerr=xErrs,yerr=yErrs,fmt='none',elinewidth =linewidth, capsize=0,ecolor = 'k')
+    x,folded=ml_downsample_minmax(spectrum['x'][band],spectrum['model'][band],max_points)
     upper_panel.step( x, folded,"blue",linewidth=2.)
     upper_panel.set_ylabel(r"$"+flux_unit+"$",labelpad=8)
-    upper_panel.set_xlabel(r'$\mathrm{'+rest_en+' Energy~ (keV)}$',fontsize=20)
+    upper_panel.set_xlabel(r'$'+rest_en+'\mathrm{Energy}~(\mathrm{keV})$',fontsize=20)
 
     upper_panel.tick_params(axis="both",which="both",direction="in",length=4,top=True,right=True)
     upper_panel.tick_params(axis="both",which="major",direction="in",length=10,top=True,right=True)
 
     if 'de' in expression: 
-        Plot("delchi")
-        x = Plot.x()
-        y = np.array(Plot.y())
-        xErrs = Plot.xErr()
-        yErrs = Plot.yErr()
+        residuals=arrays['delchi']
+        band=displayed('delchi')
+        x,xErrs,y,yErrs=ml_rebin_display(residuals['x'][band],residuals['x_err'][band],residuals['y'][band],residuals['y_err'][band],max_points,residuals=True)
         lower_panel.errorbar(x,y,yerr=yErrs,xerr=xErrs,fmt='none',elinewidth =linewidth, capsize=0,markersize=2.,ecolor = 'k')
         lower_panel.axhline(0.,color='k')
         lower_panel.set_ylabel(r"$\sigma=\mathrm{(data-model)}$/$\mathrm{error}$",labelpad=35)
         lower_panel.set_ylim(-np.std(y)*sigma_res,np.std(y)*sigma_res)
         lower_panel.tick_params(axis="both",which="both",direction="in",length=4,top=True,right=True)
-        lower_panel.set_xlabel(r'$\mathrm{'+rest_en+' Energy~ (keV)}$',fontsize=20)
+        lower_panel.set_xlabel(r'$'+rest_en+'\mathrm{Energy}~(\mathrm{keV})$',fontsize=20)
     
-    fig.savefig(filename+" "+expression+".pdf")    
-    
-def ml_plotting_statistics_errors(xnew,f,err_min,err_max,par_list,cost_list,initial_value,para_nb,statistic,level,filexcm,interp_method):
+    fig.savefig(filename+" "+expression+".pdf")
+    plt.close(fig)
+    return filename+" "+expression+".pdf"
+
+def ml_plots(filename,expression,filexcm,x_min=0,x_max=0,sigma_res=3,redshift=0,max_points=4000,latex=True):
+    # spectra of one expression or of a list of expressions (e.g. ["eeufspec delchi","ufspec"]) saved in
+    # <filename> <expression>.pdf: the .xcm file is restored once and the plot arrays of all the
+    # expressions are fetched with a single XSPEC plot
+    expressions=[expression] if isinstance(expression,str) else list(expression)
     Xset.chatter=0
     Xset.restore(filexcm)
+    Plot.redshift=redshift
+    commands=[]
+    for one in expressions:
+        commands+=[command for command in [ml_spectrum_command(one)[0]]+(['delchi'] if 'de' in one else []) if command not in commands]
+    arrays=ml_plot_arrays(commands)
+    energies=np.array(AllData(1).energies)
+    energy_range=(np.min(energies),np.max(energies))
+    return [ml_plotting_spectrum(filename,one,arrays,energy_range,x_min,x_max,sigma_res,redshift,max_points,latex) for one in expressions]
+    
+def ml_axis_label(name,unit):
+    # label of a parameter axis: name without underscores and unit with the exponents in LaTeX
+    reform_name=name
+    if '_' in name:
+        reform_name=reform_name.replace('_',' ',10)
+    if unit!='':
+        if '^-' in unit:
+            reform_unit=unit
+            index_symbol=reform_unit.index('^')
+            L=[]
+            for s in reform_unit[index_symbol+2:].split():
+                if  s.isdigit():
+                    L.append(int(s))
+                else:
+                    break
+            reform_unit=reform_unit.replace('^-','^{-',1)
+            reform_unit=reform_unit.replace(str(L[0]),str(L[0])+'}')
+            units_str=' $('+reform_unit+')$'
+        elif '^' in unit:
+            reform_unit=unit
+            index_symbol=reform_unit.index('^')
+            L=[]
+            for s in reform_unit[index_symbol+1:].split():
+                if  s.isdigit():
+                    L.append(int(s))
+                else:
+                    break
+            reform_unit=reform_unit.replace('^','^',1)
+            reform_unit=reform_unit.replace(str(L[0]),'{'+str(L[0])+'}')
+            units_str=' $('+reform_unit+')$'
+        else:
+            units_str=' ('+unit+')'
+    else:
+        units_str=''
+    return reform_name+units_str
+
+def ml_plotting_statistics_errors(xnew,f,err_min,err_max,par_list,cost_list,initial_value,para_nb,statistic,level,filexcm,interp_method,name=None,unit=None,latex=True):
+    # latex=False renders the labels with the matplotlib mathtext instead of spawning LaTeX,
+    # the rc setting must also be active when the figure is saved
+    rc('text', usetex=latex)
+    if name is None or unit is None:
+        Xset.chatter=0
+        Xset.restore(filexcm)
+        name,unit=AllModels(1)(para_nb).name,AllModels(1)(para_nb).unit
     rc('legend',fontsize=14)
     rc('xtick',labelsize=14)
     rc('axes', titlesize=14)   # fontsize of the axes title  
@@ -117,42 +229,43 @@ def ml_plotting_statistics_errors(xnew,f,err_min,err_max,par_list,cost_list,init
     plt.scatter(par_list,cost_list,marker='o',color='r')
     plt.axhline(y=level,label=r"$\Delta "+name_tag+"="+str(level)+"$",color='forestgreen')
     plt.text(0.5,0.9,r' Best fit value = $'+str(formatting %initial_value)+'^{+'+str(formatting %err_max)+'}_{-'+str(formatting %err_min)+'}$',fontsize=18, horizontalalignment='center',verticalalignment='center', transform=ax.transAxes)
-    reform_name=AllModels(1)(para_nb).name
-    if '_' in AllModels(1)(para_nb).name:
+    reform_name=name
+    if '_' in name:
         reform_name=reform_name.replace('_',' ',10)
     plt.title("Parameter "+str(para_nb)+" : "+reform_name,fontsize=20)
-    if AllModels(1)(para_nb).unit!='':
-        if '^-' in AllModels(1)(para_nb).unit:
-            reform_unit=AllModels(1)(para_nb).unit
-            index_symbol=reform_unit.index('^')
-            L=[]
-            for s in reform_unit[index_symbol+2:].split():
-                if  s.isdigit():
-                    L.append(int(s))
-                else:
-                    break
-            reform_unit=reform_unit.replace('^-','^{-',1)
-            reform_unit=reform_unit.replace(str(L[0]),str(L[0])+'}')
-            units_str=' $('+reform_unit+')$'
-        elif '^' in AllModels(1)(para_nb).unit:
-            reform_unit=AllModels(1)(para_nb).unit
-            index_symbol=reform_unit.index('^')
-            L=[]
-            for s in reform_unit[index_symbol+1:].split():
-                if  s.isdigit():
-                    L.append(int(s))
-                else:
-                    break
-            reform_unit=reform_unit.replace('^','^',1)
-            reform_unit=reform_unit.replace(str(L[0]),'{'+str(L[0])+'}')
-            units_str=' $('+reform_unit+')$'
-        else:
-            units_str=' ('+AllModels(1)(para_nb).unit+')'
-    else:
-        units_str=''
-    plt.xlabel(r''+reform_name+units_str,fontsize=14)
+    plt.xlabel(r''+ml_axis_label(name,unit),fontsize=14)
     plt.ylabel(r"$\Delta "+name_tag+"$",fontsize=14)
     plt.xticks(fontsize=14)
     plt.yticks(fontsize=14)
     plt.legend(fontsize=15)
     return fig
+
+def ml_plotting_contours(x,y,dstat,points,polygons,levels,best,para_pair,names,units,statistic,latex=True):
+    # contours of the delta statistic of two parameters (ml_get_contours), the fitted points of the
+    # adaptive grid are shown in grey
+    rc('text', usetex=latex)
+    rc('legend',fontsize=14)
+    rc('xtick',labelsize=14)
+    rc('axes', titlesize=14)
+    rc('axes', labelsize=14)
+    if statistic=="chi":
+        name_tag="\chi^2"
+    elif statistic=="cstat":
+        name_tag="cstat"
+    colors=['forestgreen','blue','red','orange','purple']
+    fig=plt.figure(figsize=(9,8))
+    fig.add_axes([0,0,1,1])
+    plt.scatter(points[:,0],points[:,1],marker='.',s=6,color='grey')
+    for k,level in enumerate(levels):
+        for n,polygon in enumerate(polygons[level]):
+            plt.plot(polygon[:,0],polygon[:,1],color=colors[k%len(colors)],label=r"$\Delta "+name_tag+"="+str(level)+"$" if n==0 else None)
+    plt.scatter([best[0]],[best[1]],marker='+',s=200,color='k')
+    plt.xlim(x[0],x[-1])
+    plt.ylim(y[0],y[-1])
+    plt.title("Parameters "+str(para_pair[0])+" and "+str(para_pair[1]),fontsize=20)
+    plt.xlabel(r''+ml_axis_label(names[0],units[0]),fontsize=14)
+    plt.ylabel(r''+ml_axis_label(names[1],units[1]),fontsize=14)
+    plt.xticks(fontsize=14)
+    plt.yticks(fontsize=14)
+    plt.legend(fontsize=15)
+    return fig
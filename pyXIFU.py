@@ -8,9 +8,9 @@
     - python 2.7
     - numpy
     - scipy
-    - matplotlib
-    - PyPDF2
-    - pyXSPEC running on Python 2.7
+    - matplotlib (imported only when a plot is drawn)
+    - PyPDF2 (imported only when the plots are merged)
+    - pyXSPEC running on Python 2.7 (not needed with the LocalBackend of backend.py)
     ---------------------------------------------------------------------------------
     Example:
     import pyXIFU as px
@@ -19,23 +19,62 @@
 
 
 import numpy as np
-from xspec import *
 import os
 from scipy import interpolate  
-import matplotlib.backends.backend_pdf
-from PyPDF2 import PdfFileMerger, PdfFileReader
 import sys
 import shutil
 import datetime
-from plotting import ml_plots,ml_plotting_statistics_errors
+import time
+import multiprocessing
 from scipy.optimize import brentq
-import matplotlib.pyplot as plt
+from backend import XspecBackend,LocalBackend
+from store import MlProfileBuffer,MlResultsTable,MlColumnStore,ml_scalar_dtype,ml_scalar_rows
+from instrument import MlInstrument,ml_instrument_summary,ml_print_instrument_summary
+from cache import MlProfileCache,ml_cache_key
+from scheduler import MlCoreScheduler
 
-Xset.chatter=0
+_ml_backend=None
+_ml_instrument=None
+_ml_fit_control={'stream':None,'max_fits':None,'counts':{}}
+
+def ml_plots(*args,**kwargs):
+    """Function to plot the spectra, see plotting.ml_plots. matplotlib is only imported by the jobs drawing plots."""
+    from plotting import ml_plots as plots
+    return plots(*args,**kwargs)
+
+def ml_set_backend(backend):
+    """Function to select the fit backend used by the error engine (XspecBackend or LocalBackend of backend.py)."""
+    global _ml_backend
+    _ml_backend=backend
+    return backend
+
+def ml_get_backend():
+    """Function to get the fit backend used by the error engine. The XSPEC backend is created by default."""
+    if _ml_backend is None:
+        ml_set_backend(XspecBackend())
+    return _ml_backend
+
+def ml_set_instrument(instrument):
+    """Function to select the instrumentation (MlInstrument of instrument.py) recording the events of the error engine."""
+    global _ml_instrument
+    _ml_instrument=instrument
+    return instrument
+
+def ml_get_instrument():
+    """Function to get the instrumentation of the error engine. By default the events are not recorded."""
+    if _ml_instrument is None:
+        ml_set_instrument(MlInstrument())
+    return _ml_instrument
+
+def ml_set_fit_control(stream=None,max_fits=None):
+    """Function to set the stop requests (MlStreamControl of stream.py) and the fit budget per parameter of the profiles."""
+    _ml_fit_control.update({'stream':stream,'max_fits':max_fits,'counts':{}})
 
 def ml_interpolation_statistics_errors(initial_value,x_graph,y_graph,hardcap_hit,level,interp_method="linear"):
     """Function to interpolate the fit statistic and compute the roots.
         
+        The roots are found by ml_interval_crossings, the dense curve is built by ml_profile_curve.
+
         Parameters
         ----------
         initial_value : float
@@ -49,40 +88,1452 @@ def ml_interpolation_statistics_errors(initial_value,x_graph,y_graph,hardcap_hit
         level : float
         Statistic level to evaluate the confidence interval.
         method : str
-        Method for the interpolation of the statistic. "linear" uses a linear interpolation and the brentq method
-        for a the root finding. "spline" uses a spline interpolation and find the roots with a scipy method in the spline class.
+        Method for the interpolation of the statistic. "linear" takes the crossing of the level on the segment between the two bracketing points,
+        "spline" the root of the cubic spline interpolation on that segment. The crossings closest to the best fit are kept.
         
         """
-    xnew=np.linspace(min(x_graph),max(x_graph),10000)
-    
+    root_min,root_max=ml_interval_crossings(x_graph,y_graph,level,interp_method)
+    root_min,root_max=root_min[0,0],root_max[0,0]
+    xnew,f=ml_profile_curve(x_graph,y_graph,level,interp_method)
+    if hardcap_hit=="None":
+        return np.abs(initial_value-root_min),np.abs(root_max-initial_value),xnew,f
+    elif hardcap_hit[0]:
+        return np.abs(initial_value-root_max),xnew,f
+    elif hardcap_hit[1]:
+        return np.abs(initial_value-root_min),xnew,f
+
+
+def _ml_pad_profiles(arrays):
+    """Stack 1D arrays of different lengths in a 2D array padded with NaN."""
+    stacked=np.full((len(arrays),max([len(a) for a in arrays])),np.nan)
+    for i,a in enumerate(arrays):
+        stacked[i,:len(a)]=a
+    return stacked
+
+
+def ml_interval_crossings(x_graph,y_graph,levels,interp_method="linear"):
+    """Function to find the crossings of statistic levels on both sides of the minimum of sampled profiles.
+
+        The crossings are searched on the segments between the sampled points that bracket the level, 
+        closest to the lowest point of each profile. "linear" gives the exact crossing of the segment, 
+        "spline" the root of the interpolating cubic spline on the segment (not-a-knot spline, the one of 
+        InterpolatedUnivariateSpline) found by bisection. All the profiles and levels are solved together.
+
+        Parameters
+        ----------
+        x_graph : numpy array (n_points,) or (n_profiles, n_points), or list of 1D arrays
+        Sorted parameter values of each profile. The profiles of a 2D array are padded with NaN at the end.
+        y_graph : same as x_graph
+        Fit statistic minus the best fit statistic.
+        levels : float or numpy array (n_levels,)
+        Statistic levels.
+        interp_method : {'linear', 'spline'}
+        Interpolation of the statistic between the points.
+
+        Returns
+        -------
+        root_min, root_max : numpy array (n_profiles, n_levels)
+        Crossing on the left and on the right side of the minimum, NaN if the level is not crossed on that side.
+        """
+    if isinstance(x_graph,list) and len(x_graph)>0 and np.ndim(x_graph[0])==1:
+        x_graph,y_graph=_ml_pad_profiles(x_graph),_ml_pad_profiles(y_graph)
+    x=np.atleast_2d(np.asarray(x_graph,dtype=float))
+    y=np.atleast_2d(np.asarray(y_graph,dtype=float))
+    levels=np.atleast_1d(np.asarray(levels,dtype=float))
+    n_profiles,n_points=x.shape
+    imin=np.argmin(np.where(np.isnan(y),np.inf,y),axis=1)
+    d=y[:,None,:]-levels[None,:,None]
+    d0,d1=d[:,:,:-1],d[:,:,1:]
+    with np.errstate(invalid='ignore'):
+        cross=(d0*d1<=0)&(d0!=d1)
+    segment=np.arange(n_points-1)[None,None,:]
+    left=cross&(segment<imin[:,None,None])
+    right=cross&(segment>=imin[:,None,None])
+    rows=np.arange(n_profiles)[:,None]
+    cols=np.arange(len(levels))[None,:]
+    roots=[]
+    for side,j in [(left,n_points-2-np.argmax(left[:,:,::-1],axis=2)),(right,np.argmax(right,axis=2))]:
+        x0,x1=x[rows,j],x[rows,j+1]
+        y0,y1=d0[rows,cols,j],d1[rows,cols,j]
+        root=x0+y0/(y0-y1)*(x1-x0)
+        if interp_method=="spline":
+            root=_ml_spline_roots(x,y,levels,j,x0,x1,y0)
+        roots.append(np.where(side.any(axis=2),root,np.nan))
+    return roots[0],roots[1]
+
+
+def _ml_spline_roots(x,y,levels,j,x0,x1,y0,n_iterations=60):
+    """Roots of the interpolating cubic splines of the profiles on the segments j, by bisection."""
+    coefficients=np.full((x.shape[0],4,x.shape[1]-1),np.nan)
+    for i in range(x.shape[0]):
+        finite=np.isfinite(x[i])&np.isfinite(y[i])
+        if finite.sum()>=2:
+            coefficients[i,:,:finite.sum()-1]=interpolate.CubicSpline(x[i][finite],y[i][finite]).c
+    rows=np.arange(x.shape[0])[:,None]
+    c=[coefficients[rows,k,j] for k in range(4)]
+    c[3]=c[3]-levels[None,:]
+    low,high=np.zeros(j.shape),x1-x0
+    sign_low=np.sign(y0)
+    for iteration in range(n_iterations):
+        middle=0.5*(low+high)
+        value=((c[0]*middle+c[1])*middle+c[2])*middle+c[3]
+        same=np.sign(value)==sign_low
+        low,high=np.where(same,middle,low),np.where(same,high,middle)
+    return x0+0.5*(low+high)
+
+
+def ml_profile_curve(x_graph,y_graph,level,interp_method="linear",n_points=10000):
+    """Function to build the dense interpolated curve of a profile, only used for the plots.
+
+        Returns
+        -------
+        xnew : numpy array
+        n_points values between the first and the last point of the profile.
+        f : callable
+        Interpolation of the statistic minus the level ("linear") or of the statistic ("spline"), 
+        as expected by ml_plotting_statistics_errors.
+        """
+    xnew=np.linspace(min(x_graph),max(x_graph),n_points)
     if interp_method=="linear":
-        f=interpolate.interp1d(x_graph,y_graph-level)
-        ynew=f(xnew)
-        if hardcap_hit=="None":
-            root_min = brentq(f,min(xnew),xnew[np.where(ynew==min(ynew))])
-            root_max = brentq(f,xnew[np.where(ynew==min(ynew))],max(xnew))
-            return np.abs(initial_value-root_min),np.abs(root_max-initial_value),xnew,f
-        elif hardcap_hit[0]:
-            root_max = brentq(f,xnew[np.where(ynew==min(ynew))],max(xnew))
-            return np.abs(initial_value-root_max),xnew,f
-        elif hardcap_hit[1]:
-            root_min = brentq(f,min(xnew),xnew[np.where(ynew==min(ynew))])
-            return np.abs(initial_value-root_min),xnew,f
+        f=interpolate.interp1d(x_graph,np.asarray(y_graph)-level)
     elif interp_method=="spline":
         f=interpolate.InterpolatedUnivariateSpline(x_graph,y_graph)
-        yreduced=y_graph-level
-        freduced=interpolate.InterpolatedUnivariateSpline(x_graph, yreduced)
-        if hardcap_hit=="None":
-            return initial_value-freduced.roots()[0],freduced.roots()[1]-initial_value,xnew,f
-        elif hardcap_hit[0]:
-            return np.abs(initial_value-freduced.roots()[0]),xnew,f
-        elif hardcap_hit[1]:
-            return np.abs(initial_value-freduced.roots()[0]),xnew,f
+    return xnew,f
+
+
+def ml_snapshot_state(filexcm,in_memory=True):
+    """Function to capture the model state of the fit session in memory.
+
+        Parameters
+        ----------
+        filexcm : str
+        Name of the .xcm XSPEC file (without extension) holding the same state on disk.
+        in_memory : bool
+        If False, ml_restore_state always restores the state from the .xcm file.
+
+        Returns
+        -------
+        snapshot : dict
+        Values, sigma, frozen flag and link of every parameter, fit settings and data fingerprint.
+        """
+    backend=ml_get_backend()
+    pars=[]
+    for i in range(1,backend.n_parameters()+1):
+        pars.append({'values':backend.get_values(i),'sigma':backend.sigma(i),'frozen':backend.is_frozen(i),'link':backend.link(i)})
+    return {'xcm':filexcm,'in_memory':in_memory,'data':backend.data_fingerprint(),'pars':pars,'fit':backend.fit_settings()}
+
+
+def ml_restore_state(snapshot,para_nb=None):
+    """Function to reset the fit session to a snapshot taken by ml_snapshot_state.
+
+        The parameter values, frozen flags, links and fit settings are set directly. The .xcm file is read 
+        from disk only if the loaded data changed or if the snapshot is not used in memory.
+
+        Parameters
+        ----------
+        snapshot : dict
+        Snapshot returned by ml_snapshot_state.
+        para_nb : int or None
+        Parameter being profiled, recorded with the restore event (see ml_get_instrument).
+
+        Returns
+        -------
+        elapsed : float
+        Time spent to restore the state in seconds.
+        from_disk : bool
+        True if the state was restored from the .xcm file.
+        """
+    start=time.time()
+    backend=ml_get_backend()
+    with ml_get_instrument().phase('restore',para_nb=para_nb) as event:
+        from_disk=not snapshot['in_memory'] or backend.data_fingerprint()!=snapshot['data']
+        event['from_disk']=from_disk
+        if from_disk:
+            backend.restore(snapshot['xcm'])
+        else:
+            values={}
+            for i,par in enumerate(snapshot['pars'],1):
+                backend.set_link(i,par['link'])
+                if par['link']=='':
+                    values[i]=par['values']
+            backend.set_values(values)
+            for i,par in enumerate(snapshot['pars'],1):
+                backend.freeze(i,par['frozen'])
+            backend.set_fit_settings(snapshot['fit'])
+    return time.time()-start,from_disk
+
+
+def ml_constrained_fit(snapshot,para_nb,par_value,scan,start_values=None):
+    """Function to fit the model with one parameter frozen at a given value.
+
+        The session is reset to the snapshot before the fit. The restore and fit times are added to the scan.
+
+        Parameters
+        ----------
+        snapshot : dict
+        Snapshot of the best fit returned by ml_snapshot_state.
+        para_nb : int
+        Number of the parameter.
+        par_value : float
+        Value of the frozen parameter.
+        scan : dict
+        Scan of the direction, its counters are updated.
+        start_values : dict or None
+        Starting values {parameter number: value} of the free parameters. If None, the fit starts from the best fit.
+
+        Returns
+        -------
+        statistic : float
+        Fit statistic of the constrained fit.
+        """
+    elapsed,from_disk=ml_restore_state(snapshot,para_nb)
+    scan['n_restore']+=1 ; scan['n_disk_restore']+=int(from_disk) ; scan['t_restore']+=elapsed
+    backend=ml_get_backend()
+    values={para_nb:par_value}
+    if start_values is not None: values.update(start_values)
+    backend.set_values(values)
+    backend.freeze(para_nb,True)
+    _ml_apply_core_share()
+    fit_start=time.time()
+    with ml_get_instrument().phase('fit',para_nb=para_nb,par_dir=scan.get('par_dir'),par_value=par_value,warm=start_values is not None) as event:
+        backend.fit()
+        event['iterations'],event['statistic']=backend.iterations(),backend.statistic()
+    scan['t_fit']+=time.time()-fit_start
+    scan['n_fits']+=1
+    return event['statistic']
+
+
+def _ml_fitted_values(snapshot,para_nb):
+    """Values of the free parameters of the snapshot, except para_nb, in the current session."""
+    return dict((i,ml_get_backend().get_values(i)[0]) for i,par in enumerate(snapshot['pars'],1) if i!=para_nb and par['link']=='' and not par['frozen'])
+
+
+def ml_warm_start_values(snapshot,para_nb,par_value,history,extrapolate=False):
+    """Function to predict the starting values of the free parameters from the previous points of a profile.
+
+        Parameters
+        ----------
+        snapshot : dict
+        Snapshot of the best fit returned by ml_snapshot_state, used for the hard limits.
+        para_nb : int
+        Number of the profiled parameter.
+        par_value : float
+        Value of the profiled parameter at the new point.
+        history : list of (float, dict, float)
+        Value of the profiled parameter, fitted values of the free parameters and delta statistic of the previous points.
+        extrapolate : bool
+        If True, the values are linearly extrapolated from the two points closest to par_value, 
+        otherwise the values of the closest point are used.
+
+        Returns
+        -------
+        start_values : dict or None
+        Starting values {parameter number: value}, None if there is no previous point.
+        """
+    if not history:
+        return None
+    closest=sorted(history,key=lambda point: abs(point[0]-par_value))
+    x1,values1=closest[0][:2]
+    start_values=dict(values1)
+    if extrapolate and len(closest)>1 and closest[1][0]!=x1:
+        x0,values0=closest[1][:2]
+        t=(par_value-x1)/(x1-x0)
+        for i in start_values:
+            hard_min,hard_max=snapshot['pars'][i-1]['values'][2],snapshot['pars'][i-1]['values'][5]
+            start_values[i]=min(max(values1[i]+t*(values1[i]-values0[i]),hard_min),hard_max)
+    return start_values
+
+
+def ml_profile_fit(snapshot,para_nb,par_value,fitstatmin,level,scan,history=None,extrapolate=False):
+    """Function to fit one point of a profile, warm-started from the previous points if a history is given.
+
+        When the warm-started profile decreases, i.e. a previous point closer to the best fit has a higher statistic 
+        (by more than criticalDelta), the point is fitted again from the best fit. The fit from the best fit replaces 
+        the warm-started one only if it is lower by more than criticalDelta, otherwise the warm-started solution is set 
+        back in the session, so a new best fit found by the warm start is kept.
+
+        Parameters
+        ----------
+        snapshot : dict
+        Snapshot of the best fit returned by ml_snapshot_state.
+        para_nb : int
+        Number of the parameter.
+        par_value : float
+        Value of the frozen parameter.
+        fitstatmin : float
+        Fit statistic of the best fit.
+        level : float
+        Statistic level to evaluate the confidence interval.
+        scan : dict
+        Scan of the direction, its counters are updated.
+        history : list or None
+        Previous points of the direction, see ml_warm_start_values. The new point is appended. 
+        If None, the fit starts from the best fit.
+        extrapolate : bool
+        Linear extrapolation of the starting values from the two closest points.
+
+        Returns
+        -------
+        statistic : float
+        Fit statistic of the point.
+        """
+    start_values=None
+    if history is not None:
+        start_values=ml_warm_start_values(snapshot,para_nb,par_value,history,extrapolate)
+    statistic=ml_constrained_fit(snapshot,para_nb,par_value,scan,start_values)
+    if history is None:
+        return statistic
+    solution=_ml_fitted_values(snapshot,para_nb)
+    critical_delta=snapshot['fit']['criticalDelta']
+    best_value=snapshot['pars'][para_nb-1]['values'][0]
+    closer=[dstat for x,values,dstat in history if abs(x-best_value)<abs(par_value-best_value)]
+    if start_values is not None and closer and max(closer)>statistic-fitstatmin+critical_delta:
+        cold_statistic=ml_constrained_fit(snapshot,para_nb,par_value,scan)
+        if cold_statistic<statistic-critical_delta:
+            print "<  WARNING  > : Warm start worse than the best fit start",statistic,cold_statistic
+            ml_get_instrument().event('retry',reason='warm start fallback',para_nb=para_nb,par_dir=scan.get('par_dir'),par_value=par_value,dstat=statistic-fitstatmin)
+            scan['n_fallback']+=1
+            statistic,solution=cold_statistic,_ml_fitted_values(snapshot,para_nb)
+        else:
+            ml_get_backend().set_values(solution)
+    history.append((par_value,solution,statistic-fitstatmin))
+    return statistic
+
+
+class _MlScanStop(Exception):
+    """Raised inside a search to stop it when a new best fit is found or a stop is requested."""
+    pass
+
+
+def ml_count_fit(para_nb,par_dir,scan):
+    """Function to count a fit of the profile of a parameter against the fit budget and the stop requests.
+
+        Raises _MlScanStop with scan['status']='stopped' if the stream asked to stop the parameter or the run, 
+        or if the fits of the parameter reached max_fits (see ml_set_fit_control).
+        """
+    stream,max_fits,counts=_ml_fit_control['stream'],_ml_fit_control['max_fits'],_ml_fit_control['counts']
+    reason=None
+    if stream is not None and stream.stopped(para_nb):
+        reason='request'
+    elif max_fits is not None and counts.get(para_nb,0)>=max_fits:
+        reason='budget'
+    if reason is not None:
+        print "<  INFO  > : Profile of parameter",para_nb,"stopped (",reason,") after",counts.get(para_nb,0),"fits"
+        ml_get_instrument().event('stopped',para_nb=para_nb,par_dir=par_dir,reason=reason,n_fits=counts.get(para_nb,0))
+        scan['status']='stopped'
+        raise _MlScanStop()
+    counts[para_nb]=counts.get(para_nb,0)+1
+
+
+def ml_journal_append(journal_file,fitstatmin,para_nb,par_dir,par_value,dstat,t_fit):
+    """Function to append one point of a profile to the checkpoint journal.
+
+        The line is written with a single call on a file opened in append mode, so the workers
+        of the process pools can share the same journal.
+
+        Parameters
+        ----------
+        journal_file : str
+        Name of the journal file.
+        fitstatmin : float
+        Fit statistic of the best fit the point refers to.
+        para_nb : int
+        Number of the parameter.
+        par_dir : {-1, 1}
+        Direction of the scan.
+        par_value : float
+        Value of the frozen parameter.
+        dstat : float
+        Fit statistic of the point minus fitstatmin.
+        t_fit : float
+        Time spent to fit the point in seconds.
+        """
+    with open(journal_file,'a') as f:
+        f.write("%r %d %d %r %r %r\n" % (fitstatmin,para_nb,par_dir,par_value,dstat,t_fit))
+
+
+def ml_journal_load(journal_file,fitstatmin,tolerance=0.01):
+    """Function to read the points of the checkpoint journal still valid for the current best fit.
+
+        A point is valid if it was computed for a best fit whose statistic is within tolerance of fitstatmin.
+        Incomplete lines (e.g. written when the job was killed) are skipped.
+
+        Parameters
+        ----------
+        journal_file : str
+        Name of the journal file.
+        fitstatmin : float
+        Fit statistic of the current best fit.
+        tolerance : float
+        Maximum difference between the statistic of the best fits.
+
+        Returns
+        -------
+        points : dict
+        {(para_nb, par_dir): [(par_value, dstat), ...]} in the order of the journal, dstat relative to fitstatmin.
+        """
+    points={}
+    if not os.path.isfile(journal_file):
+        return points
+    with open(journal_file) as f:
+        for line in f:
+            fields=line.split()
+            if line.startswith('#') or len(fields)!=6 or not line.endswith('\n'):
+                continue
+            fitstat,dstat=float(fields[0]),float(fields[4])
+            if abs(fitstat-fitstatmin)<=tolerance:
+                points.setdefault((int(fields[1]),int(fields[2])),[]).append((float(fields[3]),fitstat+dstat-fitstatmin))
+    return points
+
+
+def ml_journal_fit(journal,snapshot,para_nb,par_dir,par_value,fitstatmin,level,scan,tol,history=None,extrapolate=False):
+    """Function to fit one point of a profile through the checkpoint journal.
+
+        If the journal holds the point for the current best fit, its statistic is replayed without fitting,
+        otherwise the point is fitted with ml_profile_fit and appended to the journal. A replayed point
+        below the best fit is fitted again, so the new best fit is loaded in the session. The fits are counted 
+        by ml_count_fit, which stops the search when the fit budget is spent or a stop is requested.
+
+        Parameters
+        ----------
+        journal : dict or None
+        Journal file ('file') and valid points ('points') returned by ml_journal_load. If None, the point is fitted.
+        snapshot, para_nb, par_value, fitstatmin, level, scan, history, extrapolate
+        See ml_profile_fit.
+        par_dir : {-1, 1}
+        Direction of the scan.
+        tol : float
+        Maximum distance between par_value and a point of the journal to replay it.
+
+        Returns
+        -------
+        statistic : float
+        Fit statistic of the point.
+        """
+    if journal is None:
+        ml_count_fit(para_nb,par_dir,scan)
+        return ml_profile_fit(snapshot,para_nb,par_value,fitstatmin,level,scan,history,extrapolate)
+    for x,dstat in journal['points'].get((para_nb,par_dir),[]):
+        if abs(x-par_value)<=tol and dstat>=-snapshot['fit']['criticalDelta']:
+            ml_get_instrument().event('replay',para_nb=para_nb,par_dir=par_dir,par_value=par_value,dstat=dstat)
+            scan['n_replayed']+=1
+            return fitstatmin+dstat
+    ml_count_fit(para_nb,par_dir,scan)
+    t_fit=scan['t_fit']
+    statistic=ml_profile_fit(snapshot,para_nb,par_value,fitstatmin,level,scan,history,extrapolate)
+    ml_journal_append(journal['file'],fitstatmin,para_nb,par_dir,par_value,statistic-fitstatmin,scan['t_fit']-t_fit)
+    return statistic
+
+
+def ml_scan_direction(filexcm,para_nb,par_dir,initial_value,step_steppar,fitstatmin,level,para_sigma=4.,hardcap=False,stop_event=None,snapshot=None,warm_start=False,extrapolate=False,journal=None):
+    """Function to scan the fit statistic of a parameter in one direction.
+
+        The best fit is restored from the snapshot before each step, the parameter is frozen at the 
+        step value and the other free parameters are fitted.
+
+        Parameters
+        ----------
+        filexcm : str
+        Name of the .xcm XSPEC file (without extension) holding the best fit.
+        para_nb : int
+        Number of the parameter.
+        par_dir : {-1, 1}
+        Direction of the scan, -1 for the left side and 1 for the right side.
+        initial_value : float
+        Best fit value of the parameter.
+        step_steppar : float
+        Initial step of the scan.
+        fitstatmin : float
+        Fit statistic of the best fit.
+        level : float
+        Statistic level to evaluate the confidence interval.
+        para_sigma : float
+        Number of steps made before reaching the initial step_steppar distance.
+        hardcap : bool
+        True if the hard cap of this side is already hit (pegged parameter).
+        stop_event : multiprocessing.Event or None
+        If set during the scan, the scan is aborted.
+        snapshot : dict or None
+        Snapshot of the best fit returned by ml_snapshot_state. If None, it is taken from the current session.
+        warm_start : bool
+        If True, each step starts from the solution of the previous step instead of the best fit. When the step is 
+        reduced ("Not enough points") the previous steps are dropped, the next step starts from the best fit.
+        extrapolate : bool
+        If True, the warm start is linearly extrapolated from the two previous steps.
+        journal : dict or None
+        Checkpoint journal, see ml_journal_fit. The steps found in the journal are replayed without fitting.
+
+        Returns
+        -------
+        scan : dict
+        Points of the scan (MlProfileBuffer), hardcap flag, number of fits, status ('done', 'newbestfit', 'aborted' or 'stopped'),
+        the fit statistic of the new best fit if one was found, the time spent in restores and fits, the number 
+        of warm starts replaced by a fit from the best fit and the number of steps replayed from the journal.
+        """
+    if snapshot is None: snapshot=ml_snapshot_state(filexcm)
+    scan={'points':MlProfileBuffer(),'hardcap':hardcap,'n_fits':0,'status':'done','fitstat':fitstatmin,'par_dir':par_dir,
+          'n_restore':0,'n_disk_restore':0,'t_restore':0.,'t_fit':0.,'n_fallback':0,'n_replayed':0}
+    instrument=ml_get_instrument()
+    history=[] if warm_start else None
+    step=para_sigma
+    dstat,n_fits=0,0
+    step_steppar_cur=step_steppar
+    while dstat<level+0.1 and not scan['hardcap']:
+        if stop_event is not None and stop_event.is_set():
+            scan['status']='aborted'
+            return scan
+        par_value=initial_value+par_dir*step*step_steppar_cur
+        if par_dir==-1 and par_value < snapshot['pars'][para_nb-1]['values'][2] :
+            scan['hardcap']=True
+            print "<  WARNING  > : ---Hard min hit---"
+        elif par_dir==1 and par_value > snapshot['pars'][para_nb-1]['values'][5] :
+            scan['hardcap']=True
+            print "<  WARNING  > : ---Hard max hit---"
+        if scan['hardcap']:
+            print "<  WARNING  > : Hard cap hit, continue"
+            instrument.event('hardcap',para_nb=para_nb,par_dir=par_dir,par_value=par_value)
+        else :
+            try:
+                statistic=ml_journal_fit(journal,snapshot,para_nb,par_dir,par_value,fitstatmin,level,scan,step_steppar_cur/100.,history,extrapolate)
+            except _MlScanStop:
+                return scan
+            n_fits+=1
+            dstat=statistic-fitstatmin
+            if dstat < -snapshot['fit']['criticalDelta'] :
+                print "New miminum statistic found",dstat
+                instrument.event('newbestfit',para_nb=para_nb,par_dir=par_dir,par_value=par_value,dstat=dstat)
+                ml_get_backend().freeze(para_nb,False)
+                scan['status']='newbestfit'
+                scan['fitstat']=statistic
+                return scan
+            elif dstat > level and n_fits<=2 and step_steppar_cur>step_steppar*1e-6:
+                #------ The step is reduced, below a millionth of the first step the point is kept as the crossing ------
+                instrument.event('retry',reason='not enough points',para_nb=para_nb,par_dir=par_dir,par_value=par_value,dstat=dstat,step=step_steppar_cur/4.)
+                step_steppar_cur=step_steppar_cur/4.
+                n_fits,dstat=0,0
+                step=1
+                print "<  WARNING  > : Not enough points",step,step_steppar_cur,par_value
+                scan['points'].clear()
+                if history is not None: del history[:]
+            else :
+                scan['points'].append(par_value,dstat)
+                instrument.event('step',para_nb=para_nb,par_dir=par_dir,par_value=par_value,dstat=dstat,step=step_steppar_cur)
+                print "<  STEP  > : ",int(step),par_value, "dstat=",dstat,initial_value-par_value
+                step=step+1
+    return scan
+
+
+def ml_bracket_direction(filexcm,para_nb,par_dir,initial_value,step_steppar,fitstatmin,level,para_sigma=4.,hardcap=False,stop_event=None,snapshot=None,warm_start=False,extrapolate=False,xtol=None,expansion=2.,journal=None,levels=None,seed=None):
+    """Function to find the crossing of the statistic level in one direction with a root bracketing search.
+
+        The distance to the best fit starts at sigma and is multiplied by expansion until the statistic 
+        crosses the level or the hard limit is reached. The crossing is then refined with the Brent method 
+        on constrained fits. The scan has the same structure as the one returned by ml_scan_direction.
+
+        Parameters
+        ----------
+        filexcm : str
+        Name of the .xcm XSPEC file (without extension) holding the best fit.
+        para_nb : int
+        Number of the parameter.
+        par_dir : {-1, 1}
+        Direction of the search, -1 for the left side and 1 for the right side.
+        initial_value : float
+        Best fit value of the parameter.
+        step_steppar : float
+        The first distance to the best fit is step_steppar*para_sigma.
+        fitstatmin : float
+        Fit statistic of the best fit.
+        level : float
+        Statistic level to evaluate the confidence interval.
+        para_sigma : float
+        The first distance to the best fit is step_steppar*para_sigma.
+        hardcap : bool
+        True if the hard cap of this side is already hit (pegged parameter).
+        stop_event : multiprocessing.Event or None
+        If set during the search, the search is aborted.
+        snapshot : dict or None
+        Snapshot of the best fit returned by ml_snapshot_state. If None, it is taken from the current session.
+        warm_start : bool
+        If True, each fit starts from the solution of the closest point already fitted instead of the best fit.
+        extrapolate : bool
+        If True, the warm start is linearly extrapolated from the two closest points.
+        xtol : float or None
+        Tolerance on the crossing. Default is 1% of the first distance.
+        expansion : float
+        Factor applied to the distance at each step of the bracketing.
+        journal : dict or None
+        Checkpoint journal, see ml_journal_fit. The points found in the journal are replayed without fitting.
+        levels : list of float or None
+        Lower statistic levels whose crossings are also refined with the Brent method, each one between the two 
+        points already fitted that bracket it.
+        seed : dict or None
+        Points {parameter value: delta statistic} of this side already fitted, they are not fitted again.
+
+        Returns
+        -------
+        scan : dict
+        Same as ml_scan_direction, with the crossing value in scan['root'] (None if the hard cap is hit) and the 
+        crossings of level and of the lower levels in the dict scan['roots'] (level: crossing).
+        """
+    if snapshot is None: snapshot=ml_snapshot_state(filexcm)
+    scan={'points':MlProfileBuffer(),'hardcap':hardcap,'n_fits':0,'status':'done','fitstat':fitstatmin,'par_dir':par_dir,
+          'n_restore':0,'n_disk_restore':0,'t_restore':0.,'t_fit':0.,'n_fallback':0,'n_replayed':0,'root':None,'roots':{}}
+    if hardcap:
+        return scan
+    instrument=ml_get_instrument()
+    history=[] if warm_start else None
+    distance=step_steppar*para_sigma
+    if xtol is None: xtol=distance/100.
+    if par_dir==-1:
+        hard_limit=snapshot['pars'][para_nb-1]['values'][2]
+    else:
+        hard_limit=snapshot['pars'][para_nb-1]['values'][5]
+    evaluated={initial_value:0.}
+    for par_value,dstat in sorted((seed or {}).items()):
+        evaluated[par_value]=dstat
+        scan['points'].append(par_value,dstat)
+
+    def dstat_at(par_value):
+        if par_value in evaluated:
+            return evaluated[par_value]
+        if stop_event is not None and stop_event.is_set():
+            scan['status']='aborted'
+            raise _MlScanStop()
+        statistic=ml_journal_fit(journal,snapshot,para_nb,par_dir,par_value,fitstatmin,level,scan,xtol/100.,history,extrapolate)
+        dstat=statistic-fitstatmin
+        if dstat < -snapshot['fit']['criticalDelta'] :
+            print "New miminum statistic found",dstat
+            instrument.event('newbestfit',para_nb=para_nb,par_dir=par_dir,par_value=par_value,dstat=dstat)
+            ml_get_backend().freeze(para_nb,False)
+            scan['status']='newbestfit'
+            scan['fitstat']=statistic
+            raise _MlScanStop()
+        evaluated[par_value]=dstat
+        scan['points'].append(par_value,dstat)
+        previous=scan['points'].par_list[-2] if len(scan['points'])>1 else initial_value
+        instrument.event('step',para_nb=para_nb,par_dir=par_dir,par_value=par_value,dstat=dstat,step=abs(par_value-previous))
+        print "<  STEP  > : ",scan['n_fits'],par_value, "dstat=",dstat,initial_value-par_value
+        return dstat
+
+    try:
+        inner=initial_value
+        while True:
+            par_value=initial_value+par_dir*distance
+            if (par_value-hard_limit)*par_dir>=0:
+                par_value=hard_limit
+            if dstat_at(par_value)>=level:
+                break
+            if par_value==hard_limit:
+                scan['hardcap']=True
+                print "<  WARNING  > : Hard cap hit, continue"
+                instrument.event('hardcap',para_nb=para_nb,par_dir=par_dir,par_value=par_value)
+                break
+            inner,distance=par_value,distance*expansion
+        if not scan['hardcap']:
+            scan['root']=brentq(lambda x: dstat_at(x)-level,inner,par_value,xtol=xtol)
+            scan['roots'][level]=scan['root']
+            print "<  INFO  > : Crossing found at",scan['root'],"after",scan['n_fits'],"fits"
+        for other_level in sorted([other for other in (levels or []) if other<level],reverse=True):
+            points=sorted([(abs(x-initial_value),x,y) for x,y in evaluated.items()])
+            outer=[i for i,point in enumerate(points) if point[2]>=other_level]
+            if not outer:
+                continue
+            outer=outer[0]
+            scan['roots'][other_level]=brentq(lambda x: dstat_at(x)-other_level,points[outer-1][1],points[outer][1],xtol=xtol)
+            print "<  INFO  > : Crossing of the level",other_level,"found at",scan['roots'][other_level],"after",scan['n_fits'],"fits"
+    except _MlScanStop:
+        pass
+    return scan
+
+
+def ml_parabolic_roots(points,levels):
+    """Function to compute the crossings of the levels of the quadratic a*u + b*u**2 through the best fit and two points.
+
+        Parameters
+        ----------
+        points : list of (float, float)
+        Distance u to the best fit (positive) and delta statistic of the two points.
+        levels : list of float
+        Statistic levels.
+
+        Returns
+        -------
+        distances : dict or None
+        {level: distance of the crossing to the best fit}, None if the quadratic does not increase up to the levels.
+        """
+    (u1,d1),(u2,d2)=points
+    determinant=u1*u2**2-u2*u1**2
+    if abs(determinant)>1e-6*u1*u2*max(u1,u2):
+        a,b=(d1*u2**2-d2*u1**2)/determinant,(u1*d2-u2*d1)/determinant
+    else:
+        #------ The two points are at the same distance, the quadratic is a parabola centred on the best fit ------
+        a,b=0.,0.5*(d1/u1**2+d2/u2**2)
+    distances={}
+    for one_level in levels:
+        if b>0:
+            distances[one_level]=(-a+np.sqrt(a**2+4*b*one_level))/(2*b)
+        elif b==0 and a>0:
+            distances[one_level]=one_level/a
+        else:
+            return None
+    return distances
+
+
+def ml_parabolic_direction(filexcm,para_nb,par_dir,initial_value,step_steppar,fitstatmin,level,para_sigma=4.,hardcap=False,stop_event=None,snapshot=None,warm_start=False,extrapolate=False,xtol=None,expansion=2.,journal=None,levels=None,tolerance=0.1):
+    """Function to find the crossing of the level on one side from the parabolic (covariance) interval, verified with constrained fits.
+
+        The crossing predicted by the sigma of the best fit (sigma*sqrt(level)) is fitted first, then the crossing predicted 
+        by the parabola through the best fit and this point. If the delta statistic of the second point is within tolerance 
+        of the level, the profile is parabolic and the crossing is the root of the quadratic through the best fit and the two 
+        points (ml_parabolic_roots): the side costs two fits. The crossings of the lower levels predicted by the quadratic are 
+        verified with one fit each and refined by bisection if they are not within tolerance. Otherwise the profile is not parabolic and the 
+        crossings of the level and of the lower levels are found by ml_bracket_direction, starting from the points already fitted. 
+        Whether the covariance crossing itself is within tolerance of the level is reported in scan['covariance'].
+
+        Parameters
+        ----------
+        filexcm, para_nb, par_dir, initial_value, step_steppar, fitstatmin, level, para_sigma, hardcap, stop_event, snapshot, 
+        warm_start, extrapolate, xtol, expansion, journal :
+        See ml_bracket_direction.
+        levels : list of float or None
+        Lower statistic levels whose crossings are taken from the quadratic and verified.
+        tolerance : float
+        Maximum difference between the delta statistic of a verification fit and the level.
+
+        Returns
+        -------
+        scan : dict
+        Same as ml_bracket_direction, scan['parabolic'] is True if the parabolic crossing was accepted and scan['covariance'] 
+        is True if the fit at the covariance crossing sigma*sqrt(level) is within tolerance of the level.
+        """
+    if snapshot is None: snapshot=ml_snapshot_state(filexcm)
+    scan={'points':MlProfileBuffer(),'hardcap':hardcap,'n_fits':0,'status':'done','fitstat':fitstatmin,'par_dir':par_dir,
+          'n_restore':0,'n_disk_restore':0,'t_restore':0.,'t_fit':0.,'n_fallback':0,'n_replayed':0,'root':None,'roots':{},'parabolic':False,'covariance':False}
+    if hardcap:
+        return scan
+    instrument=ml_get_instrument()
+    history=[] if warm_start else None
+    if xtol is None: xtol=step_steppar*para_sigma/100.
+    hard_limit=snapshot['pars'][para_nb-1]['values'][5 if par_dir==1 else 2]
+    sigma=snapshot['pars'][para_nb-1]['sigma']
+    distance=sigma*np.sqrt(level) if sigma>0 else 0.
+    seed={}
+
+    def dstat_at(par_value):
+        if stop_event is not None and stop_event.is_set():
+            scan['status']='aborted'
+            raise _MlScanStop()
+        statistic=ml_journal_fit(journal,snapshot,para_nb,par_dir,par_value,fitstatmin,level,scan,xtol/100.,history,extrapolate)
+        dstat=statistic-fitstatmin
+        if dstat < -snapshot['fit']['criticalDelta'] :
+            print "New miminum statistic found",dstat
+            instrument.event('newbestfit',para_nb=para_nb,par_dir=par_dir,par_value=par_value,dstat=dstat)
+            ml_get_backend().freeze(para_nb,False)
+            scan['status'],scan['fitstat']='newbestfit',statistic
+            raise _MlScanStop()
+        seed[par_value]=dstat
+        scan['points'].append(par_value,dstat)
+        previous=scan['points'].par_list[-2] if len(scan['points'])>1 else initial_value
+        instrument.event('step',para_nb=para_nb,par_dir=par_dir,par_value=par_value,dstat=dstat,step=abs(par_value-previous))
+        print "<  STEP  > : ",scan['n_fits'],par_value, "dstat=",dstat,"parabolic prediction=",level
+        return dstat
+
+    try:
+        while len(seed)<2 and distance>0 and (initial_value+par_dir*distance-hard_limit)*par_dir<0:
+            dstat=dstat_at(initial_value+par_dir*distance)
+            if dstat<=0:
+                break
+            if len(seed)==1:
+                scan['covariance']=abs(dstat-level)<=tolerance
+                print "<  INFO  > : Covariance crossing",initial_value+par_dir*distance,"dstat=",dstat,"verified" if scan['covariance'] else "not verified"
+            distance=distance*np.sqrt(level/dstat)
+        verified=len(seed)==2 and abs(dstat-level)<=tolerance
+        distances=ml_parabolic_roots([(abs(x-initial_value),y) for x,y in sorted(seed.items())],sorted(set((levels or [])+[level]))) if verified else None
+        if distances is not None and all([(initial_value+par_dir*u-hard_limit)*par_dir<0 for u in distances.values()]):
+            scan['root'],scan['parabolic']=initial_value+par_dir*distances[level],True
+            scan['roots'][level]=scan['root']
+            instrument.event('parabolic',para_nb=para_nb,par_dir=par_dir,root=scan['root'],n_fits=scan['n_fits'],covariance=scan['covariance'])
+            print "<  INFO  > : Parabolic crossing verified at",scan['root'],"after",scan['n_fits'],"fits"
+            #------ The crossings of the lower levels are verified with one fit, and refined if the quadratic is off ------
+            for other_level in sorted([other for other in (levels or []) if other<level],reverse=True):
+                par_value=initial_value+par_dir*distances[other_level]
+                if abs(dstat_at(par_value)-other_level)<=tolerance:
+                    scan['roots'][other_level]=par_value
+                else:
+                    points=sorted([(0.,initial_value,0.)]+[(abs(x-initial_value),x,y) for x,y in seed.items()])
+                    outer=[i for i,point in enumerate(points) if point[2]>=other_level][0]
+                    evaluated=dict((x,y) for u,x,y in points)
+                    scan['roots'][other_level]=brentq(lambda x: evaluated[x]-other_level if x in evaluated else dstat_at(x)-other_level,points[outer-1][1],points[outer][1],xtol=xtol)
+                print "<  INFO  > : Crossing of the level",other_level,"found at",scan['roots'][other_level],"after",scan['n_fits'],"fits"
+            return scan
+    except _MlScanStop:
+        return scan
+    #------ Not parabolic: the crossing is bracketed from the first point fitted ------
+    print "<  INFO  > : The profile is not parabolic, bracketing the crossing"
+    instrument.event('retry',para_nb=para_nb,par_dir=par_dir,reason='not parabolic')
+    start=min([abs(x-initial_value) for x in seed]) if seed else step_steppar*para_sigma
+    bracket=ml_bracket_direction(filexcm,para_nb,par_dir,initial_value,start/para_sigma,fitstatmin,level,para_sigma,hardcap,stop_event,snapshot,warm_start,extrapolate,xtol,expansion,journal,levels,seed)
+    for key in ['n_fits','n_restore','n_disk_restore','t_restore','t_fit','n_fallback','n_replayed']:
+        bracket[key]+=scan[key]
+    bracket['parabolic'],bracket['covariance']=False,scan['covariance']
+    return bracket
+
+
+_ml_search_methods={'steppar':ml_scan_direction,'bracket':ml_bracket_direction,'parabolic':ml_parabolic_direction}
+
+
+def ml_profile_parameter(filexcm,para_nb,fitstatmin,level,para_sigma=4.,stop_event=None,parallel_directions=False,statistic='cstat',n_cores=1,snapshot=None,search_method='steppar',search_options=None):
+    """Function to compute the statistic profile of a parameter on both sides of the best fit.
+
+        The model must be loaded at the best fit stored in the .xcm file. When a new best fit is found
+        the scan stops and the new best fit is left loaded in the XSPEC session.
+
+        Parameters
+        ----------
+        filexcm : str
+        Name of the .xcm XSPEC file (without extension) holding the best fit.
+        para_nb : int
+        Number of the parameter.
+        fitstatmin : float
+        Fit statistic of the best fit.
+        level : float
+        Statistic level to evaluate the confidence interval.
+        para_sigma : float
+        The initial step of the scan is sigma/para_sigma.
+        stop_event : multiprocessing.Event or None
+        If set during the scan, the scan is aborted.
+        parallel_directions : bool
+        If True, the left and right directions are scanned at the same time in two worker processes.
+        statistic : {'cstat', 'chi'}
+        Statistic of the fit method, used by the worker processes.
+        n_cores : int
+        Number of cores to set for the XSPEC parallel variable in the worker processes.
+        snapshot : dict or None
+        Snapshot of the best fit returned by ml_snapshot_state. If None, it is taken from the current session.
+        search_method : {'steppar', 'bracket', 'parabolic'}
+        'steppar' scans each direction with ml_scan_direction, 'bracket' finds the crossing of each direction 
+        with ml_bracket_direction.
+        search_options : dict or None
+        Keyword arguments given to the search function of each direction (e.g. xtol for 'bracket').
+
+        Returns
+        -------
+        profile : dict
+        Parameter number, name, unit, best fit value, hard limits, sorted par_list and cost_list, 
+        hardcap_hit, crossings found by the search (roots), number of fits, status ('done', 'newbestfit', 
+        'aborted' or 'stopped' with the points fitted before the stop), fit statistic and the time spent in restores and fits.
+        """
+    if search_options is None: search_options={}
+    if snapshot is None: snapshot=ml_snapshot_state(filexcm)
+    backend=ml_get_backend()
+    par_values=snapshot['pars'][para_nb-1]['values']
+    initial_value=par_values[0]
+    profile={'para_nb':para_nb,'name':backend.name(para_nb),'unit':backend.unit(para_nb),'initial_value':initial_value,'hard_min':par_values[2],'hard_max':par_values[5],
+             'par_list':np.array([]),'cost_list':np.array([]),'hardcap_hit':[False,False],'n_fits':0,'status':'done','fitstat':fitstatmin,
+             'n_restore':0,'n_disk_restore':0,'t_restore':0.,'t_fit':0.,'n_fallback':0,'n_replayed':0,'roots':[None,None]}
+    if _ml_fit_control['stream'] is not None and _ml_fit_control['stream'].stopped(0):
+        profile['status']='aborted'
+        return profile
+    step_steppar=snapshot['pars'][para_nb-1]['sigma']/para_sigma
+    _ml_fit_control['counts'][para_nb]=0
+    hardcap_hit=profile['hardcap_hit'] # hardcap_hit[0]=hardcapmin, hardcap_hit[1]=hardcapmax
+    if step_steppar <=0 and np.abs(initial_value - par_values[2]) < 1e-8 :
+        print "<  WARNING  > : Parameter pegged at the hard lower limit",initial_value,par_values[2]
+        hardcap_hit[0]=True
+    if step_steppar <=0 and np.abs(initial_value - par_values[5]) < 1e-8 :
+        print "<  WARNING  > : Parameter pegged at the hard upper limit"
+        hardcap_hit[1]=True
+    if step_steppar <= 0 : step_steppar=np.abs(initial_value/10.)
+    if step_steppar <= 0 : step_steppar=np.abs(par_values[1])/para_sigma #parameter pegged at 0: fit delta
+    print "<  INFO  > : Starting steppar on parameter ",para_nb,' :',profile['name']
+    print "<  INFO  > : Initial value :", initial_value
+    points=MlProfileBuffer()
+    points.append(initial_value,0.)
+    if parallel_directions:
+        print "<  INFO  > : Initiating directions <== left and right ==> in parallel"
+        scans=ml_parallel_directions(filexcm,para_nb,initial_value,step_steppar,fitstatmin,level,para_sigma,hardcap_hit,statistic,n_cores,snapshot,search_method,search_options)
+        newbest=sorted([scan for scan in scans if scan['status']=='newbestfit'],key=lambda scan: scan['fitstat'])
+        if newbest:
+            backend.restore(newbest[0]['xcm'])
+        for scan in newbest:
+            os.remove(scan['xcm']+backend.extension)
+    else:
+        scans=[]
+        for par_dir in [-1,1]:
+            if par_dir==1:
+                print "<  INFO  > : Initiating direction ==> right"
+            else:
+                print "<  INFO  > : Initiating direction <== left"
+            scans.append(_ml_search_methods[search_method](filexcm,para_nb,par_dir,initial_value,step_steppar,fitstatmin,level,para_sigma,hardcap_hit[int(par_dir==1)],stop_event,snapshot,**search_options))
+            if scans[-1]['status']!='done':
+                break
+    for index_cap,scan in enumerate(scans):
+        for key in ['n_fits','n_restore','n_disk_restore','t_restore','t_fit','n_fallback','n_replayed']:
+            profile[key]+=scan[key]
+        hardcap_hit[index_cap]=scan['hardcap']
+        profile['roots'][index_cap]=scan.get('roots')
+        points.extend(scan['points'])
+    newbest=[scan['fitstat'] for scan in scans if scan['status']=='newbestfit']
+    if newbest:
+        profile['status'],profile['fitstat']='newbestfit',min(newbest)
+        return profile
+    if 'aborted' in [scan['status'] for scan in scans]:
+        profile['status']='aborted'
+        return profile
+    if 'stopped' in [scan['status'] for scan in scans]:
+        profile['status']='stopped'
+    profile['par_list'],profile['cost_list']=points.sorted()
+    return profile
+
+
+def ml_shift_profile(profile,snapshot,fitstatmin,level,tolerance=0.1,journal=None):
+    """Function to update a profile computed for a previous best fit to a new best fit.
+
+        The points of the profile are shifted by the change of the best fit value of the parameter, the delta
+        statistic of each point is kept. On each side where the shifted profile crosses the level, the crossing
+        is verified with one constrained fit from the new best fit. A side stopped by the hard cap keeps it only if 
+        the best fit value of the parameter did not change, since the cap was reached from the previous minimum.
+
+        Parameters
+        ----------
+        profile : dict
+        Profile returned by ml_profile_parameter for the previous best fit.
+        snapshot : dict
+        Snapshot of the new best fit returned by ml_snapshot_state.
+        fitstatmin : float
+        Fit statistic of the new best fit.
+        level : float
+        Statistic level to evaluate the confidence interval.
+        tolerance : float
+        Maximum difference between the statistic of a verified crossing and the level.
+        journal : dict or None
+        Checkpoint journal, see ml_journal_fit.
+
+        Returns
+        -------
+        shifted : dict
+        Profile for the new best fit, its counters are the ones of the verification fits and n_fits_profile is the 
+        number of fits of the original profile. The status is 'moved' if a crossing moved beyond the tolerance 
+        and the parameter must be profiled again.
+        """
+    para_nb=profile['para_nb']
+    initial_value=snapshot['pars'][para_nb-1]['values'][0]
+    shift=initial_value-profile['initial_value']
+    _ml_fit_control['counts'][para_nb]=0
+    shifted=dict(profile)
+    shifted.update({'initial_value':initial_value,'fitstat':fitstatmin,'hardcap_hit':list(profile['hardcap_hit']),'roots':[None,None],'status':'done',
+                    'n_fits':0,'n_restore':0,'n_disk_restore':0,'t_restore':0.,'t_fit':0.,'n_fallback':0,'n_replayed':0,
+                    'n_fits_profile':profile.get('n_fits_profile',profile['n_fits'])})
+    x_list=profile['par_list']+shift
+    keep=(x_list!=initial_value)&(x_list>=profile['hard_min'])&(x_list<=profile['hard_max'])
+    par_list=[initial_value]+list(x_list[keep])
+    cost_list=[0.]+list(profile['cost_list'][keep])
+    for index_cap,par_dir in enumerate([-1,1]):
+        side=sorted([(abs(x-initial_value),x,y) for x,y in zip(par_list,cost_list) if (x-initial_value)*par_dir>0])
+        above=[i for i,point in enumerate(side) if point[2]>=level]
+        if not above:
+            if not profile['hardcap_hit'][index_cap] or shift!=0:
+                shifted['status']='moved'
+                return shifted
+            continue
+        x1,y1=side[above[0]][1:]
+        x0,y0=side[above[0]-1][1:] if above[0]>0 else (initial_value,0.)
+        par_value=x0+(level-y0)*(x1-x0)/(y1-y0)
+        try:
+            statistic=ml_journal_fit(journal,snapshot,para_nb,par_dir,par_value,fitstatmin,level,shifted,abs(x1-x0)/100.)
+        except _MlScanStop:
+            shifted['status']='moved'
+            return shifted
+        dstat=statistic-fitstatmin
+        print "<  STEP  > : ",para_nb,"crossing of the shifted profile",par_value,"dstat=",dstat
+        if abs(dstat-level)>tolerance:
+            shifted['status']='moved'
+            return shifted
+        shifted['hardcap_hit'][index_cap]=False
+        par_list.append(par_value) ; cost_list.append(dstat)
+    order=np.argsort(par_list)
+    shifted['par_list'],shifted['cost_list']=np.array(par_list)[order],np.array(cost_list)[order]
+    return shifted
 
 
-def ml_get_errors(filexcm,statistic,selection='all',blacklist=[''],n_cores=8,level=2.706,plot_statistic=True,interp_method="linear"):
+def ml_finalize_parameter(profile,filexcm,statistic,level,plot_statistic=True,interp_method="linear",store=None):
+    """Function to compute the errors of a parameter from its statistic profile.
+
+        The data of the statistic plot is saved in the <filexcm>_plots directory and the points of the profile 
+        are appended to the 'points' table of the results store.
+
+        Parameters
+        ----------
+        profile : dict
+        Statistic profile returned by ml_profile_parameter.
+        filexcm : str
+        Name of the .xcm XSPEC file (without extension).
+        statistic : {'cstat', 'chi'}
+        Statistic of the fit method.
+        level : float or list of float
+        Statistic levels to evaluate the confidence intervals. The plot shows the first level.
+        plot_statistic : bool
+        If True, the data of the statistic plot is saved in <filexcm>_plots/<para_nb>_plot.npz for ml_render_plots.
+        interp_method : str
+        Method for the interpolation of the statistic.
+        store : MlColumnStore or None
+        Results store of the run, see ml_results_store.
+
+        Returns
+        -------
+        err_min, err_max : float or numpy array
+        Errors on the left and right side of the best fit value, one per level if level is a list.
+        """
+    filename=filexcm
+    para_nb=profile['para_nb']
+    initial_value=profile['initial_value']
+    par_list,cost_list=profile['par_list'],profile['cost_list']
+    hardcap_hit=profile['hardcap_hit']
+    roots=profile.get('roots',[None,None])
+    profile['t_interp'],profile['t_plot']=0.,0.
+    if interp_method=="spline" and len(par_list)<4:
+        interp_method='linear'
+    levels=np.atleast_1d(level)
+    instrument=ml_get_instrument()
+    #------ Finding the errors depends on the hard cap hit variable ------
+    interp_start=time.time()
+    if hardcap_hit!=[False,False]:
+        interp_method='linear'
+    with instrument.phase('interp',para_nb=para_nb,n_points=len(par_list),interp_method=interp_method):
+        if len(par_list)>1:
+            root_min,root_max=ml_interval_crossings(par_list,cost_list,levels,interp_method)
+            root_min,root_max=root_min[0],root_max[0]
+        else:
+            root_min,root_max=np.full(len(levels),np.nan),np.full(len(levels),np.nan)
+    #------ The levels not crossed on a side stopped by the hard cap get the hard limit ------
+    if hardcap_hit[0]: root_min=np.where(np.isnan(root_min),profile['hard_min'],root_min)
+    if hardcap_hit[1]: root_max=np.where(np.isnan(root_max),profile['hard_max'],root_max)
+    #------ The crossings found by the bracket search are used instead of the interpolation ------
+    for k,one_level in enumerate(levels):
+        if roots[0] and one_level in roots[0]: root_min[k]=roots[0][one_level]
+        if roots[1] and one_level in roots[1]: root_max[k]=roots[1][one_level]
+    err_min,err_max=np.abs(initial_value-root_min),np.abs(root_max-initial_value)
+    profile['t_interp']=time.time()-interp_start
+    #------ The plot is only described here, it is rendered by ml_render_plots after the fits ------
+    if plot_statistic and hardcap_hit!=[True,True]:
+        plot_start=time.time()
+        with instrument.phase('plot',para_nb=para_nb):
+            np.savez(filename+"_plots/"+str(para_nb)+'_plot.npz',para_nb=para_nb,name=profile['name'],unit=profile['unit'],initial_value=initial_value,
+                     par_list=par_list,cost_list=cost_list,err_min=err_min[0],err_max=err_max[0],level=levels[0],statistic=statistic,interp_method=interp_method)
+        profile['t_plot']=time.time()-plot_start
+    if store is not None:
+        points=np.zeros(len(par_list),dtype=store.dtype('points'))
+        points['para_nb'],points['par_value'],points['dstat']=para_nb,par_list,cost_list
+        store.append('points',points)
+    if np.ndim(level)==0:
+        return err_min[0],err_max[0]
+    return err_min,err_max
+
+
+def ml_render_plot(plot_file,latex=True):
+    """Function to render the statistic plot of a parameter from the data saved by ml_finalize_parameter.
+
+        Parameters
+        ----------
+        plot_file : str
+        <filexcm>_plots/<para_nb>_plot.npz file.
+        latex : bool
+        If False, the labels are rendered with the matplotlib mathtext instead of LaTeX (faster).
+
+        Returns
+        -------
+        pdf_file : str
+        The plot, <filexcm>_plots/<para_nb>.pdf.
+        """
+    import matplotlib.backends.backend_pdf
+    import matplotlib.pyplot as plt
+    from plotting import ml_plotting_statistics_errors
+    data=np.load(plot_file)
+    para_nb,level,interp_method=int(data['para_nb']),float(data['level']),str(data['interp_method'])
+    with ml_get_instrument().phase('render',para_nb=para_nb,latex=latex):
+        par_list,cost_list=data['par_list'],data['cost_list']
+        new_x,f=ml_profile_curve(par_list,cost_list,level,interp_method)
+        fig=ml_plotting_statistics_errors(new_x,f,float(data['err_min']),float(data['err_max']),par_list,cost_list,float(data['initial_value']),para_nb,str(data['statistic']),level,None,interp_method,str(data['name']),str(data['unit']),latex)
+        pdf_file=os.path.join(os.path.dirname(plot_file),str(para_nb)+'.pdf')
+        pdf = matplotlib.backends.backend_pdf.PdfPages(pdf_file)
+        pdf.savefig(fig,bbox_inches='tight')
+        pdf.close()
+        plt.close(fig)
+    return pdf_file
+
+def _ml_plot_worker(task):
+    """Worker of the process pool: render one statistic plot."""
+    plot_file,latex=task
+    pdf_file=ml_render_plot(plot_file,latex)
+    ml_get_instrument().dump_profiles()
+    return pdf_file
+
+def ml_render_plots(filexcm,n_workers=1,latex=True,merge=True,selection=None):
+    """Function to render the statistic plots of all the parameters and merge them in <filexcm>_plots.pdf.
+
+        The plots are rendered from the <filexcm>_plots/<para_nb>_plot.npz files, independently of the fit 
+        session, so it can be run again after ml_get_errors (e.g. with latex=False).
+
+        Parameters
+        ----------
+        filexcm : str
+        Name of the .xcm XSPEC file (without extension).
+        n_workers : int
+        Number of processes rendering the plots.
+        latex : bool
+        If False, the labels are rendered with the matplotlib mathtext instead of LaTeX (faster).
+        merge : bool
+        If True, the plots are merged by parameter number in <filexcm>_plots.pdf.
+        selection : list of int or None
+        Numbers of the parameters to plot. Default is all the parameters with a saved plot.
+
+        Returns
+        -------
+        pdf_files : list of str
+        Plot of each parameter.
+        """
+    plot_dir=filexcm+"_plots"
+    plot_files=sorted([os.path.join(plot_dir,name) for name in os.listdir(plot_dir) if name.endswith('_plot.npz')],key=lambda name: int(os.path.basename(name).split('_')[0]))
+    if selection is not None:
+        plot_files=[plot_file for plot_file in plot_files if int(os.path.basename(plot_file).split('_')[0]) in selection]
+    tasks=[(plot_file,latex) for plot_file in plot_files]
+    if n_workers>1 and len(tasks)>1:
+        pool=multiprocessing.Pool(min(n_workers,len(tasks)))
+        try:
+            pdf_files=pool.map(_ml_plot_worker,tasks)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        pdf_files=[_ml_plot_worker(task) for task in tasks]
+    if merge and pdf_files:
+        from PyPDF2 import PdfFileMerger, PdfFileReader
+        merger=PdfFileMerger()
+        for pdf_file in pdf_files:
+            merger.append(PdfFileReader(open(pdf_file,'rb')))
+        merger.addMetadata({'/Creator':'Mehdy Lefkir','/Author':'Mehdy Lefkir','/Title':'Errors plots on model'})
+        merger.write(filexcm+'_plots.pdf')
+        merger.close()
+        print "<  INFO  > : Statistic plots merged in",filexcm+'_plots.pdf'
+    return pdf_files
+
+
+_ml_stop_event=None
+_ml_core_scheduler=None
+_ml_core_slots=None
+_ml_core_slot=None
+_ml_worker_cores=None
+
+def _ml_profile_worker_init(stop_event,core_slots=None,scheduler=None):
+    global _ml_stop_event,_ml_core_scheduler,_ml_core_slots,_ml_core_slot
+    _ml_stop_event=stop_event
+    if scheduler is not None:
+        #------ Each worker claims a slot of the shared array: -1 free, 0 idle, 1 busy ------
+        _ml_core_scheduler,_ml_core_slots=scheduler,core_slots
+        with core_slots.get_lock():
+            _ml_core_slot=list(core_slots[:]).index(-1)
+            core_slots[_ml_core_slot]=0
+
+def _ml_set_busy(busy):
+    if _ml_core_slots is not None:
+        _ml_core_slots[_ml_core_slot]=int(busy)
+
+def _ml_apply_core_share():
+    """Set the parallel fit cores of a worker to its share of the core budget among the busy workers (scheduler.py)."""
+    global _ml_worker_cores
+    if _ml_core_scheduler is None:
+        return
+    busy=[slot for slot,state in enumerate(_ml_core_slots[:]) if state==1]
+    n_cores=_ml_core_scheduler.share(len(busy),busy.index(_ml_core_slot) if _ml_core_slot in busy else 0)
+    if n_cores!=_ml_worker_cores:
+        _ml_worker_cores=n_cores
+        ml_get_backend().set_parallel(n_cores)
+
+def _ml_worker_session(filexcm,statistic,n_cores):
+    """Open the fit session of a worker process on the best fit stored in the .xcm file."""
+    backend=ml_get_backend()
+    backend.restore(filexcm)
+    backend.set_statistic(statistic)
+    backend.set_fit_settings({'query':'no','nIterations':100,'criticalDelta':0.01})
+    backend.set_parallel(n_cores)
+
+def _ml_save_newbest(filexcm,tag):
+    """Save the new best fit found by a worker process and return its file name (without extension)."""
+    newbest_xcm=filexcm+"_newbest_"+tag
+    ml_get_backend().save(newbest_xcm)
+    return newbest_xcm
+
+def _ml_profile_worker(task):
+    """Worker of the process pool: profile one parameter in its own XSPEC session."""
+    global _ml_worker_cores
+    filexcm,para_nb,fitstatmin,level,para_sigma,statistic,n_cores,snapshot,search_method,search_options=task
+    _ml_worker_session(filexcm,statistic,n_cores)
+    _ml_worker_cores=n_cores
+    snapshot['data']=ml_get_backend().data_fingerprint()
+    _ml_set_busy(True)
+    try:
+        with ml_get_instrument().phase('profile',para_nb=para_nb) as event:
+            profile=ml_profile_parameter(filexcm,para_nb,fitstatmin,level,para_sigma,_ml_stop_event,snapshot=snapshot,search_method=search_method,search_options=search_options)
+            event['n_fits'],event['status'],event['n_cores']=profile['n_fits'],profile['status'],_ml_worker_cores
+    finally:
+        _ml_set_busy(False)
+    if profile['status']=='newbestfit':
+        profile['xcm']=_ml_save_newbest(filexcm,str(para_nb))
+    ml_get_instrument().dump_profiles()
+    return profile
+
+def _ml_scan_worker(task):
+    """Worker of the process pool: scan one direction of a parameter in its own XSPEC session."""
+    filexcm,para_nb,par_dir,initial_value,step_steppar,fitstatmin,level,para_sigma,hardcap,statistic,n_cores,snapshot,search_method,search_options=task
+    _ml_worker_session(filexcm,statistic,n_cores)
+    snapshot['data']=ml_get_backend().data_fingerprint()
+    scan=_ml_search_methods[search_method](filexcm,para_nb,par_dir,initial_value,step_steppar,fitstatmin,level,para_sigma,hardcap,_ml_stop_event,snapshot,**search_options)
+    scan['par_dir']=par_dir
+    if scan['status']=='newbestfit':
+        scan['xcm']=_ml_save_newbest(filexcm,str(para_nb)+"_"+str(par_dir))
+    ml_get_instrument().dump_profiles()
+    return scan
+
+def ml_parallel_directions(filexcm,para_nb,initial_value,step_steppar,fitstatmin,level,para_sigma=4.,hardcap_hit=[False,False],statistic='cstat',n_cores=1,snapshot=None,search_method='steppar',search_options=None):
+    """Function to scan the left and right directions of a parameter at the same time.
+
+        Each direction is scanned in its own worker process with its own XSPEC session restored 
+        from the .xcm file and its own hard cap detection. If one direction finds a new best fit, 
+        the other one is stopped.
+
+        Parameters
+        ----------
+        filexcm : str
+        Name of the .xcm XSPEC file (without extension) holding the best fit.
+        para_nb : int
+        Number of the parameter.
+        initial_value : float
+        Best fit value of the parameter.
+        step_steppar : float
+        Initial step of the scan.
+        fitstatmin : float
+        Fit statistic of the best fit.
+        level : float
+        Statistic level to evaluate the confidence interval.
+        para_sigma : float
+        Number of steps made before reaching the initial step_steppar distance.
+        hardcap_hit : [bool,bool]
+        Hard caps already hit on the left and right side (pegged parameter).
+        statistic : {'cstat', 'chi'}
+        Statistic of the fit method.
+        n_cores : int
+        Number of cores to set for the XSPEC parallel variable in each worker.
+        snapshot : dict or None
+        Snapshot of the best fit returned by ml_snapshot_state. If None, it is taken from the current session.
+        search_method : {'steppar', 'bracket', 'parabolic'}
+        Search function used for each direction, see ml_profile_parameter.
+        search_options : dict or None
+        Keyword arguments given to the search function.
+
+        Returns
+        -------
+        scans : [dict,dict]
+        Scans of the left and right directions as returned by ml_scan_direction.
+        """
+    if snapshot is None: snapshot=ml_snapshot_state(filexcm)
+    if search_options is None: search_options={}
+    stop_event=multiprocessing.Event()
+    pool=multiprocessing.Pool(2,_ml_profile_worker_init,(stop_event,))
+    tasks=[(filexcm,para_nb,par_dir,initial_value,step_steppar,fitstatmin,level,para_sigma,hardcap_hit[int(par_dir==1)],statistic,n_cores,snapshot,search_method,search_options) for par_dir in [-1,1]]
+    scans=[None,None]
+    try:
+        for scan in pool.imap_unordered(_ml_scan_worker,tasks):
+            if scan['status']=='newbestfit':
+                stop_event.set()
+            scans[int(scan['par_dir']==1)]=scan
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return scans
+
+def ml_parallel_profiles(filexcm,free_pars,fitstatmin,level,n_workers,para_sigma=4.,statistic='cstat',n_cores=1,snapshot=None,search_method='steppar',search_options=None,scheduler=None):
+    """Generator profiling each parameter in its own worker process.
+
+        Each worker restores the .xcm file in its own XSPEC session. The profiles are yielded as soon as 
+        they are finished. When a worker finds a new best fit, the other workers are told to stop and 
+        the profiles with status 'newbestfit' are yielded so the caller can re-center.
+
+        Parameters
+        ----------
+        filexcm : str
+        Name of the .xcm XSPEC file (without extension) holding the best fit.
+        free_pars : list of int
+        Parameters to profile.
+        fitstatmin : float
+        Fit statistic of the best fit.
+        level : float
+        Statistic level to evaluate the confidence interval.
+        n_workers : int
+        Number of worker processes.
+        para_sigma : float
+        The initial step of the scan is sigma/para_sigma.
+        statistic : {'cstat', 'chi'}
+        Statistic of the fit method.
+        n_cores : int
+        Number of cores to set for the XSPEC parallel variable in each worker.
+        snapshot : dict or None
+        Snapshot of the best fit returned by ml_snapshot_state. If None, it is taken from the current session.
+        search_method : {'steppar', 'bracket', 'parabolic'}
+        Search function used for each direction, see ml_profile_parameter.
+        search_options : dict or None
+        Keyword arguments given to the search function.
+        scheduler : MlCoreScheduler or None
+        If given, n_cores is replaced before each fit by the share of the core budget of the worker among 
+        the busy workers, so the workers still running get the cores of the finished ones.
+        """
+    if snapshot is None: snapshot=ml_snapshot_state(filexcm)
+    stop_event=multiprocessing.Event()
+    core_slots=multiprocessing.Array('i',[-1]*n_workers) if scheduler is not None else None
+    pool=multiprocessing.Pool(n_workers,_ml_profile_worker_init,(stop_event,core_slots,scheduler))
+    tasks=[(filexcm,para_nb,fitstatmin,level,para_sigma,statistic,n_cores,snapshot,search_method,search_options) for para_nb in free_pars]
+    try:
+        for profile in pool.imap_unordered(_ml_profile_worker,tasks):
+            if profile['status']=='newbestfit':
+                stop_event.set()
+            if profile['status']!='aborted':
+                yield profile
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def ml_calibrate_fit(snapshot,para_nb,n_cores_list,n_repeat=2):
+    """Function to time the constrained fit of a parameter one sigma away from its best fit with several parallel fit settings.
+
+        Parameters
+        ----------
+        snapshot : dict
+        Snapshot of the best fit returned by ml_snapshot_state.
+        para_nb : int
+        Number of the parameter fixed in the fits.
+        n_cores_list : list of int
+        Parallel fit cores (Xset.parallel.leven) to time.
+        n_repeat : int
+        Number of fits for each setting, the shortest time is kept.
+
+        Returns
+        -------
+        fit_times : dict
+        {n_cores: time of the fit (s)}
+        """
+    backend=ml_get_backend()
+    par=snapshot['pars'][para_nb-1]
+    delta=par['sigma'] if par['sigma']>0 else np.abs(par['values'][0]/10.) or np.abs(par['values'][1])
+    par_value=par['values'][0]+delta if par['values'][0]+delta<=par['values'][5] else par['values'][0]-delta
+    scan={'n_restore':0,'n_disk_restore':0,'t_restore':0.,'t_fit':0.,'n_fits':0}
+    fit_times={}
+    for n_cores in n_cores_list:
+        backend.set_parallel(n_cores)
+        for repeat in range(n_repeat):
+            t_fit=scan['t_fit']
+            ml_constrained_fit(snapshot,para_nb,par_value,scan)
+            fit_times[n_cores]=min(fit_times.get(n_cores,np.inf),scan['t_fit']-t_fit)
+    ml_restore_state(snapshot)
+    return fit_times
+
+def ml_core_scheduler(snapshot,para_nb,core_budget):
+    """Function to calibrate the fit time of a model and return the MlCoreScheduler of a core budget (see scheduler.py)."""
+    n_free=sum([1 for par in snapshot['pars'] if not par['frozen'] and par['link']==''])-1
+    k_parallel=max(min(core_budget,n_free),1)
+    fit_times=ml_calibrate_fit(snapshot,para_nb,sorted(set([1,k_parallel])))
+    return MlCoreScheduler(core_budget,n_free,fit_times[1],fit_times[k_parallel],k_parallel)
+
+def ml_results_table(filename,level,capacity):
+    """Function to create the table of the errors, with one error_min/error_max pair of columns per level.
+
+        Parameters
+        ----------
+        filename : str
+        Text file of the results.
+        level : float or list of float
+        Statistic level(s). With a float the columns are error_min error_max, with a list 
+        error_min_<level> error_max_<level> for each level.
+        capacity : int
+        Number of rows preallocated.
+
+        Returns
+        -------
+        table : MlResultsTable
+        """
+    if np.ndim(level)==0:
+        error_names=['error_min','error_max']
+    else:
+        error_names=[name+'_'+str(float(one_level)) for one_level in level for name in ['error_min','error_max']]
+    dt = np.dtype([('para_nb',  np.int32, (1,)),('name', np.str_, 16) ,('best_fit_value', np.float64, (1,))]+[(name, np.float64, (1,)) for name in error_names]+[('hard_min_hit', np.bool, (1,)),('hard_max_hit', np.bool, (1,))])
+    return MlResultsTable(filename,dt,capacity,'%1.d %s %1.9f '+'%1.9f '*len(error_names)+'%d %d')
+
+def ml_profile_keys(snapshot,free_pars,settings):
+    """Function to compute the cache keys of the profiles of the parameters.
+
+        The key of a parameter is the hash of the model expression, the data digest of the backend, the frozen flag, 
+        link and hard limits of every parameter with the value of the frozen and linked ones, the fit statistic method, 
+        the profiling settings and the parameter number. The values of the free parameters are not in the key: they 
+        are the result of the fit, checked with the best fit statistic stored with the profile.
+
+        Parameters
+        ----------
+        snapshot : dict
+        Snapshot of the best fit returned by ml_snapshot_state.
+        free_pars : list of int
+        Parameters to profile.
+        settings : dict
+        Settings changing the profiles (levels, search method and options).
+
+        Returns
+        -------
+        keys : dict
+        {para_nb: key}
+        """
+    backend=ml_get_backend()
+    pars=[[par['frozen'],par['link'],par['values'][2],par['values'][5]]+([par['values'][0]] if par['frozen'] or par['link']!='' else []) for par in snapshot['pars']]
+    common=ml_cache_key(backend.expression(),backend.data_digest(),pars,snapshot['fit']['statMethod'],settings)
+    return dict((para_nb,ml_cache_key(common,para_nb)) for para_nb in free_pars)
+
+def ml_results_store(path,level):
+    """Function to open the binary results store of a run (store.py) with its two tables.
+
+        'summary' has the columns of the table of the errors (ml_results_table), one value per column, and 
+        'points' has one row per point of the profiles (para_nb, par_value, dstat). A table whose columns 
+        changed (e.g. other levels) is started again.
+
+        Parameters
+        ----------
+        path : str
+        Directory of the store, <filexcm>_store.
+        level : float or list of float
+        Statistic level(s), see ml_results_table.
+
+        Returns
+        -------
+        store : MlColumnStore
+        """
+    store=MlColumnStore(path)
+    store.create_table('summary',ml_scalar_dtype(ml_results_table('',level,0).dtype))
+    store.create_table('points',[('para_nb',np.int32),('par_value',np.float64),('dstat',np.float64)])
+    return store
+
+def ml_results_header(fitstatmin,fitdof,level):
+    """Header of the table of the errors: fit settings, best fit statistic, levels and column names."""
+    backend=ml_get_backend()
+    info="Fit statMethod: "+str(backend.fit_settings()['statMethod'])+" | "+"Fit statTest: "+str(backend.stat_test())+" | "+"Fit statistic: "+str(fitstatmin)+" | "+"Fit DOF: "+str(fitdof)+" | "+"Confidence level: "+' '.join([str(one_level) for one_level in np.atleast_1d(level)])+" \n"
+    return info+'para_nb name '+' '.join([name for name in ml_results_table('',level,0).dtype.names if name not in ['para_nb','name']])
+
+
+def ml_get_errors(filexcm,statistic,selection='all',blacklist=[''],n_cores=8,level=2.706,plot_statistic=True,interp_method="linear",n_workers=1,parallel_directions=False,in_memory_restore=True,search_method="steppar",xtol=None,warm_start=False,extrapolate=False,backend=None,journal=False,shift_tolerance=0.1,plot_latex=True,plot_workers=None,events=False,profiler=None,profile_phases=None,cache=False,cache_dir=None,cache_size=500.,core_budget=None,parabolic_tolerance=0.1,max_fits=None,stream=None):
     """Main function to evaluate errors of an XSPEC model.
 
+    The errors are appended to <filexcm>_list.txt and, with the points of the profiles, to the binary 
+    results store <filexcm>_store (see ml_results_store).
+
     Parameters
     ----------
     filexcm : str
@@ -98,14 +1549,101 @@ def ml_get_errors(filexcm,statistic,selection='all',blacklist=[''],n_cores=8,lev
         Default is ['']
     n_cores : float
         Number of cores to set for the XSPEC parallel variable.
-    level : float
+    level : float or list of float
         Chi2 level to evaluate a confidence interval. Default is chi2 = 2.706 
-        for a 90% confidence interval.
+        for a 90% confidence interval. With a list of levels (e.g. [1.,2.706,6.635]) the profiles are scanned 
+        once up to the highest level and the interval of every level is extracted from the same profile. 
+        <filexcm>_list.txt then has the columns error_min_<level> error_max_<level> for each level.
+        The lower levels are sampled with the step of the highest level, interp_method="spline" is recommended. 
+        With search_method="bracket" or "parabolic" the crossing of each lower level is refined by fits instead.
     plot_statistic : bool
-        Used to plot or not the statistic graphs.
+        Used to plot or not the statistic graphs. The plots are rendered after the fits, see plot_workers.
     interp_method : str
-        Method for the interpolation of the statistic. "linear" uses a linear interpolation and the brentq method
-        for a the root finding. "spline" uses a spline interpolation and find the roots with a scipy method in the spline class.
+        Method for the interpolation of the statistic. "linear" takes the crossing of the level on the segment between the two bracketing points,
+        "spline" the root of the cubic spline interpolation on that segment. The crossings closest to the best fit are kept.
+    n_workers : int
+        Number of worker processes. If greater than 1, each parameter is profiled in its own process with its own 
+        XSPEC session restored from the .xcm file. When a worker finds a new best fit, the other workers are stopped 
+        and the profiling restarts from the new minimum. Default is 1 (sequential profiling).
+    parallel_directions : bool
+        If True, the left and right directions of each parameter are scanned at the same time in two worker 
+        processes. Only used when n_workers is 1, since the workers of the process pool cannot start processes.
+    in_memory_restore : bool
+        If True, the best fit is captured once in memory and each step of the profiles resets the parameters 
+        from this snapshot. The .xcm file is read again only if the loaded data change. If False, the .xcm file 
+        is restored at each step. The time spent in restores and fits is printed at the end.
+    search_method : str
+        Method used to find the crossing of the level on each side. "steppar" walks outward with a fixed step 
+        of sigma/4. "bracket" brackets the crossing with a geometric expansion of the distance to the best fit 
+        and refines it with the Brent method on constrained fits. "parabolic" fits the crossing predicted by the parabolic 
+        (covariance) interval, sigma*sqrt(level), and the crossing of the parabola through this point: if the second one is 
+        within parabolic_tolerance of the level the crossings are taken from the quadratic through the two points (two fits 
+        per side), otherwise the side is bracketed like "bracket" from the points already fitted. Whether the covariance 
+        crossing itself is within parabolic_tolerance is printed for each side. The number of fits is printed for each parameter.
+    xtol : float or None
+        Tolerance on the interval endpoints for search_method="bracket" or "parabolic". Default is 1% of sigma.
+    warm_start : bool
+        If True, each point of a profile starts from the solution of the previous point instead of the best fit. 
+        A point whose statistic is lower than the one of a point closer to the best fit is fitted again from the best fit.
+    extrapolate : bool
+        If True, the warm start is linearly extrapolated from the two previous points.
+    backend : XspecBackend, LocalBackend or None
+        Fit backend of backend.py. If None, the backend selected with ml_set_backend is used 
+        (XspecBackend by default). With LocalBackend the files have the .npz extension instead of .xcm.
+    journal : bool
+        If True, every point of the profiles is appended to the checkpoint journal <filexcm>_journal.txt 
+        (best fit statistic, parameter, direction, value, delta statistic, fit time). A restarted run replays the 
+        points of the journal computed for the same best fit and continues each profile from the exact step. Default is False.
+    shift_tolerance : float or None
+        When a new best fit is found, the profiles already computed are shifted by the change of the best fit values 
+        and their crossings of the level are verified with one fit each from the new best fit (ml_shift_profile). Only 
+        the parameters whose verified crossing differs from the level by more than shift_tolerance are profiled 
+        again. If None, all the parameters are profiled again. Default is 0.1.
+    plot_latex : bool
+        If False, the statistic plots are rendered with the matplotlib mathtext instead of LaTeX (faster, no LaTeX needed).
+    plot_workers : int or None
+        Number of processes rendering the statistic plots once all the parameters are profiled (ml_render_plots). 
+        The plots are merged in <filexcm>_plots.pdf. Default is the number of CPUs.
+    events : bool
+        If True, the events of the run are appended as JSON lines to <filexcm>_events.jsonl (instrument.py): time of 
+        each restore, fit (with its number of iterations), interpolation and plot, delta statistic and step size of each 
+        point of the profiles, retries (step reductions, warm start fallbacks), hard caps and new best fits. The summary 
+        per parameter and per run is printed at the end, see ml_instrument_summary. Default is False.
+    profiler : 'cprofile', callable or None
+        Profiler enabled only during the phases listed in profile_phases, see MlInstrument. Its statistics are written 
+        in <filexcm>_events_<phase>_<pid>.prof by each process.
+    profile_phases : list of str or None
+        Phases profiled among 'restore', 'fit', 'interp', 'plot', 'render' and 'profile' (whole parameter).
+    cache : bool
+        If True, the profile of each parameter is stored in a content-addressed cache (cache.py) under the hash of the 
+        model expression, the data and response files, the frozen parameters and limits, the statistic and the profiling 
+        settings (see ml_profile_keys). A run with the same inputs reads the profiles from the cache instead of fitting, 
+        a partially changed run only profiles the parameters whose key changed. A cached profile is used only if the best 
+        fit statistic is the same (within criticalDelta), with its stored best fit value. Unless it already lists all the 
+        parameters, <filexcm>_list.txt is then written again from the cache and the new profiles. If False, a restarted 
+        run reads <filexcm>_list.txt and profiles the missing parameters. Default is False.
+    cache_dir : str or None
+        Directory of the cache, it can be shared by several models and runs. Default is pyXIFU_cache next to the .xcm file.
+    cache_size : float
+        Size bound of the cache directory in MB, the least recently used profiles are removed beyond it. Default is 500.
+    parabolic_tolerance : float
+        Maximum difference between the delta statistic of the verification fits and the level for search_method="parabolic". 
+        Default is 0.1.
+    core_budget : int or None
+        Total number of cores of the run. If given, n_workers and n_cores are replaced by the split of the budget chosen 
+        by MlCoreScheduler (scheduler.py) from the time of a constrained fit with one core and with the parallel fit 
+        (Xset.parallel.leven), and the number of parameters to profile. Before each fit a worker sets its parallel fit 
+        cores to its share of the budget among the busy workers, so the cores of the finished workers go to the 
+        running ones. The split is chosen again after a new best fit.
+    max_fits : int or None
+        Fit budget of the profile of each parameter (both sides, or each side with parallel_directions). The profile 
+        is stopped when it is spent, the sides whose crossing was not reached have a NaN error. Default is no budget.
+    stream : MlStreamControl or None
+        Channel of MlErrorStream (stream.py): the events of the run are put in its queue by every process, and the 
+        profile of a parameter, or the whole run, is stopped before its next fit when the consumer asks for it. 
+        A stopped profile is reported in the 'parameter' event with status 'stopped' but it is not written in the 
+        results, the cache or the plots, so a later run profiles it again (replaying its points from the journal if journal=True). 
+        When the run is stopped, the parameters not started are skipped and the plots of the finished ones are rendered.
     
     +-----------+---------+---------+---------+---------+---------+---------+---------+---------+---------+
     |   sigma   |  1.00s  |  1.28s  |  1.64   |  1.96s  |  2.00s  |  2.58s  |  3.00s  |  3.29s  |  4.00s  |
@@ -114,41 +1652,71 @@ def ml_get_errors(filexcm,statistic,selection='all',blacklist=[''],n_cores=8,lev
     | level     | 1.000   | 1.642   | 2.706   | 3.841   | 4.000   | 6.635   | 9.000   | 10.828  | 16.000  |
     +-----------+---------+---------+---------+---------+---------+---------+---------+---------+---------+
 
+    Returns
+    -------
+    run_stats : dict
+        Number of distinct profiled parameters, number of fits (including the initial fit), number of restores (and from disk), 
+        number of warm start fallbacks, number of points replayed from the journal, number of profiles shifted to a 
+        new best fit and fits saved by the shifts, the number of stopped profiles, and the time in seconds spent in restores, 
+        fits, interpolations and plots.
+
     """
     filename=filexcm
     start=datetime.datetime.now()
     if not os.path.isdir(filename+"_plots"):
         os.mkdir(filename+"_plots")
-    Xset.restore(filexcm+".xcm")
+    if backend is not None: ml_set_backend(backend)
+    backend=ml_get_backend()
+    instrument=ml_set_instrument(MlInstrument(filename+'_events.jsonl' if events else None,profiler=profiler,phases=profile_phases,queue=stream.queue if stream is not None else None))
+    ml_set_fit_control(stream,max_fits)
+    instrument.event('start',model=filexcm,statistic=statistic,level=level,search_method=search_method,n_workers=n_workers,backend=backend.backend_name)
+    run_stats={'n_parameters':0,'n_fits':0,'n_restore':1,'n_disk_restore':1,'t_restore':0.,'t_fit':0.,'n_fallback':0,'n_replayed':0,'n_shifted':0,'n_saved':0,'t_interp':0.,'t_plot':0.,'n_cached':0,'n_cache_saved':0,'n_stopped':0}
+    restore_start=time.time()
+    with instrument.phase('restore',from_disk=True):
+        backend.restore(filexcm)
+    run_stats['t_restore']+=time.time()-restore_start
     try:
         if statistic=='cstat':
-            Fit.statMethod='cstat'
+            backend.set_statistic('cstat')
         elif statistic=='chi':
-            Fit.statMethod='chi'
+            backend.set_statistic('chi')
         else : 
             raise ValueError('Wrong statistic method entered !')
     except ValueError:
          print "Please restart the script and change the statistic method"
     
-    Fit.query='no'
+    backend.set_fit_settings({'query':'no'})
     para_sigma=4.
+    if search_method not in _ml_search_methods:
+        raise ValueError('Wrong search method entered !')
+    #------ The profiles are scanned up to the highest level, all the levels are extracted from them ------
+    levels=[float(one_level) for one_level in np.atleast_1d(level)]
+    scan_level=max(levels)
+    search_options={'warm_start':warm_start,'extrapolate':extrapolate}
+    if search_method in ["bracket","parabolic"]:
+        search_options['xtol']=xtol
+        if len(levels)>1: search_options['levels']=levels
+    if search_method=="parabolic":
+        search_options['tolerance']=parabolic_tolerance
+    journal_file=filename+'_journal.txt'
+    if journal and not os.path.isfile(journal_file):
+        with open(journal_file,'w') as f:
+            f.write("# fitstatmin para_nb par_dir par_value dstat t_fit\n")
     d=datetime.datetime.now()
     title="Title: "+filename+"Date: "+d.strftime("%c")
-    head='para_nb name best_fit_value error_min error_max hard_min_hit hard_max_hit'
-    dt = np.dtype([('para_nb',  np.int32, (1,)),('name', np.str_, 16) ,('best_fit_value', np.float64, (1,)),('error_min', np.float64, (1,)),('error_max', np.float64, (1,)),('hard_min_hit', np.bool, (1,)),('hard_max_hit', np.bool, (1,))])
     out_pdf = filename+'_plots.pdf'
     metadata={'Creator': 'Mehdy Lefkir', 'Author': 'Mehdy Lefkir', 'Title': 'Errors plots on model'}
     free_pars,to_be_frozen=[],[]
-    for i in range(1,AllModels(1).nParameters+1):
-        if AllModels(1)(i).link=='' and not AllModels(1)(i).frozen :
+    for i in range(1,backend.n_parameters()+1):
+        if backend.link(i)=='' and not backend.is_frozen(i) :
                 free_pars.append(i)
-        if not AllModels(1)(i).frozen and AllModels(1)(i).name in blacklist:
+        if not backend.is_frozen(i) and backend.name(i) in blacklist:
                 to_be_frozen.append(i)
     if not selection=="all":
         free_pars=selection
         for i in free_pars:
-            if AllModels(1)(i).frozen:
-                print "<  WARNING  > : Parameter ",i,' ',AllModels(1)(i).name,' is frozen but in the selection ! It will be remove from the list.'
+            if backend.is_frozen(i):
+                print "<  WARNING  > : Parameter ",i,' ',backend.name(i),' is frozen but in the selection ! It will be remove from the list.'
                 selection.remove(i)
         free_pars=selection
     print "Free parameters =",free_pars
@@ -157,170 +1725,638 @@ def ml_get_errors(filexcm,statistic,selection='all',blacklist=[''],n_cores=8,lev
     print "Blacklisting all parameters with name :",blacklist
     print "Parameters blacklisted =",to_be_frozen
     for i in to_be_frozen:
-        AllModels(1)(i).frozen=True
-    Fit.nIterations=100 
-    Fit.criticalDelta= 0.01
-    Fit.perform()
-    os.system("rm "+filexcm+".xcm"); Xset.save(filexcm+".xcm",info="a")
-    Xset.parallel.leven = n_cores
-    fitstatmin=Fit.statistic
+        backend.freeze(i,True)
+    backend.set_fit_settings({'nIterations':100,'criticalDelta':0.01})
+    fit_start=time.time()
+    with instrument.phase('fit') as event:
+        backend.fit()
+        event['iterations'],event['statistic']=backend.iterations(),backend.statistic()
+    run_stats['n_fits']+=1 ; run_stats['t_fit']+=time.time()-fit_start
+    backend.save(filexcm)
+    backend.set_parallel(n_cores)
+    fitstatmin=backend.statistic()
+    fitdof=backend.dof()
+    snapshot=ml_snapshot_state(filexcm,in_memory_restore)
     print "Fit statistic =",fitstatmin
-    if os.path.isfile(filename+'_list.txt'):
-        Array=np.loadtxt(filename+"_list.txt",dtype=dt)
-        if len(Array["para_nb"].flatten())==len(free_pars): 
-            if (Array["para_nb"].flatten()==free_pars).all():
-                print '<  WARNING  > : Errors on this model were already computed !'
-                print '<  INFO  > : Stopping script'
-                return
-            else: 
-                j=free_pars.index(int(Array["para_nb"][-1]))+1
-                print '<  INFO  > : Restarting steppar from parameter ',free_pars[j],' ',AllModels(1)(free_pars[j]).name
+    if journal:
+        search_options['journal']={'file':journal_file,'points':ml_journal_load(journal_file,fitstatmin,snapshot['fit']['criticalDelta'])}
+        if search_options['journal']['points']:
+            print '<  INFO  > : Points of the journal valid for this best fit :',sum([len(points) for points in search_options['journal']['points'].values()])
+
+    def results_header():
+        return ml_results_header(fitstatmin,fitdof,level)
+
+    profile_cache,cache_keys=None,{}
+    if cache:
+        profile_cache=MlProfileCache(cache_dir or os.path.join(os.path.dirname(os.path.abspath(filexcm)),'pyXIFU_cache'),int(cache_size*1024**2))
+        settings=dict((key,value) for key,value in search_options.items() if key!='journal')
+        settings.update({'levels':levels,'search_method':search_method,'para_sigma':para_sigma})
+        cache_keys=ml_profile_keys(snapshot,free_pars,settings)
+
+    Array=ml_results_table(filename+'_list.txt',level,len(free_pars))
+    store=ml_results_store(filename+'_store',level)
+    if Array.load() and (profile_cache is None or set(free_pars)<=set(int(i) for i in Array.rows["para_nb"].flatten())):
+        done=[int(i) for i in Array.rows["para_nb"].flatten()]
+        todo=[i for i in free_pars if i not in done]
+        #------ The store keeps the rows of the results file and the points of their parameters only ------
+        points=store.read('points',mmap=False)
+        store.rewrite('summary',ml_scalar_rows(Array.rows))
+        store.rewrite('points',points[np.in1d(points['para_nb'],done)])
+        if len(todo)==0:
+            print '<  WARNING  > : Errors on this model were already computed !'
+            print '<  INFO  > : Stopping script'
+            return run_stats
         else:
-            j=free_pars.index(int(Array["para_nb"][-1]))+1
-            print '<  INFO  > : Restarting steppar from parameter ',free_pars[j],' ',AllModels(1)(free_pars[j]).name
+            print '<  INFO  > : Restarting steppar from parameter ',todo[0],' ',backend.name(todo[0])
     else:
-        Array=np.delete(np.zeros((1),dtype=dt),0)
         print '<  INFO  > : Initializing steppar'
-        j=0      
-    if plot_statistic :  mergedObject = PdfFileMerger()
-        
-    newbestfit=False
-    while j<len(free_pars):
-        Xset.restore(filexcm+".xcm")
-        para_nb=free_pars[j] 
-        if AllModels(1)(para_nb).link!='' or AllModels(1)(para_nb).frozen==True :
-            print "<  INFO  > : Frozen parameter : I pass"
-        else :  
-            if plot_statistic : pdf = matplotlib.backends.backend_pdf.PdfPages(str(para_nb)+'.pdf')
-            newbestfit=False
-            cost_list,par_list=np.array([[],[]]),np.array([])       
-            initial_value=AllModels(1)(para_nb).values[0]
-            step_steppar=AllModels(1)(para_nb).sigma/para_sigma
-            hardcap_hit=[False,False] # hardcap_hit[0]=hardcapmin, hardcap_hit[1]=hardcapmax
-            if step_steppar <=0 and np.abs(initial_value - AllModels(1)(para_nb).values[2]) < 1e-8 :
-                print "<  WARNING  > : Parameter pegged at the hard lower limit",par_value,AllModels(1)(para_nb).values[2]
-                hardcap_hit[0]=True
-            if step_steppar <=0 and np.abs(initial_value - AllModels(1)(para_nb).values[5]) < 1e-8 :
-                print "<  WARNING  > : Parameter pegged at the hard upper limit"
-                hardcap_hit[1]=True
-            if step_steppar <= 0 : step_steppar=np.abs(AllModels(1)(para_nb).values[0]/10.)
-            print "<  INFO  > : Starting steppar on parameter ",para_nb,' :',AllModels(1)(para_nb).name
-            print "<  INFO  > : Initial value :", initial_value
-            step_steppar_cur=step_steppar
-            for par_dir in [-1,1]:               
-                if par_dir==-1: index_cap=0
-                elif par_dir==1: index_cap=1
-                if index_cap:
-                    cost_list=np.append(cost_list,0)
-                    par_list=np.append(par_list,initial_value)
-                    print "<  INFO  > : Initiating direction ==> right"
-                else:
-                    print "<  INFO  > : Initiating direction <== left"
-                step=para_sigma
-                dstat,n_fits=0,0
-                step_steppar_cur=step_steppar 
-                while not newbestfit and dstat<level+0.1 and not hardcap_hit[index_cap]:
-                    Xset.restore(filexcm+".xcm")
-                    par_value=initial_value+par_dir*step*step_steppar_cur
-                    if index_cap==0:
-                        if par_value < AllModels(1)(para_nb).values[2] :
-                            hardcap_hit[0]=True
-                            print "<  WARNING  > : ---Hard min hit---"
-                    elif index_cap==1:
-                        if par_value > AllModels(1)(para_nb).values[5] :
-                            hardcap_hit[1]=True
-                            print "<  WARNING  > : ---Hard max hit---"
-                    if hardcap_hit[index_cap]==True:
-                        print "<  WARNING  > : Hard cap hit, continue"
-                    else :
-                        AllModels(1).setPars({para_nb:par_value})
-                        AllModels(1)(para_nb).frozen=True
-                        Fit.perform()
-                        n_fits+=1
-                        dstat=Fit.statistic-fitstatmin
-                        if dstat < -Fit.criticalDelta :
-                            print "New miminum statistic found",dstat
-                            AllModels(1)(para_nb).frozen=False
-                            fitstatmin=Fit.statistic
-                            os.system("rm "+filexcm+".xcm") ; Xset.save(filexcm+".xcm")
-                            os.system("rm "+filename+'_list.txt')
-                            plt.close('all')
-                            Array=np.delete(np.zeros((1),dtype=dt),0)
-                            newbestfit=True
-                            j,n_fits=0,0 #with this line the whole procedure restarts completely from the first parameter when a new best fit is found!
-                        else :                        
-                            if dstat > level and n_fits<=2:
-                                step_steppar_cur=step_steppar_cur/4.
-                                n_fits,dstat=0,0
-                                step=1
-                                print "<  WARNING  > : Not enough points",step,step_steppar_cur,par_value
-                                if index_cap==0:
-                                    cost_list,par_list=np.array([[],[]]),np.array([])
-                            else :
-                                cost_list=np.append(cost_list,dstat) ; par_list=np.append(par_list,par_value)
-                                print "<  STEP  > : ",int(step),par_value, "dstat=",dstat,initial_value-par_value
-                                step=step+1
-            if not newbestfit:
-                #------ Finding the errors depends on the hard cap hit variable ------
-                if hardcap_hit==[False,False]:
-                    par_list, cost_list = zip(*sorted(zip(par_list, cost_list)))
-                    par_list,cost_list=np.array(par_list),np.array(cost_list)
-                    err_min,err_max,new_x,f=ml_interpolation_statistics_errors(initial_value,np.sort(par_list),cost_list,'None',level,interp_method)
-                    if plot_statistic :
-                        fig=ml_plotting_statistics_errors(new_x,f,err_min,err_max,par_list,cost_list,initial_value,para_nb,statistic,level,filexcm+".xcm",interp_method)
-                        pdf.savefig(fig,bbox_inches='tight')
-                        pdf.close()
-                elif hardcap_hit==[True,True] :
-                    err_min=initial_value-AllModels(1)(para_nb).values[2]
-                    err_max=AllModels(1)(para_nb).values[5]-initial_value
-                elif hardcap_hit[0]:
-                    par_list, cost_list = zip(*sorted(zip(par_list, cost_list)))
-                    par_list,cost_list=np.array(par_list),np.array(cost_list)
-                    err_min=initial_value-AllModels(1)(para_nb).values[2]
-                    err_max,new_x,f=ml_interpolation_statistics_errors(initial_value,np.sort(par_list),cost_list,hardcap_hit,level,'linear')
-                    if plot_statistic :
-                        fig=ml_plotting_statistics_errors(new_x,f,err_min,err_max,par_list,cost_list,initial_value,para_nb,statistic,level,filexcm+".xcm",interp_method)
-                        pdf.savefig(fig,bbox_inches='tight')
-                        pdf.close()
-                elif hardcap_hit[1]:
-                    par_list, cost_list = zip(*sorted(zip(par_list, cost_list)))
-                    par_list,cost_list=np.array(par_list),np.array(cost_list)
-                    err_min,new_x,f=ml_interpolation_statistics_errors(initial_value,np.sort(par_list),cost_list,hardcap_hit,level,'linear')
-                    err_max=AllModels(1)(para_nb).values[5]-initial_value
-                    if plot_statistic :
-                        fig=ml_plotting_statistics_errors(new_x,f,err_min,err_max,par_list,cost_list,initial_value,para_nb,statistic,level,filexcm+".xcm",interp_method)
-                        pdf.savefig(fig,bbox_inches='tight')
-                        pdf.close()
-                initial_value = np.array([initial_value])
-                hardcap_hit_array = np.array([hardcap_hit[0]])
-                val_cost = np.concatenate([initial_value, np.sort(par_list), cost_list, hardcap_hit_array])
-                #val_cost=np.array([initial_value,np.sort(par_list),cost_list,hardcap_hit[0]])
-                np.save(str(para_nb)+'_val_cost',val_cost,allow_pickle=True)
-                Array=np.append(Array,np.array([(int(para_nb),AllModels(1)(para_nb).name,initial_value,err_min,err_max,hardcap_hit[0],hardcap_hit[1])],dtype=dt))                   
-                AllModels(1)(para_nb).frozen=False
-                if plot_statistic :
-                    if os.path.exists(str(para_nb)+'.pdf'):
-                        shutil.move(str(para_nb)+'.pdf',filename+"_plots/"+str(para_nb)+'.pdf')
-                    elif os.path.exists(filename+"_plots/"+str(para_nb)+'.pdf'):
-                        print "<  INFO  > :  The statistic plot was already moved"
-                    else:
-                        print "<  WARNING  > : The statistic plot was not found !"
-                if os.path.exists(str(para_nb)+'_val_cost.npy'):
-                    shutil.move(str(para_nb)+'_val_cost.npy',filename+"_plots/"+str(para_nb)+'_val_cost.npy')
-                elif os.path.exists(filename+"_plots/"+str(para_nb)+'_val_cost.npy'):
-                    print "<  INFO  > : The statistic array file was already moved"
+        todo=list(free_pars)
+        #------ The results file is started again, with the cache the cached parameters are written first ------
+        Array.reset(results_header())
+        store.rewrite('summary') ; store.rewrite('points')
+    Array.write_header(results_header())
+    store.set_attrs(model=filexcm,statistic=statistic,level=levels,fitstat=fitstatmin,dof=fitdof,run=instrument.run_id)
+
+    completed,profiled=[],set()
+
+    def cancelled():
+        return stream is not None and stream.stopped(0)
+
+    def add_results(Array,profile):
+        if profile['status']=='stopped':
+            #------ The partial interval is only reported, the parameter stays to be profiled in the results ------
+            err_min,err_max=ml_finalize_parameter(profile,filexcm,statistic,level,False,interp_method)
+            run_stats['n_stopped']+=1
+            print "<  INFO  > : Parameter",profile['para_nb'],"stopped after",profile['n_fits'],"fits, errors :",err_min,err_max
+            instrument.event('parameter',para_nb=profile['para_nb'],name=profile['name'],n_fits=profile['n_fits'],t_fit=profile['t_fit'],t_restore=profile['t_restore'],
+                             n_points=len(profile['par_list']),hardcap_hit=profile['hardcap_hit'],err_min=err_min,err_max=err_max,status='stopped')
+            return Array
+        completed.append(profile)
+        err_min,err_max=ml_finalize_parameter(profile,filexcm,statistic,level,plot_statistic,interp_method,store)
+        profiled.add(profile['para_nb'])
+        run_stats['n_parameters']=len(profiled) ; run_stats['t_interp']+=profile['t_interp'] ; run_stats['t_plot']+=profile['t_plot']
+        print "<  INFO  > : Parameter",profile['para_nb'],"done with",profile['n_fits'],"fits"
+        instrument.event('parameter',para_nb=profile['para_nb'],name=profile['name'],n_fits=profile['n_fits'],t_fit=profile['t_fit'],t_restore=profile['t_restore'],
+                         n_points=len(profile['par_list']),hardcap_hit=profile['hardcap_hit'],err_min=err_min,err_max=err_max,status='done')
+        errors=np.column_stack([np.atleast_1d(err_min),np.atleast_1d(err_max)]).flatten()
+        row=Array.append((int(profile['para_nb']),profile['name'],profile['initial_value'])+tuple(errors)+(profile['hardcap_hit'][0],profile['hardcap_hit'][1]))
+        store.append('summary',ml_scalar_rows(Array.rows[-1:]))
+        if profile_cache is not None and not profile.get('cached'):
+            profile_cache.put(cache_keys[profile['para_nb']],profile)
+        print "Results :",row
+        return Array
+
+    def from_cache(todo):
+        if profile_cache is None:
+            return todo
+        missing=[]
+        for para_nb in todo:
+            profile=profile_cache.get(cache_keys[para_nb])
+            if profile is None or abs(profile['fitstat']-fitstatmin)>snapshot['fit']['criticalDelta']:
+                missing.append(para_nb)
+                continue
+            #------ The stored best fit value is kept, it equals the one of this run within the fit tolerance ------
+            run_stats['n_cached']+=1 ; run_stats['n_cache_saved']+=profile['n_fits_profile']
+            print "<  INFO  > : Profile of parameter",para_nb,"read from the cache"
+            add_results(Array,profile)
+        return missing
+
+    def count_restores(profile):
+        for key in ['n_fits','n_restore','n_disk_restore','t_restore','t_fit','n_fallback','n_replayed']:
+            run_stats[key]+=profile[key]
+
+    def reset_results():
+        Array.reset(results_header())
+        store.rewrite('summary') ; store.rewrite('points')
+        store.set_attrs(fitstat=fitstatmin)
+        if 'matplotlib.pyplot' in sys.modules: sys.modules['matplotlib.pyplot'].close('all')
+        return Array
+
+    def refit_newbest():
+        fit_start=time.time()
+        with instrument.phase('fit') as event:
+            backend.fit()
+            event['iterations'],event['statistic']=backend.iterations(),backend.statistic()
+        run_stats['n_fits']+=1 ; run_stats['t_fit']+=time.time()-fit_start
+        backend.save(filexcm)
+        return backend.statistic()
+
+    def recenter(previous):
+        Array=reset_results()
+        del completed[:]
+        done=[]
+        for profile in previous:
+            shifted=ml_shift_profile(profile,snapshot,fitstatmin,scan_level,shift_tolerance,search_options.get('journal'))
+            count_restores(shifted)
+            if shifted['status']=='done':
+                run_stats['n_shifted']+=1 ; run_stats['n_saved']+=max(shifted['n_fits_profile']-shifted['n_fits'],0)
+                Array=add_results(Array,shifted)
+                done.append(profile['para_nb'])
+            else:
+                print "<  INFO  > : The interval of parameter",profile['para_nb'],"moved with the new best fit, it will be profiled again"
+        return Array,from_cache([i for i in free_pars if i not in done])
+
+    todo=from_cache(todo)
+    scheduler=None
+    calibrated=[i for i in todo if not snapshot['pars'][i-1]['frozen'] and snapshot['pars'][i-1]['link']=='']
+    if core_budget is not None and calibrated:
+        scheduler=ml_core_scheduler(snapshot,calibrated[0],core_budget)
+
+    def schedule(todo):
+        n_pool,n_leven=scheduler.plan(len(todo))
+        print "<  INFO  > : Core budget",scheduler.core_budget,": workers",n_pool,"| parallel fit cores",n_leven,"| parallel fraction of the fit",round(scheduler.parallel_fraction,3)
+        instrument.event('schedule',core_budget=scheduler.core_budget,n_workers=n_pool,n_cores=n_leven,parallel_fraction=scheduler.parallel_fraction,n_todo=len(todo))
+        return n_pool,n_leven
+
+    if scheduler is not None:
+        n_workers,n_cores=schedule(todo)
+        backend.set_parallel(n_cores)
+    if n_workers>1:
+        if parallel_directions:
+            print "<  WARNING  > : parallel_directions is not used with n_workers > 1"
+        while todo:
+            newbest,stale=[],[]
+            if scheduler is not None and len(todo)<n_workers: n_workers,n_cores=schedule(todo)
+            for profile in ml_parallel_profiles(filexcm,todo,fitstatmin,scan_level,n_workers,para_sigma,statistic,n_cores,snapshot,search_method,search_options,scheduler):
+                count_restores(profile)
+                if profile['status']=='newbestfit':
+                    print "<  INFO  > : New best fit found by the worker of parameter",profile['para_nb'],"statistic =",profile['fitstat']
+                    newbest.append(profile)
+                elif not newbest:
+                    Array=add_results(Array,profile)
                 else:
-                    print "<  WARNING  > : The statistic array file was not found !"
-                #if plot_statistic : mergedObject.append(PdfFileReader(filename+"_plots/"+str(para_nb)+'.pdf', 'rb'))
-        if not newbestfit:
+                    stale.append(profile)
+            todo=[]
+            if newbest:
+                newbest.sort(key=lambda profile: profile['fitstat'])
+                shutil.move(newbest[0]['xcm']+backend.extension,filexcm+backend.extension)
+                for profile in newbest[1:]:
+                    os.remove(profile['xcm']+backend.extension)
+                backend.restore(filexcm)
+                fitstatmin=refit_newbest()
+                snapshot=ml_snapshot_state(filexcm,in_memory_restore)
+                if journal: search_options['journal']['points']=ml_journal_load(journal_file,fitstatmin,snapshot['fit']['criticalDelta'])
+                print "<  INFO  > : Re-centering all the workers on the new best fit, statistic =",fitstatmin
+                Array,todo=recenter(completed+stale if shift_tolerance is not None else [])
+            if cancelled():
+                todo=[]
+        backend.restore(filexcm)
+    else:
+        j=0
+        while j<len(todo) and not cancelled():
+            ml_restore_state(snapshot)
+            para_nb=todo[j] 
+            if backend.link(para_nb)!='' or backend.is_frozen(para_nb)==True :
+                print "<  INFO  > : Frozen parameter : I pass"
+                j=j+1
+                continue
+            with instrument.phase('profile',para_nb=para_nb) as event:
+                profile=ml_profile_parameter(filexcm,para_nb,fitstatmin,scan_level,para_sigma,parallel_directions=parallel_directions,statistic=statistic,n_cores=n_cores,snapshot=snapshot,search_method=search_method,search_options=search_options)
+                event['n_fits'],event['status']=profile['n_fits'],profile['status']
+            count_restores(profile)
+            if profile['status']=='aborted':
+                break
+            if profile['status']=='newbestfit':
+                fitstatmin=refit_newbest()
+                snapshot=ml_snapshot_state(filexcm,in_memory_restore)
+                if journal: search_options['journal']['points']=ml_journal_load(journal_file,fitstatmin,snapshot['fit']['criticalDelta'])
+                print "<  INFO  > : Re-centering on the new best fit, statistic =",fitstatmin
+                Array,todo=recenter(list(completed) if shift_tolerance is not None else [])
+                j=0
+                continue
+            Array=add_results(Array,profile)
             j=j+1
-            info="Fit statMethod: "+str(Fit.statMethod)+" | "+"Fit statTest: "+str(Fit.statTest)+" | "+"Fit statistic: "+str(Fit.statistic)+" | "+"Fit DOF: "+str(Fit.dof)+" | "+"Confidence level: "+str(level)+" \n"
-            np.savetxt(filename+'_list.txt',Array,header=info+head,fmt='%1.d %s %1.9f %1.9f %1.9f %1.d %1.d')
-            print "Results :",Array
-    #if plot_statistic : mergedObject.write(filename+"_error_plots.pdf")
+    if cancelled():
+        print "<  INFO  > : Run stopped by the stream, parameters profiled :",run_stats['n_parameters'],"| stopped :",run_stats['n_stopped']
+    if plot_statistic :
+        plot_start=time.time()
+        ml_render_plots(filexcm,plot_workers or multiprocessing.cpu_count(),plot_latex,selection=free_pars)
+        run_stats['t_plot']+=time.time()-plot_start
     #convert_to_excel(filename,dt)
     end=datetime.datetime.now()
+    if run_stats['n_restore']>0:
+        print "<  INFO  > :  Restores :",run_stats['n_restore'],"(from disk :",run_stats['n_disk_restore'],") | mean time per step :",1e3*run_stats['t_restore']/run_stats['n_restore'],"ms"
+    if run_stats['n_fits']>0:
+        print "<  INFO  > :  Fits :",run_stats['n_fits'],"| mean time per fit :",1e3*run_stats['t_fit']/run_stats['n_fits'],"ms"
+    if warm_start:
+        print "<  INFO  > :  Warm starts replaced by a fit from the best fit :",run_stats['n_fallback']
+    if run_stats['n_replayed']>0:
+        print "<  INFO  > :  Points replayed from the journal :",run_stats['n_replayed']
+    if run_stats['n_shifted']>0:
+        print "<  INFO  > :  Profiles shifted to a new best fit :",run_stats['n_shifted'],"| fits saved :",run_stats['n_saved']
+    if run_stats['n_cached']>0:
+        print "<  INFO  > :  Profiles read from the cache :",run_stats['n_cached'],"| fits saved :",run_stats['n_cache_saved']
     print "<  INFO  > :  Finished in ",str(end-start)
+    instrument.event('run',wall=(end-start).total_seconds(),**run_stats)
+    instrument.dump_profiles()
+    ml_set_fit_control()
+    if events:
+        ml_print_instrument_summary(ml_instrument_summary(instrument.filename,instrument.run_id))
+    return run_stats
+
+_ml_worker_snapshot=None
+
+def _ml_snapshot_worker_init(filexcm,statistic,n_cores):
+    """Open the fit session of a worker process on the best fit stored in the .xcm file and take its snapshot."""
+    global _ml_worker_snapshot
+    _ml_worker_session(filexcm,statistic,n_cores)
+    _ml_worker_snapshot=ml_snapshot_state(filexcm)
+
+def _ml_bootstrap_worker(seed):
+    """Worker of the process pool: fit one Poisson realization of the best fit."""
+    snapshot=_ml_worker_snapshot
+    return ml_bootstrap_realization(snapshot,seed,snapshot['xcm']+'_boot_'+str(os.getpid()))
+
+def ml_bootstrap_realization(snapshot,seed,file_prefix):
+    """Function to simulate one Poisson realization of the best fit and fit it from the best fit values.
+
+        Parameters
+        ----------
+        snapshot : dict
+        Snapshot of the best fit returned by ml_snapshot_state.
+        seed : int
+        Seed of the realization.
+        file_prefix : str
+        Prefix of the fake spectra files.
+
+        Returns
+        -------
+        seed, statistic, values : int, float, list of float
+        Seed, fit statistic and fitted values of the free parameters of the snapshot.
+        """
+    backend=ml_get_backend()
+    #------ Only the model is reset, the data are the ones of the previous realization ------
+    snapshot['data']=backend.data_fingerprint()
+    ml_restore_state(snapshot)
+    backend.fakeit(seed,None,file_prefix)
+    with ml_get_instrument().phase('fit',seed=seed) as event:
+        backend.fit()
+        event['iterations'],event['statistic']=backend.iterations(),backend.statistic()
+    free=[i for i,par in enumerate(snapshot['pars'],1) if par['link']=='' and not par['frozen']]
+    return seed,backend.statistic(),[backend.get_values(i)[0] for i in free]
+
+
+def ml_bootstrap_intervals(best_values,samples,level,hard_limits=None):
+    """Function to compute the errors of the parameters from the distribution of the bootstrap fits.
+
+        The interval of each level is given by the percentiles of the distribution containing the probability 
+        of the level for one parameter (e.g. 5% and 95% for 2.706).
+
+        Parameters
+        ----------
+        best_values : numpy array (n_parameters,)
+        Best fit values.
+        samples : numpy array (n_realizations, n_parameters)
+        Fitted values of each realization.
+        level : float or list of float
+        Statistic levels.
+        hard_limits : numpy array (n_parameters, 2) or None
+        Hard limits of the parameters, used to flag the intervals stopped by a limit.
+
+        Returns
+        -------
+        err_min, err_max : numpy array (n_parameters, n_levels)
+        Errors on the left and right side of the best fit value.
+        hard_hit : numpy array (n_parameters, 2) of bool
+        True if the widest interval reaches the hard min or hard max.
+        """
+    from scipy.stats import chi2
+    probability=chi2.cdf(np.atleast_1d(level),1)
+    low=np.percentile(samples,50.*(1.-probability),axis=0).T
+    high=np.percentile(samples,50.*(1.+probability),axis=0).T
+    err_min=np.abs(best_values[:,None]-low)
+    err_max=np.abs(high-best_values[:,None])
+    hard_hit=np.zeros((len(best_values),2),dtype=bool)
+    if hard_limits is not None:
+        widest=np.argmax(probability)
+        hard_hit[:,0]=low[:,widest]<=hard_limits[:,0]
+        hard_hit[:,1]=high[:,widest]>=hard_limits[:,1]
+    return err_min,err_max,hard_hit
+
+
+def ml_bootstrap_errors(filexcm,statistic,n_realizations=1000,n_workers=1,level=2.706,tolerance=0.05,batch=None,min_realizations=100,seed=0,n_cores=1,backend=None):
+    """Function to evaluate the errors of all the parameters with a parametric bootstrap.
+
+        The best fit of the .xcm file is simulated with Poisson realizations (fakeit) and each realization 
+        is fitted from the best fit values, in n_workers processes each with its own XSPEC session. The errors 
+        of every parameter and the correlation matrix are computed from the distribution of the fitted values. 
+        The realizations are run by batches and stop when the errors change by less than tolerance.
+
+        Parameters
+        ----------
+        filexcm : str
+        Name of the .xcm XSPEC file (without extension) to load both the model and the data.
+        statistic : {'cstat', 'chi'}
+        Statistic of the fit method.
+        n_realizations : int
+        Maximum number of realizations.
+        n_workers : int
+        Number of worker processes fitting the realizations.
+        level : float or list of float
+        Chi2 level(s) of the confidence intervals, see ml_get_errors.
+        tolerance : float
+        The bootstrap stops when the largest relative change of the errors after a batch is below tolerance.
+        batch : int or None
+        Number of realizations of a batch. Default is max(50, 4*n_workers).
+        min_realizations : int
+        Minimum number of realizations before the convergence test.
+        seed : int
+        Seed of the first realization, the realization k has the seed seed+k.
+        n_cores : int
+        Number of cores to set for the XSPEC parallel variable in each worker.
+        backend : XspecBackend, LocalBackend or None
+        Fit backend of backend.py, see ml_get_errors.
+
+        Returns
+        -------
+        bootstrap : dict
+        Parameter numbers, names, best fit values, fitted values of each realization (samples), statistics, 
+        errors (err_min, err_max of shape (n_parameters, n_levels)), correlation matrix, number of realizations, 
+        convergence flag and wall time.
+        The errors are written in <filexcm>_bootstrap.txt (same columns as <filexcm>_list.txt), the correlation 
+        matrix in <filexcm>_bootstrap_corr.txt and the samples in <filexcm>_bootstrap_samples.npy.
+        """
+    start=time.time()
+    if backend is not None: ml_set_backend(backend)
+    backend=ml_get_backend()
+    backend.restore(filexcm)
+    backend.set_statistic(statistic)
+    backend.set_fit_settings({'query':'no','nIterations':100,'criticalDelta':0.01})
+    backend.fit()
+    backend.save(filexcm)
+    backend.set_parallel(n_cores)
+    fitstatmin,fitdof=backend.statistic(),backend.dof()
+    snapshot=ml_snapshot_state(filexcm)
+    free=[i for i,par in enumerate(snapshot['pars'],1) if par['link']=='' and not par['frozen']]
+    best_values=np.array([snapshot['pars'][i-1]['values'][0] for i in free])
+    hard_limits=np.array([[snapshot['pars'][i-1]['values'][2],snapshot['pars'][i-1]['values'][5]] for i in free])
+    print "Fit statistic =",fitstatmin
+    print "<  INFO  > : Bootstrap of the",len(free),"free parameters with at most",n_realizations,"realizations"
+    if batch is None: batch=max(50,4*n_workers)
+    samples=np.empty((n_realizations,len(free)))
+    statistics=np.empty(n_realizations)
+    n_done,converged,errors=0,False,None
+    pool=multiprocessing.Pool(n_workers,_ml_snapshot_worker_init,(filexcm,statistic,n_cores)) if n_workers>1 else None
+    try:
+        while n_done<n_realizations and not converged:
+            seeds=range(seed+n_done,seed+min(n_done+batch,n_realizations))
+            if pool is not None:
+                results=pool.map(_ml_bootstrap_worker,seeds)
+            else:
+                results=[ml_bootstrap_realization(snapshot,one_seed,filexcm+'_boot') for one_seed in seeds]
+            for one_seed,one_statistic,values in results:
+                samples[one_seed-seed]=values
+                statistics[one_seed-seed]=one_statistic
+            n_done+=len(seeds)
+            err_min,err_max,hard_hit=ml_bootstrap_intervals(best_values,samples[:n_done],level,hard_limits)
+            new_errors=np.concatenate([err_min,err_max],axis=1)
+            if errors is not None and n_done>=min_realizations:
+                change=np.max(np.abs(new_errors-errors)/np.maximum(new_errors,1e-30))
+                converged=change<tolerance
+                print "<  INFO  > : Bootstrap realizations :",n_done,"| largest relative change of the errors :",change
+            errors=new_errors
+        if pool is not None: pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    samples,statistics=samples[:n_done],statistics[:n_done]
+    backend.restore(filexcm)
+    correlation=np.corrcoef(samples,rowvar=False) if len(free)>1 else np.ones((1,1))
+    table=ml_results_table(filexcm+'_bootstrap.txt',level,len(free))
+    table.write_header(ml_results_header(fitstatmin,fitdof,level))
+    for k,para_nb in enumerate(free):
+        table.append((para_nb,backend.name(para_nb),best_values[k])+tuple(np.column_stack([err_min[k],err_max[k]]).flatten())+(hard_hit[k,0],hard_hit[k,1]))
+    np.savetxt(filexcm+'_bootstrap_corr.txt',correlation,fmt='%1.6f',header='correlation matrix of the parameters '+' '.join([str(i) for i in free]))
+    np.save(filexcm+'_bootstrap_samples',samples)
+    print "Results :",table.rows
+    if not converged:
+        print "<  WARNING  > : The bootstrap errors did not converge within",n_realizations,"realizations"
+    print "<  INFO  > :  Bootstrap finished in ",round(time.time()-start,3),"s"
+    return {'para_nb':free,'names':[backend.name(i) for i in free],'best_values':best_values,'samples':samples,'statistics':statistics,
+            'err_min':err_min,'err_max':err_max,'correlation':correlation,'n_realizations':n_done,'converged':converged,'wall':time.time()-start}
+
+
+def ml_pair_fit(snapshot,para_pair,pair_values,counters):
+    """Function to fit the model with two parameters frozen at given values, from the best fit.
+
+        Parameters
+        ----------
+        snapshot : dict
+        Snapshot of the best fit returned by ml_snapshot_state.
+        para_pair : (int, int)
+        Numbers of the two parameters.
+        pair_values : (float, float)
+        Values of the two frozen parameters.
+        counters : dict
+        Number of fits and restores and time spent in them, updated like the counters of a scan.
+
+        Returns
+        -------
+        statistic : float
+        Fit statistic of the constrained fit.
+        """
+    elapsed,from_disk=ml_restore_state(snapshot,para_pair[0])
+    counters['n_restore']+=1 ; counters['n_disk_restore']+=int(from_disk) ; counters['t_restore']+=elapsed
+    backend=ml_get_backend()
+    backend.set_values(dict(zip(para_pair,pair_values)))
+    for para_nb in para_pair:
+        backend.freeze(para_nb,True)
+    fit_start=time.time()
+    with ml_get_instrument().phase('fit',para_nb=para_pair[0],para_pair=list(para_pair),par_value=list(pair_values)) as event:
+        backend.fit()
+        event['iterations'],event['statistic']=backend.iterations(),backend.statistic()
+    counters['t_fit']+=time.time()-fit_start
+    counters['n_fits']+=1
+    return event['statistic']
+
+def _ml_contour_worker(task):
+    """Worker of the process pool: fit one point of a contour grid."""
+    para_pair,pair_values=task
+    counters={'n_fits':0,'n_restore':0,'n_disk_restore':0,'t_restore':0.,'t_fit':0.}
+    statistic=ml_pair_fit(_ml_worker_snapshot,para_pair,pair_values,counters)
+    return pair_values,statistic,counters
+
+
+def ml_contour_polygons(x,y,dstat,levels):
+    """Function to extract the contour polygons of the delta statistic grid at each level.
+
+        Parameters
+        ----------
+        x, y : numpy array
+        Values of the two parameters on the axes of the grid.
+        dstat : numpy array (len(x), len(y))
+        Delta statistic at each point of the grid.
+        levels : list of float
+        Statistic levels.
+
+        Returns
+        -------
+        polygons : dict
+        {level: list of numpy arrays (n_vertices, 2)}, a polygon is open where the contour leaves the grid.
+        """
+    levels=sorted(levels)
+    import matplotlib.pyplot as plt
+    fig=plt.figure()
+    contours=plt.contour(x,y,dstat.T,levels)
+    polygons=dict((level,[np.array(segment) for segment in segments]) for level,segments in zip(levels,contours.allsegs))
+    plt.close(fig)
+    return polygons
+
+
+def ml_get_contours(filexcm,statistic,para_pair,level=[2.30,4.61,9.21],n_grid=9,n_refine=3,extent=None,n_workers=1,n_cores=1,backend=None,plot=True,plot_latex=True):
+    """Function to compute the confidence contours of two parameters on an adaptive grid.
+
+        The delta statistic is computed on a coarse n_grid x n_grid grid with the two parameters frozen and the other 
+        free parameters fitted. Each cell whose corners straddle one of the levels is divided in four, n_refine times, 
+        so only the cells crossed by the contours are refined. The points of each refinement are fitted in n_workers 
+        processes, each with its own XSPEC session. The grid points not fitted are interpolated bilinearly in their 
+        cell, far from the contours. A contour entirely inside a coarse cell is missed, n_grid must resolve the 
+        smallest contour.
+
+        Parameters
+        ----------
+        filexcm : str
+        Name of the .xcm XSPEC file (without extension) to load both the model and the data.
+        statistic : {'cstat', 'chi'}
+        Statistic of the fit method.
+        para_pair : (int, int)
+        Numbers of the two parameters, e.g. (LineE, Sigma) or (kT, abundance).
+        level : float or list of float
+        Statistic levels of the contours. For two parameters 2.30, 4.61 and 9.21 are the 68.3%, 90% and 99% contours.
+        n_grid : int
+        Number of points of the coarse grid on each axis.
+        n_refine : int
+        Number of refinements, the final grid has (n_grid-1)*2**n_refine+1 points on each axis.
+        extent : [(float, float), (float, float)] or None
+        Range of each parameter. Default is the best fit value +- 1.5*sqrt(max(level)) sigma, within the hard limits.
+        n_workers : int
+        Number of worker processes fitting the grid points.
+        n_cores : int
+        Number of cores to set for the XSPEC parallel variable in each worker.
+        backend : XspecBackend, LocalBackend or None
+        Fit backend of backend.py, see ml_get_errors.
+        plot : bool
+        If True, the contours are plotted in <filexcm>_contour_<p1>_<p2>.pdf.
+        plot_latex : bool
+        If False, the plot is rendered with the matplotlib mathtext instead of LaTeX.
+
+        Returns
+        -------
+        contours : dict
+        Parameter numbers and names, best fit values, levels, axes x and y of the final grid, delta statistic on the 
+        grid (dstat), fitted points (n_points, 3: x, y, dstat), contour polygons (see ml_contour_polygons), number of 
+        fits, time spent in fits and wall time.
+        The grid and the fitted points are saved in <filexcm>_contour_<p1>_<p2>.npz and the polygons in 
+        <filexcm>_contour_<p1>_<p2>.txt (level, polygon number, x, y).
+        """
+    start=time.time()
+    if backend is not None: ml_set_backend(backend)
+    backend=ml_get_backend()
+    backend.restore(filexcm)
+    backend.set_statistic(statistic)
+    backend.set_fit_settings({'query':'no','nIterations':100,'criticalDelta':0.01})
+    backend.fit()
+    backend.save(filexcm)
+    backend.set_parallel(n_cores)
+    fitstatmin=backend.statistic()
+    snapshot=ml_snapshot_state(filexcm)
+    para_pair=tuple(int(para_nb) for para_nb in para_pair)
+    levels=sorted([float(one_level) for one_level in np.atleast_1d(level)])
+    best=np.array([snapshot['pars'][para_nb-1]['values'][0] for para_nb in para_pair])
+    if extent is None:
+        extent=[]
+        for para_nb,value in zip(para_pair,best):
+            sigma=snapshot['pars'][para_nb-1]['sigma']
+            if sigma<=0: sigma=np.abs(value/10.) or np.abs(snapshot['pars'][para_nb-1]['values'][1])
+            width=1.5*np.sqrt(max(levels))*sigma
+            extent.append((max(value-width,snapshot['pars'][para_nb-1]['values'][2]),min(value+width,snapshot['pars'][para_nb-1]['values'][5])))
+    n_axis=(n_grid-1)*2**n_refine+1
+    x,y=np.linspace(extent[0][0],extent[0][1],n_axis),np.linspace(extent[1][0],extent[1][1],n_axis)
+    stat=np.full((n_axis,n_axis),np.nan)
+    counters={'n_fits':0,'n_restore':0,'n_disk_restore':0,'t_restore':0.,'t_fit':0.}
+    print "Fit statistic =",fitstatmin
+    print "<  INFO  > : Contours of the parameters",para_pair,"at the levels",levels,"on a",n_grid,"x",n_grid,"grid refined",n_refine,"times"
+    pool=multiprocessing.Pool(n_workers,_ml_snapshot_worker_init,(filexcm,statistic,n_cores)) if n_workers>1 else None
+
+    def evaluate(indices):
+        indices=sorted(set([index for index in indices if np.isnan(stat[index])]))
+        tasks=[(para_pair,(x[i],y[j])) for i,j in indices]
+        if pool is not None:
+            results=pool.map(_ml_contour_worker,tasks)
+        else:
+            results=[(task[1],ml_pair_fit(snapshot,para_pair,task[1],counters),None) for task in tasks]
+        for (i,j),(pair_values,one_statistic,worker_counters) in zip(indices,results):
+            stat[i,j]=one_statistic
+            if worker_counters is not None:
+                for key in counters: counters[key]+=worker_counters[key]
+        return len(indices)
+
+    def crosses(cell):
+        i,j,size=cell
+        corners=stat[[i,i+size,i,i+size],[j,j,j+size,j+size]]-fitstatmin
+        return any([corners.min()<one_level<=corners.max() for one_level in levels])
+
+    try:
+        size=2**n_refine
+        evaluate([(i,j) for i in range(0,n_axis,size) for j in range(0,n_axis,size)])
+        cells=[(i,j,size) for i in range(0,n_axis-1,size) for j in range(0,n_axis-1,size)]
+        leaves=[]
+        for refinement in range(n_refine):
+            crossing=[cell for cell in cells if crosses(cell)]
+            leaves+=[cell for cell in cells if not crosses(cell)]
+            half=size//2
+            cells=[(i+di,j+dj,half) for i,j,cell_size in crossing for di in [0,half] for dj in [0,half]]
+            n_new=evaluate([(i+di,j+dj) for i,j,cell_size in cells for di in [0,half] for dj in [0,half]])
+            print "<  INFO  > : Refinement",refinement+1,":",len(crossing),"cells crossing the levels,",n_new,"new points"
+            size=half
+        leaves+=cells
+        if pool is not None: pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    backend.restore(filexcm)
+    fitted=~np.isnan(stat)
+    points=np.column_stack([x[np.nonzero(fitted)[0]],y[np.nonzero(fitted)[1]],stat[fitted]])
+    #------ The points not fitted are interpolated in their cell, which is not crossed by the contours ------
+    for i,j,size in leaves:
+        if size>1:
+            t=np.linspace(0.,1.,size+1)
+            u,v=t[:,None],t[None,:]
+            corners=stat[[i,i+size,i,i+size],[j,j,j+size,j+size]]
+            block=stat[i:i+size+1,j:j+size+1]
+            bilinear=(1-u)*(1-v)*corners[0]+u*(1-v)*corners[1]+(1-u)*v*corners[2]+u*v*corners[3]
+            block[np.isnan(block)]=bilinear[np.isnan(block)]
+    minimum=np.min(points[:,2])
+    if minimum<fitstatmin-snapshot['fit']['criticalDelta']:
+        print "<  WARNING  > : A point of the grid is below the best fit statistic",minimum,fitstatmin,", the contours are relative to this point"
+        fitstatmin=minimum
+    dstat=stat-fitstatmin
+    points[:,2]-=fitstatmin
+    polygons=ml_contour_polygons(x,y,dstat,levels)
+    output=filexcm+'_contour_'+str(para_pair[0])+'_'+str(para_pair[1])
+    np.savez(output+'.npz',para_pair=para_pair,best=best,levels=levels,x=x,y=y,dstat=dstat,points=points)
+    with open(output+'.txt','w') as f:
+        f.write('# contours of the parameters '+str(para_pair[0])+' '+str(para_pair[1])+'\n# level polygon x y\n')
+        for one_level in levels:
+            for k,polygon in enumerate(polygons[one_level]):
+                for vertex in polygon:
+                    f.write('%r %d %1.9e %1.9e\n' % (one_level,k,vertex[0],vertex[1]))
+    names=[backend.name(para_nb) for para_nb in para_pair]
+    if plot:
+        import matplotlib.backends.backend_pdf
+        import matplotlib.pyplot as plt
+        from plotting import ml_plotting_contours
+        fig=ml_plotting_contours(x,y,dstat,points,polygons,levels,best,para_pair,names,[backend.unit(para_nb) for para_nb in para_pair],statistic,plot_latex)
+        pdf=matplotlib.backends.backend_pdf.PdfPages(output+'.pdf')
+        pdf.savefig(fig,bbox_inches='tight')
+        pdf.close()
+        plt.close(fig)
+    print "<  INFO  > : Fitted points :",len(points),"instead of",n_axis**2,"for the full grid | fits :",counters['n_fits'],"| mean time per fit :",1e3*counters['t_fit']/max(counters['n_fits'],1),"ms"
+    print "<  INFO  > :  Contours finished in ",round(time.time()-start,3),"s"
+    return {'para_pair':para_pair,'names':names,'best':best,'levels':levels,'x':x,'y':y,'dstat':dstat,'points':points,'polygons':polygons,
+            'n_fits':counters['n_fits'],'t_fit':counters['t_fit'],'wall':time.time()-start}
 
 """
 def convert_to_excel(filename,dtype):
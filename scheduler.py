@@ -0,0 +1,92 @@
+"""
+    scheduler.py  -  core budget of the pyXIFU error engine
+    ---------------------------------------------------------------------------------
+    Author: V. Fioretti (INAF/OAS) valentina.fioretti@inaf.it
+    ---------------------------------------------------------------------------------
+    Dependencies:
+    - python 2.7
+    ---------------------------------------------------------------------------------
+    MlCoreScheduler splits a total number of cores between the worker processes
+    profiling the parameters and the parallel fit of each worker (Xset.parallel.leven).
+    The parallel fit splits the derivatives of the free parameters between processes,
+    so its speedup is bounded by the number of free parameters and is measured with a
+    short calibration: the same constrained fit is timed with one core and with several,
+    and the parallel fraction of the fit time is derived from Amdahl's law. The plan
+    minimizes the estimated time of the remaining profiles (number of waves of workers
+    times the time of a fit). Before each fit a worker takes its share of the budget
+    among the busy workers, so the cores of the workers still running are increased
+    as the parameters finish and the budget stays used without being exceeded.
+    ---------------------------------------------------------------------------------
+    Usage example:
+    > python scheduler.py 16 12 0.8 0.25 8
+    (16 cores, 12 free parameters, fit of 0.8 s with one core and 0.25 s with 8 cores)
+    """
+
+
+import sys
+
+
+class MlCoreScheduler(object):
+    """Split of a core budget between the worker processes and the parallel fit cores of each worker.
+
+        Parameters
+        ----------
+        core_budget : int
+        Total number of cores of the run.
+        n_free : int
+        Number of free parameters of the constrained fits, the parallel fit does not use more cores.
+        t_serial : float or None
+        Time of a fit with one core (s).
+        t_parallel : float or None
+        Time of the same fit with k_parallel cores (s). Without calibration the fit is taken as serial.
+        k_parallel : int
+        Number of cores of t_parallel.
+        """
+
+    def __init__(self,core_budget,n_free,t_serial=None,t_parallel=None,k_parallel=1):
+        self.core_budget=max(int(core_budget),1)
+        self.k_max=max(min(int(n_free),self.core_budget),1)
+        self.t_serial=t_serial or 1.
+        self.parallel_fraction=0.
+        if t_serial and t_parallel and min(k_parallel,self.k_max)>1:
+            #------ Amdahl: t(k) = t(1) ((1-p) + p/k) ------
+            k=min(k_parallel,self.k_max)
+            fraction=(1.-t_parallel/t_serial)/(1.-1./k)
+            self.parallel_fraction=min(max(fraction,0.),1.)
+
+    def fit_time(self,n_cores):
+        """Estimated time of a fit with n_cores parallel fit cores (s)."""
+        k=min(max(int(n_cores),1),self.k_max)
+        return self.t_serial*((1.-self.parallel_fraction)+self.parallel_fraction/k)
+
+    def share(self,n_running,rank=0):
+        """Parallel fit cores of the worker of rank rank among n_running busy workers, the cores left by the
+            division of the budget go to the first ranks so the sum of the shares does not exceed the budget."""
+        n_running=max(int(n_running),1)
+        return min(max(self.core_budget//n_running+int(rank<self.core_budget%n_running),1),self.k_max)
+
+    def plan(self,n_tasks):
+        """Number of worker processes and parallel fit cores of the last worker for n_tasks parameters to profile.
+
+            The time of the remaining profiles is estimated as the number of waves of workers times the
+            time of a fit. With the same estimate, more workers are preferred since the profiles do not
+            all have the same number of fits.
+            """
+        best=None
+        for n_workers in range(1,max(min(self.core_budget,int(n_tasks)),1)+1):
+            n_cores=self.share(n_workers,n_workers-1)
+            waves=-(-max(int(n_tasks),1)//n_workers)
+            cost=waves*self.fit_time(n_cores)
+            if best is None or cost<best[0]*(1.-1e-9) or (cost<=best[0]*(1.+1e-9) and n_workers>best[1]):
+                best=(cost,n_workers,n_cores)
+        return best[1],best[2]
+
+
+if __name__ == '__main__':
+    arg_list = sys.argv
+    scheduler = MlCoreScheduler(int(arg_list[1]),int(arg_list[2]),float(arg_list[3]),float(arg_list[4]),int(arg_list[5]))
+    print "<  INFO  > : Parallel fraction of the fit :",round(scheduler.parallel_fraction,3)
+    n_workers, n_cores = scheduler.plan(int(arg_list[2]))
+    print "<  INFO  > : Workers :",n_workers,"| parallel fit cores :",n_cores
+    for n_left in range(int(arg_list[2]),0,-1):
+        print "<  INFO  > : Parameters left :",n_left,"| parallel fit cores of the workers :",[scheduler.share(min(n_workers,n_left),rank) for rank in range(min(n_workers,n_left))]
@@ -0,0 +1,303 @@
+"""
+    store.py  -  profile and results storage of the pyXIFU error engine
+    ---------------------------------------------------------------------------------
+    Author: V. Fioretti (INAF/OAS) valentina.fioretti@inaf.it
+    ---------------------------------------------------------------------------------
+    Dependencies:
+    - python 2.7
+    - numpy
+    ---------------------------------------------------------------------------------
+    - MlProfileBuffer holds the points (parameter value, delta statistic) of a profile
+      in a preallocated array whose capacity is doubled when it is full, so a scan
+      does not reallocate its arrays at each step.
+    - MlResultsTable holds the errors of the parameters in a fixed-dtype array sized
+      for all the free parameters and appends each new row to the <model>_list.txt
+      file instead of rewriting it.
+    - ml_load_results reads a results file written by MlResultsTable whatever its columns.
+    - MlColumnStore is the binary store of a run (<model>_store directory): typed tables of
+      fixed-size records (the errors of the parameters and the points of their profiles)
+      appended to raw files and read memory-mapped. ml_load_stores combines the tables of
+      many runs in one array, e.g. for the analysis of a campaign.
+    """
+
+
+import numpy as np
+import os
+import json
+
+
+class MlProfileBuffer(object):
+    """Growable array-backed buffer of the points (parameter value, delta statistic) of a profile."""
+
+    def __init__(self,capacity=32):
+        self._data=np.empty((2,max(int(capacity),1)))
+        self.size=0
+
+    def __len__(self):
+        return self.size
+
+    def append(self,par_value,dstat):
+        if self.size==self._data.shape[1]:
+            self._grow(2*self.size)
+        self._data[0,self.size]=par_value
+        self._data[1,self.size]=dstat
+        self.size+=1
+
+    def extend(self,other):
+        if self.size+other.size>self._data.shape[1]:
+            self._grow(2*(self.size+other.size))
+        self._data[:,self.size:self.size+other.size]=other._data[:,:other.size]
+        self.size+=other.size
+
+    def clear(self):
+        self.size=0
+
+    def _grow(self,capacity):
+        data=np.empty((2,capacity))
+        data[:,:self.size]=self._data[:,:self.size]
+        self._data=data
+
+    @property
+    def par_list(self):
+        """View on the parameter values of the points."""
+        return self._data[0,:self.size]
+
+    @property
+    def cost_list(self):
+        """View on the delta statistic of the points."""
+        return self._data[1,:self.size]
+
+    def sorted(self):
+        """Return copies of par_list and cost_list sorted by parameter value."""
+        order=np.argsort(self.par_list,kind='mergesort')
+        return self.par_list[order],self.cost_list[order]
+
+
+class MlResultsTable(object):
+    """Fixed-dtype table of the errors of the parameters, appended row by row to a text file.
+
+        Parameters
+        ----------
+        filename : str
+        Text file of the results (<model>_list.txt).
+        dtype : numpy dtype
+        Structured dtype of a row.
+        capacity : int
+        Number of rows preallocated, usually the number of free parameters.
+        fmt : str
+        Format of a row in the text file, see numpy.savetxt.
+        """
+
+    def __init__(self,filename,dtype,capacity,fmt):
+        self.filename=filename
+        self.dtype=dtype
+        self.fmt=fmt
+        self._rows=np.zeros(max(int(capacity),1),dtype=dtype)
+        self.size=0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def rows(self):
+        """View on the rows of the table."""
+        return self._rows[:self.size]
+
+    def load(self):
+        """Read the rows already written in the text file, return False if it does not exist."""
+        if not os.path.isfile(self.filename):
+            return False
+        with open(self.filename) as f:
+            lines=[line for line in f if line.strip() and not line.startswith('#')]
+        rows=np.atleast_1d(np.loadtxt(lines,dtype=self.dtype)) if lines else np.zeros(0,dtype=self.dtype)
+        if len(rows)>len(self._rows):
+            self._rows=np.zeros(len(rows),dtype=self.dtype)
+        self._rows[:len(rows)]=rows
+        self.size=len(rows)
+        return True
+
+    def write_header(self,header):
+        """Write the header and the rows of the table in a new text file, the next rows are appended to it."""
+        np.savetxt(self.filename,self.rows,header=header,fmt=self.fmt)
+
+    def append(self,row):
+        """Add a row (tuple in the order of the dtype) to the table and append it to the text file."""
+        if self.size==len(self._rows):
+            rows=np.zeros(2*self.size,dtype=self.dtype)
+            rows[:self.size]=self._rows
+            self._rows=rows
+        self._rows[self.size]=row
+        self.size+=1
+        with open(self.filename,'a') as f:
+            np.savetxt(f,self._rows[self.size-1:self.size],fmt=self.fmt)
+        return self._rows[self.size-1]
+
+    def reset(self,header):
+        """Remove all the rows and start a new text file."""
+        self.size=0
+        self.write_header(header)
+
+
+def ml_load_results(filename):
+    """Function to read a <model>_list.txt results file as a list of dict, the keys are the names of the header columns."""
+    names,rows=None,[]
+    with open(filename) as f:
+        for line in f:
+            if line.startswith('#'):
+                fields=line.lstrip('#').split()
+                if fields and fields[0]=='para_nb':
+                    names=fields
+            elif line.strip():
+                row={}
+                for name,value in zip(names,line.split()):
+                    row[name]=value if name=='name' else (int(value) if name in ['para_nb','hard_min_hit','hard_max_hit'] else float(value))
+                rows.append(row)
+    return rows
+
+
+class MlColumnStore(object):
+    """Binary store of the results of a run, one table of fixed-size records per raw file.
+
+        The store is a directory holding <table>.dat for each table and store.json with the dtype of each table 
+        and the attributes of the run. The records are appended to the raw files and the tables are read 
+        memory-mapped, so a table is never parsed nor rewritten.
+
+        Parameters
+        ----------
+        path : str
+        Directory of the store, created if needed.
+        """
+
+    def __init__(self,path):
+        self.path=path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.schema={'tables':{},'attrs':{}}
+        if os.path.isfile(self._schema_file()):
+            with open(self._schema_file()) as f:
+                self.schema=json.load(f)
+
+    def _schema_file(self):
+        return os.path.join(self.path,'store.json')
+
+    def _table_file(self,table):
+        return os.path.join(self.path,table+'.dat')
+
+    def _write_schema(self):
+        with open(self._schema_file(),'w') as f:
+            json.dump(self.schema,f,sort_keys=True,default=lambda value: value.tolist())
+
+    @property
+    def tables(self):
+        return sorted(self.schema['tables'])
+
+    @property
+    def attrs(self):
+        """Attributes of the run (e.g. fit statistic, levels)."""
+        return self.schema['attrs']
+
+    def set_attrs(self,**attrs):
+        self.schema['attrs'].update(attrs)
+        self._write_schema()
+
+    def dtype(self,table):
+        return _ml_dtype_from_descr(self.schema['tables'][table])
+
+    def create_table(self,table,dtype):
+        """Create an empty table, or keep the existing one if it has the same dtype (a different dtype starts a new table)."""
+        dtype=np.dtype(dtype)
+        if table in self.schema['tables'] and self.dtype(table)==dtype and os.path.isfile(self._table_file(table)):
+            return
+        self.schema['tables'][table]=dtype.descr
+        self._write_schema()
+        open(self._table_file(table),'wb').close()
+
+    def append(self,table,rows):
+        """Append rows (structured array, or tuple for one row, in the order of the dtype) to the raw file of the table."""
+        dtype=self.dtype(table)
+        if isinstance(rows,tuple):
+            rows=np.array([rows],dtype=dtype)
+        with open(self._table_file(table),'ab') as f:
+            np.asarray(rows,dtype=dtype).tofile(f)
+
+    def read(self,table,mmap=True):
+        """Read a table, memory-mapped (read-only) if mmap is True, as a structured array."""
+        dtype=self.dtype(table)
+        filename=self._table_file(table)
+        n_rows=os.path.getsize(filename)//dtype.itemsize if os.path.isfile(filename) else 0
+        if n_rows==0:
+            return np.zeros(0,dtype=dtype)
+        if mmap:
+            return np.memmap(filename,dtype=dtype,mode='r',shape=(n_rows,))
+        return np.fromfile(filename,dtype=dtype,count=n_rows)
+
+    def rewrite(self,table,rows=None):
+        """Replace the content of a table by rows (empty if None)."""
+        with open(self._table_file(table),'wb') as f:
+            if rows is not None and len(rows):
+                np.asarray(rows,dtype=self.dtype(table)).tofile(f)
+
+
+def _ml_dtype_from_descr(descr):
+    """numpy dtype from a dtype descr read from json (lists instead of tuples, unicode names)."""
+    return np.dtype([tuple([str(field[0]),str(field[1])]+([tuple(field[2])] if len(field)>2 else [])) for field in descr])
+
+
+def ml_scalar_dtype(dtype):
+    """Structured dtype with the same columns as dtype but one value per column (e.g. the dtype of MlResultsTable)."""
+    return np.dtype([(name,dtype.fields[name][0].base) for name in dtype.names])
+
+
+def ml_scalar_rows(rows):
+    """Copy of rows of MlResultsTable (columns of shape (1,)) with one value per column."""
+    scalar=np.zeros(len(rows),dtype=ml_scalar_dtype(rows.dtype))
+    for name in rows.dtype.names:
+        scalar[name]=rows[name].reshape(len(rows))
+    return scalar
+
+
+def ml_table_rows(array):
+    """Function to convert the rows of a structured array of one value per column into a list of dict."""
+    return [dict((name,row[name].item()) for name in array.dtype.names) for row in array]
+
+
+def ml_load_stores(paths,table='summary',runs=None):
+    """Function to combine a table of many stores in one structured array.
+
+        Parameters
+        ----------
+        paths : list of str
+        Directories of the stores.
+        table : str
+        Table to combine, e.g. 'summary' (errors of the parameters) or 'points' (profiles).
+        runs : list of str or None
+        Name of each store, written in the first column 'run'. Default is the directory name.
+
+        Returns
+        -------
+        combined : numpy structured array
+        Rows of all the stores. The columns are the union of the columns of the stores (e.g. different levels), 
+        the missing values are NaN for the float columns and 0 for the other ones.
+        """
+    if runs is None: runs=[os.path.basename(os.path.normpath(path)) for path in paths]
+    arrays=[]
+    for path in paths:
+        store=MlColumnStore(path)
+        arrays.append(store.read(table) if table in store.tables else None)
+    fields=[]
+    for array in arrays:
+        if array is not None:
+            fields+=[(name,array.dtype.fields[name][0]) for name in array.dtype.names if name not in [field[0] for field in fields]]
+    dtype=np.dtype([('run','S'+str(max([len(run) for run in runs]+[1])))]+fields)
+    combined=np.zeros(sum([len(array) for array in arrays if array is not None]),dtype=dtype)
+    for name,field_dtype in fields:
+        if field_dtype.kind=='f': combined[name]=np.nan
+    start=0
+    for run,array in zip(runs,arrays):
+        if array is None:
+            continue
+        combined['run'][start:start+len(array)]=run
+        for name in array.dtype.names:
+            combined[name][start:start+len(array)]=array[name]
+        start+=len(array)
+    return combined
@@ -0,0 +1,173 @@
+"""
+    stream.py  -  streaming interface of the pyXIFU error engine
+    ---------------------------------------------------------------------------------
+    Author: V. Fioretti (INAF/OAS) valentina.fioretti@inaf.it
+    ---------------------------------------------------------------------------------
+    Dependencies:
+    - python 2.7
+    - pyXSPEC running on Python 2.7 (backend=xspec)
+    ---------------------------------------------------------------------------------
+    MlErrorStream runs pyXIFU.ml_get_errors in a child process and yields its events
+    as they are produced, from the main process and from the worker processes:
+    - 'step': one point of a profile (para_nb, par_dir, par_value, dstat)
+    - 'parameter': the interval of a finished parameter (err_min, err_max, n_fits,
+      status 'done', or 'stopped' for a partial profile)
+    - 'newbestfit', 'hardcap', 'retry', 'stopped', the timed phases ('fit', 'restore', ...)
+    - 'end': the statistics of the run returned by ml_get_errors (also in stream.result)
+    The consumer stops the profile of one parameter, or the whole run, with stop(): the
+    request is read before each fit, so the running fit finishes and the results, plots
+    and .xcm files are left consistent. A fit budget per parameter is set with max_fits.
+    Breaking out of the loop stops the run the same way.
+    ---------------------------------------------------------------------------------
+    Usage example:
+    > python stream.py base10_60_error cstat max_fits=40 n_workers=8 plot_statistic=False
+    > python stream.py base10_60_error cstat backend=local search_method=bracket
+    (one JSON line per event on the standard output, e.g. for a dashboard, the output of the engine goes to base10_60_error_stream.log)
+
+    import stream
+    errors=stream.MlErrorStream('base10_60_error','cstat',max_fits=40,n_workers=8)
+    for event in errors:
+        if event['kind']=='parameter':
+            print event['para_nb'],event['err_min'],event['err_max']
+    print errors.result
+    """
+
+
+import os
+import sys
+import json
+import Queue
+import traceback
+import multiprocessing
+
+
+class MlStreamControl(object):
+    """Channel between the consumer of MlErrorStream and the processes of the error engine.
+
+        Parameters
+        ----------
+        max_parameters : int
+        Highest parameter number that can be stopped alone.
+        """
+
+    def __init__(self,max_parameters=4096):
+        self.queue=multiprocessing.Queue()
+        self.flags=multiprocessing.Array('b',max_parameters+1,lock=False)
+
+    def stop(self,para_nb=None):
+        """Ask the engine to stop the profile of the parameter para_nb, or the whole run if para_nb is None."""
+        self.flags[para_nb or 0]=1
+
+    def stopped(self,para_nb=0):
+        """True if the profile of the parameter para_nb (0 for the run) must stop before its next fit."""
+        return bool(self.flags[0] or (0<para_nb<len(self.flags) and self.flags[para_nb]))
+
+
+def _ml_stream_run(control,filexcm,statistic,options,log=None):
+    """Child process of MlErrorStream: run the error engine and put its result in the queue."""
+    if log is not None:
+        #------ The output of the engine and of XSPEC is written in the log file instead of the standard output ------
+        sys.stdout.flush()
+        os.dup2(os.open(log,os.O_WRONLY|os.O_CREAT|os.O_APPEND,0644),1)
+    try:
+        import pyXIFU as px
+        if isinstance(options.get('backend'),str):
+            import backend
+            options=dict(options,backend=backend.backends[options['backend']]())
+        result={'kind':'end','result':px.ml_get_errors(filexcm,statistic,stream=control,**options)}
+    except Exception:
+        result={'kind':'error','traceback':traceback.format_exc()}
+    control.queue.put(result)
+
+
+class MlErrorStream(object):
+    """Iterator over the events of pyXIFU.ml_get_errors, run in a child process.
+
+        Parameters
+        ----------
+        filexcm : str
+        Name of the .xcm XSPEC file to load both the model and the data.
+        statistic : {'cstat', 'chi'}
+        Statistic of the fit method.
+        kinds : list of str or None
+        Kinds of events yielded, e.g. ['step','parameter']. The 'end' event is always yielded. Default is all the events.
+        timeout : float
+        Time between two checks that the child process is alive while waiting for an event (s).
+        log : str or None
+        File receiving the printed output of the engine. Default is the standard output.
+        **options :
+        Keyword arguments of ml_get_errors, e.g. max_fits, n_workers, level or search_method. The backend can be given
+        by its name in backend.backends ('xspec' or 'local'), it is then created in the child process.
+        """
+
+    def __init__(self,filexcm,statistic,kinds=None,timeout=1.,log=None,**options):
+        self.filexcm=filexcm
+        self.statistic=statistic
+        self.kinds=set(kinds) if kinds is not None else None
+        self.timeout=timeout
+        self.log=log
+        self.options=options
+        self.control=MlStreamControl()
+        self.process=None
+        self.result=None
+
+    def stop(self,para_nb=None):
+        """Stop the profile of the parameter para_nb, or the whole run if para_nb is None, before their next fit."""
+        self.control.stop(para_nb)
+
+    def next_record(self):
+        """Wait for the next record of the queue, None if the child process ended without sending its result."""
+        while True:
+            try:
+                return self.control.queue.get(timeout=self.timeout)
+            except Queue.Empty:
+                if not self.process.is_alive():
+                    return None
+
+    def __iter__(self):
+        self.process=multiprocessing.Process(target=_ml_stream_run,args=(self.control,self.filexcm,self.statistic,self.options,self.log))
+        self.process.start()
+        try:
+            while True:
+                record=self.next_record()
+                if record is None:
+                    raise RuntimeError('The error engine stopped with exit code '+str(self.process.exitcode))
+                if record['kind']=='error':
+                    raise RuntimeError('The error engine failed:\n'+record['traceback'])
+                if record['kind']=='end':
+                    self.result=record['result']
+                    yield record
+                    return
+                if self.kinds is None or record['kind'] in self.kinds:
+                    yield record
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop the run if it is still going and wait for the child process, the remaining events are dropped."""
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            self.stop()
+            #------ The queue is emptied so the child process can flush it and exit ------
+            while True:
+                record=self.next_record()
+                if record is None or record['kind'] in ['end','error']:
+                    break
+            if record is not None and record['kind']=='end':
+                self.result=record['result']
+        self.process.join()
+        self.process=None
+
+
+if __name__ == '__main__':
+    from campaign import ml_parse_option
+    from instrument import _ml_json_default
+    arg_list = sys.argv
+    options = {}
+    for arg in arg_list[3:]:
+        key, value = arg.split('=', 1)
+        options[key] = ml_parse_option(key, value)
+    for event in MlErrorStream(arg_list[1], arg_list[2], log=arg_list[1]+'_stream.log', **options):
+        print json.dumps(event, sort_keys=True, default=_ml_json_default)
+        sys.stdout.flush()
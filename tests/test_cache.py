@@ -0,0 +1,101 @@
+"""
+    Tests of the profile cache of cache.py and of the cache keys of the profiles.
+    > python -m unittest discover -s tests -t . -b
+    """
+
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import backend
+import pyXIFU as px
+from cache import MlProfileCache,ml_cache_key
+
+
+def _ml_profile(para_nb=1,n_points=5):
+    x=np.linspace(-1.,1.,n_points)
+    return {'para_nb':para_nb,'name':'PhoIndex','unit':'','initial_value':0.,'hard_min':-3.,'hard_max':3.,'par_list':x,'cost_list':x**2,
+            'hardcap_hit':[False,False],'n_fits':12,'fitstat':100.,'roots':[None,{2.706:1.645}]}
+
+
+class MlCacheKeyTest(unittest.TestCase):
+    """Keys of the cache."""
+
+    def test_rounding(self):
+        self.assertEqual(ml_cache_key('powerlaw',[1.,2.706]),ml_cache_key('powerlaw',[1.+1e-13,2.706]))
+        self.assertNotEqual(ml_cache_key('powerlaw',[1.,2.706]),ml_cache_key('powerlaw',[1.,2.705]))
+
+    def test_dict_order(self):
+        self.assertEqual(ml_cache_key({'a':1,'b':[2.,3.]}),ml_cache_key(dict([('b',[2.,3.]),('a',1)])))
+
+    def test_profile_keys(self):
+        local=px.ml_set_backend(backend.LocalBackend())
+        local.simulate(n_channels=500,seed=1)
+        settings={'levels':[2.706],'search_method':'steppar'}
+        keys=px.ml_profile_keys(px.ml_snapshot_state('model'),[1,2,3],settings)
+        self.assertEqual(len(set(keys.values())),3)
+        #------ The value of a free parameter is a result of the fit, not an input ------
+        local.set_values({1:1.9})
+        self.assertEqual(px.ml_profile_keys(px.ml_snapshot_state('model'),[1,2,3],settings),keys)
+        self.assertNotEqual(px.ml_profile_keys(px.ml_snapshot_state('model'),[1,2,3],dict(settings,search_method='bracket')),keys)
+        local.freeze(4,True)
+        self.assertNotEqual(px.ml_profile_keys(px.ml_snapshot_state('model'),[1,2,3],settings)[1],keys[1])
+
+
+class MlProfileCacheTest(unittest.TestCase):
+    """Profiles stored in the cache directory and least recently used eviction."""
+
+    def setUp(self):
+        self.directory=tempfile.mkdtemp()
+        self.cache=MlProfileCache(os.path.join(self.directory,'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_and_get(self):
+        self.cache.put('key',_ml_profile())
+        profile=self.cache.get('key')
+        np.testing.assert_array_equal(profile['cost_list'],np.linspace(-1.,1.,5)**2)
+        self.assertEqual(profile['roots'],[None,{2.706:1.645}])
+        self.assertEqual((profile['n_fits'],profile['n_fits_profile'],profile['status'],profile['cached']),(0,12,'done',True))
+        self.assertIsNone(self.cache.get('other'))
+
+    def test_least_recently_used(self):
+        for i,key in enumerate(['a','b','c']):
+            self.cache.put(key,_ml_profile(i+1))
+            os.utime(os.path.join(self.cache.path,key+'.json'),(time.time()-100+i,time.time()-100+i))
+        #------ Reading a profile makes it the most recently used ------
+        self.cache.get('a')
+        entries=self.cache.entries()
+        self.assertEqual([os.path.basename(entry[2]) for entry in entries],['b.json','c.json','a.json'])
+        self.assertEqual(self.cache.evict(entries[1][1]+entries[2][1]),1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('c'))
+        self.assertIsNotNone(self.cache.get('a'))
+
+    def test_rerun(self):
+        #------ A second run of the same model reads every profile and keeps the rows of the first run ------
+        filexcm=os.path.join(self.directory,'model')
+        rows=[]
+        for run in range(2):
+            local=backend.LocalBackend()
+            local.simulate(n_channels=2000,seed=1)
+            local.save(filexcm)
+            if run==1: os.remove(filexcm+'_list.txt')
+            run_stats=px.ml_get_errors(filexcm,'cstat',backend=local,plot_statistic=False,cache=True,cache_dir=self.cache.path,search_method='bracket')
+            with open(filexcm+'_list.txt') as f:
+                rows.append([line for line in f if not line.startswith('#')])
+        self.assertEqual(run_stats['n_cached'],5)
+        self.assertEqual(rows[0],rows[1])
+
+    def test_size_bound(self):
+        cache=MlProfileCache(self.cache.path,max_bytes=1)
+        cache.put('a',_ml_profile())
+        self.assertEqual(cache.entries(),[])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+    Tests of the extraction of the confidence intervals from the sampled profiles.
+    > python -m unittest discover -s tests -t . -b
+    """
+
+
+import unittest
+import numpy as np
+import pyXIFU as px
+
+
+class MlIntervalCrossingsTest(unittest.TestCase):
+    """ml_interval_crossings on profiles whose crossings are known."""
+
+    def test_linear_crossing(self):
+        x=np.array([-2.,-1.,0.,1.,2.])
+        y=np.array([4.,1.,0.,1.,4.])
+        root_min,root_max=px.ml_interval_crossings(x,y,2.5)
+        self.assertAlmostEqual(root_min[0,0],-1.5)
+        self.assertAlmostEqual(root_max[0,0],1.5)
+
+    def test_spline_crossing(self):
+        #------ The not-a-knot cubic spline of a quadratic is the quadratic itself ------
+        x=np.linspace(-3.,3.,13)+0.5
+        root_min,root_max=px.ml_interval_crossings(x,(x-0.5)**2,[1.,2.706],"spline")
+        np.testing.assert_allclose(root_min[0],0.5-np.sqrt([1.,2.706]),atol=1e-9)
+        np.testing.assert_allclose(root_max[0],0.5+np.sqrt([1.,2.706]),atol=1e-9)
+
+    def test_level_not_crossed(self):
+        x=np.array([-1.,0.,1.,2.,3.])
+        y=np.array([0.5,0.,1.,4.,9.])
+        root_min,root_max=px.ml_interval_crossings(x,y,[1.,2.706])
+        self.assertTrue(np.isnan(root_min).all())
+        np.testing.assert_allclose(root_max[0],[1.,1.+(2.706-1.)/3.])
+
+    def test_crossing_closest_to_the_minimum(self):
+        #------ The profile crosses the level again beyond a second minimum ------
+        x=np.array([-2.,-1.,0.,1.,2.,3.,4.])
+        y=np.array([4.,1.,0.,3.,0.5,3.,5.])
+        root_min,root_max=px.ml_interval_crossings(x,y,2.)
+        self.assertAlmostEqual(root_min[0,0],-4./3.)
+        self.assertAlmostEqual(root_max[0,0],2./3.)
+
+    def test_profiles_of_different_lengths(self):
+        x_graph=[np.linspace(-2.,2.,9),np.linspace(-1.,3.,17),np.array([-1.,0.,2.])]
+        y_graph=[x**2 for x in x_graph[:2]]+[np.array([3.,0.,2.])]
+        levels=[1.,2.706]
+        root_min,root_max=px.ml_interval_crossings(x_graph,y_graph,levels)
+        self.assertEqual(root_min.shape,(3,2))
+        for i in range(3):
+            one_min,one_max=px.ml_interval_crossings(x_graph[i],y_graph[i],levels)
+            np.testing.assert_array_equal(root_min[i],one_min[0])
+            np.testing.assert_array_equal(root_max[i],one_max[0])
+        self.assertTrue(np.isnan(root_max[2,1]))
+
+
+class MlFinalizeParameterTest(unittest.TestCase):
+    """Errors of several levels extracted from one profile by ml_finalize_parameter."""
+
+    def profile(self,**fields):
+        x=np.linspace(-3.,3.,25)
+        profile={'para_nb':1,'name':'PhoIndex','unit':'','initial_value':0.,'hard_min':-10.,'hard_max':10.,
+                 'par_list':x,'cost_list':x**2,'hardcap_hit':[False,False],'roots':[None,None]}
+        profile.update(fields)
+        return profile
+
+    def test_levels(self):
+        err_min,err_max=px.ml_finalize_parameter(self.profile(),'model','cstat',[1.,4.],plot_statistic=False)
+        np.testing.assert_allclose(err_min,[1.,2.])
+        np.testing.assert_allclose(err_max,[1.,2.])
+
+    def test_single_level(self):
+        err_min,err_max=px.ml_finalize_parameter(self.profile(),'model','cstat',4.,plot_statistic=False)
+        self.assertEqual(np.ndim(err_min),0)
+        self.assertAlmostEqual(err_max,2.)
+
+    def test_search_crossings_replace_the_interpolation(self):
+        profile=self.profile(roots=[{1.:-0.9},{1.:1.1,4.:2.05}])
+        err_min,err_max=px.ml_finalize_parameter(profile,'model','cstat',[1.,4.],plot_statistic=False)
+        np.testing.assert_allclose(err_min,[0.9,2.])
+        np.testing.assert_allclose(err_max,[1.1,2.05])
+
+    def test_hard_cap(self):
+        x=np.linspace(0.,3.,13)
+        profile=self.profile(par_list=x,cost_list=x**2,hard_min=0.,hardcap_hit=[True,False])
+        err_min,err_max=px.ml_finalize_parameter(profile,'model','cstat',[1.,4.],plot_statistic=False)
+        np.testing.assert_allclose(err_min,[0.,0.])
+        np.testing.assert_allclose(err_max,[1.,2.])
+
+
+if __name__ == '__main__':
+    unittest.main()
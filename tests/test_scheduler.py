@@ -0,0 +1,55 @@
+"""
+    Tests of the split of a core budget by MlCoreScheduler (scheduler.py).
+    > python -m unittest discover -s tests -t . -b
+    """
+
+
+import unittest
+from scheduler import MlCoreScheduler
+
+
+class MlCoreSchedulerTest(unittest.TestCase):
+    """Calibration, shares of the busy workers and plan of the workers."""
+
+    def test_parallel_fraction(self):
+        #------ t(8) = t(1) ((1-p) + p/8) with p = 0.8 ------
+        scheduler=MlCoreScheduler(16,12,1.,0.3,8)
+        self.assertAlmostEqual(scheduler.parallel_fraction,0.8)
+        self.assertAlmostEqual(scheduler.fit_time(4),0.4)
+        #------ The parallel fit does not use more cores than free parameters ------
+        self.assertEqual(scheduler.fit_time(50),scheduler.fit_time(12))
+
+    def test_without_calibration(self):
+        scheduler=MlCoreScheduler(8,5)
+        self.assertEqual(scheduler.parallel_fraction,0.)
+        self.assertEqual(scheduler.plan(5),(5,1))
+
+    def test_shares_within_budget(self):
+        scheduler=MlCoreScheduler(10,20,1.,0.2,8)
+        for n_running in range(1,11):
+            shares=[scheduler.share(n_running,rank) for rank in range(n_running)]
+            self.assertEqual(sum(shares),10)
+            self.assertLessEqual(max(shares)-min(shares),1)
+
+    def test_shares_bounded_by_free_parameters(self):
+        scheduler=MlCoreScheduler(16,3,1.,0.4,3)
+        self.assertEqual(scheduler.share(1),3)
+
+    def test_plan(self):
+        #------ A serial fit: one worker per parameter up to the budget ------
+        self.assertEqual(MlCoreScheduler(16,12,1.,1.,8).plan(12),(12,1))
+        #------ A parallel fit with few parameters: the cores left go to the parallel fit ------
+        n_workers,n_cores=MlCoreScheduler(16,12,1.,0.15,8).plan(2)
+        self.assertEqual(n_workers,2)
+        self.assertEqual(n_cores,8)
+        #------ The cores of the planned workers never exceed the budget ------
+        scheduler=MlCoreScheduler(16,12,1.,0.3,8)
+        for n_tasks in range(1,40):
+            n_workers,n_cores=scheduler.plan(n_tasks)
+            self.assertLessEqual(n_workers,min(n_tasks,16))
+            self.assertLessEqual(sum([scheduler.share(n_workers,rank) for rank in range(n_workers)]),16)
+            self.assertEqual(n_cores,scheduler.share(n_workers,n_workers-1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+"""
+    Tests of the profile searches of pyXIFU run with the LocalBackend of backend.py (no XSPEC needed).
+    > python -m unittest discover -s tests -t . -b
+    """
+
+
+import os
+import signal
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import backend
+import pyXIFU as px
+from store import ml_load_results
+
+
+class _MlTimeout(Exception):
+    pass
+
+
+def _ml_raise_timeout(signum,frame):
+    raise _MlTimeout()
+
+
+class MlWarmStartValuesTest(unittest.TestCase):
+    """Starting values predicted by ml_warm_start_values from the previous points of a profile."""
+
+    snapshot={'pars':[{'values':[1.,0.01,0.,0.,10.,10.]},{'values':[2.,0.01,0.,0.,2.5,2.5]},{'values':[3.,0.01,-5.,-5.,5.,5.]}]}
+
+    def test_no_history(self):
+        self.assertIsNone(px.ml_warm_start_values(self.snapshot,1,1.5,[]))
+
+    def test_closest_point(self):
+        history=[(1.2,{2:2.1,3:3.1},0.5),(1.6,{2:2.3,3:3.3},2.),(1.4,{2:2.2,3:3.2},1.)]
+        self.assertEqual(px.ml_warm_start_values(self.snapshot,1,1.45,history),{2:2.2,3:3.2})
+
+    def test_extrapolation(self):
+        history=[(1.2,{2:2.1,3:3.1},0.5),(1.4,{2:2.2,3:2.9},1.)]
+        start_values=px.ml_warm_start_values(self.snapshot,1,1.6,history,extrapolate=True)
+        self.assertAlmostEqual(start_values[2],2.3)
+        self.assertAlmostEqual(start_values[3],2.7)
+
+    def test_extrapolation_within_hard_limits(self):
+        history=[(1.2,{2:2.,3:3.},0.5),(1.4,{2:2.4,3:3.},1.)]
+        start_values=px.ml_warm_start_values(self.snapshot,1,2.,history,extrapolate=True)
+        self.assertEqual(start_values[2],2.5)
+
+
+class MlSearchTest(unittest.TestCase):
+    """Error runs on synthetic spectra, each run must end within timeout seconds."""
+
+    timeout=120
+
+    def setUp(self):
+        self.directory=tempfile.mkdtemp()
+        signal.signal(signal.SIGALRM,_ml_raise_timeout)
+
+    def tearDown(self):
+        signal.alarm(0)
+        shutil.rmtree(self.directory)
+
+    def run_errors(self,lines,seed,n_channels=2000,**options):
+        local=backend.LocalBackend()
+        local.simulate(n_channels=n_channels,lines=lines,seed=seed)
+        filexcm=os.path.join(self.directory,'model')
+        local.save(filexcm)
+        signal.alarm(self.timeout)
+        try:
+            run_stats=px.ml_get_errors(filexcm,'cstat',backend=local,plot_statistic=False,**options)
+        except _MlTimeout:
+            self.fail('The error run did not end within '+str(self.timeout)+' s')
+        finally:
+            signal.alarm(0)
+        return run_stats
+
+    def results(self):
+        return ml_load_results(os.path.join(self.directory,'model_list.txt'))
+
+    def dstat_at(self,para_nb,par_value):
+        #------ Delta statistic of a constrained fit from the best fit saved by the run ------
+        filexcm=os.path.join(self.directory,'model')
+        local=px.ml_get_backend()
+        local.restore(filexcm)
+        fitstatmin=local.statistic()
+        scan={'n_fits':0,'n_restore':0,'n_disk_restore':0,'t_restore':0.,'t_fit':0.}
+        return px.ml_constrained_fit(px.ml_snapshot_state(filexcm),para_nb,par_value,scan)-fitstatmin
+
+    def test_warm_start_keeps_new_best_fit(self):
+        #------ The warm start finds a new best fit that the fit from the best fit misses ------
+        run_stats=self.run_errors([(6.4,0.02,1e-4),(3.,0.02,5e-5)],2,warm_start=True,search_method='bracket')
+        self.assertEqual(run_stats['n_parameters'],8)
+        self.assertLess(run_stats['n_fits'],400)
+
+    def test_warm_start_step_reduction(self):
+        #------ The reduced steps of steppar must not start from the far point they replace ------
+        run_stats=self.run_errors([(6.4,0.02,1e-4),(3.,0.02,5e-5)],2,warm_start=True)
+        self.assertEqual(run_stats['n_parameters'],8)
+        self.assertLess(run_stats['n_fits'],1000)
+
+    def test_bracket_lower_levels(self):
+        #------ On the nearly parabolic PhoIndex profile the crossings scale as sqrt(level) ------
+        self.run_errors([(6.4,0.01,1e-4)],1,n_channels=20000,selection=[1],level=[1.,2.706],search_method='bracket')
+        row=self.results()[0]
+        for side in ['min','max']:
+            ratio=row['error_'+side+'_1.0']/row['error_'+side+'_2.706']
+            self.assertAlmostEqual(ratio,np.sqrt(1./2.706),delta=0.02)
+
+    def test_parabolic_fallback_lower_levels(self):
+        #------ The line norm is not parabolic, its lower level comes from the bracket fallback ------
+        self.run_errors([(6.4,0.01,1e-4)],1,n_channels=20000,selection=[5],level=[1.,2.706],search_method='parabolic')
+        row=self.results()[0]
+        self.assertAlmostEqual(self.dstat_at(5,row['best_fit_value']-row['error_min_1.0']),1.,delta=0.1)
+        self.assertAlmostEqual(self.dstat_at(5,row['best_fit_value']+row['error_max_1.0']),1.,delta=0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
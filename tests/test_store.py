@@ -0,0 +1,89 @@
+"""
+    Tests of the profile buffers and of the results table of store.py.
+    > python -m unittest discover -s tests -t . -b
+    """
+
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pyXIFU as px
+from store import MlProfileBuffer,ml_load_results
+
+
+class MlProfileBufferTest(unittest.TestCase):
+    """Points of a profile kept in a growable buffer."""
+
+    def test_grow(self):
+        points=MlProfileBuffer(capacity=2)
+        for i in range(5):
+            points.append(float(i),float(i**2))
+        self.assertEqual(len(points),5)
+        np.testing.assert_array_equal(points.par_list,[0.,1.,2.,3.,4.])
+        np.testing.assert_array_equal(points.cost_list,[0.,1.,4.,9.,16.])
+
+    def test_extend_and_clear(self):
+        points,other=MlProfileBuffer(capacity=1),MlProfileBuffer(capacity=1)
+        points.append(0.,0.)
+        for i in range(1,4):
+            other.append(-float(i),float(i))
+        points.extend(other)
+        np.testing.assert_array_equal(points.par_list,[0.,-1.,-2.,-3.])
+        points.clear()
+        self.assertEqual(len(points),0)
+        points.append(5.,1.)
+        np.testing.assert_array_equal(points.par_list,[5.])
+
+    def test_sorted(self):
+        points=MlProfileBuffer()
+        for par_value,dstat in [(0.,0.),(-1.,1.),(2.,4.),(1.,1.5)]:
+            points.append(par_value,dstat)
+        par_list,cost_list=points.sorted()
+        np.testing.assert_array_equal(par_list,[-1.,0.,1.,2.])
+        np.testing.assert_array_equal(cost_list,[1.,0.,1.5,4.])
+        #------ The sorted arrays are copies, the buffer keeps its order ------
+        par_list[0]=10.
+        self.assertEqual(points.par_list[1],-1.)
+
+
+class MlResultsTableTest(unittest.TestCase):
+    """Rows of the errors appended to <model>_list.txt and read again by a restarted run."""
+
+    header='para_nb name best_fit_value error_min error_max hard_min_hit hard_max_hit'
+
+    def setUp(self):
+        self.directory=tempfile.mkdtemp()
+        self.filename=os.path.join(self.directory,'model_list.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_append_and_load(self):
+        table=px.ml_results_table(self.filename,[1.,2.706],1)
+        table.write_header('para_nb name best_fit_value error_min_1.0 error_max_1.0 error_min_2.706 error_max_2.706 hard_min_hit hard_max_hit')
+        table.append((1,'PhoIndex',1.7,0.01,0.011,0.02,0.021,False,False))
+        table.append((3,'LineE',6.4,0.001,0.002,0.003,0.004,False,True))
+        self.assertEqual(len(table),2)
+        loaded=px.ml_results_table(self.filename,[1.,2.706],1)
+        self.assertTrue(loaded.load())
+        np.testing.assert_array_equal(loaded.rows['para_nb'].flatten(),[1,3])
+        rows=ml_load_results(self.filename)
+        self.assertEqual([row['name'] for row in rows],['PhoIndex','LineE'])
+        self.assertAlmostEqual(rows[1]['error_max_2.706'],0.004)
+
+    def test_reset(self):
+        table=px.ml_results_table(self.filename,2.706,2)
+        table.write_header(self.header)
+        table.append((1,'PhoIndex',1.7,0.01,0.011,False,False))
+        table.reset(self.header)
+        self.assertEqual(len(table),0)
+        self.assertEqual(ml_load_results(self.filename),[])
+
+    def test_load_missing_file(self):
+        self.assertFalse(px.ml_results_table(self.filename,2.706,1).load())
+
+
+if __name__ == '__main__':
+    unittest.main()